@@ -147,14 +147,24 @@ class EntryExtractionHandler:
 
         try:
             if url:
-                structured_text = json.loads(requests.get(url, timeout=30).content)
+                # An expired url or an s3 error is an HTTPError, not an invalid json
+                response = requests.get(url, timeout=30)
+                response.raise_for_status()
+                structured_text = response.json()
 
             elif text_extraction_id:
-                response = s3_client.get_object(
-                    Bucket=self.bucket_name,
-                    Key=f"textextraction/structured/{text_extraction_id}/{filename}",
+                # The text extraction outputs are gzip encoded, the http download decodes them
+                structured_text_url = s3_client_presigned_url.generate_presigned_url(
+                    "get_object",
+                    Params={
+                        "Bucket": self.bucket_name,
+                        "Key": f"textextraction/structured/{text_extraction_id}/{filename}",
+                    },
+                    ExpiresIn=60,
                 )
-                structured_text = json.loads(response["Body"].read())
+                response = requests.get(structured_text_url, timeout=30)
+                response.raise_for_status()
+                structured_text = response.json()
             else:
                 logging.error(
                     "The url or text_extraction_id is missing. Extraction failed."
@@ -1,34 +1,58 @@
 import asyncio
 import copy
+import functools
 import json
 import logging
 import operator
 import os
 import shutil
+import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 import boto3
 import sentry_sdk
+from batches import Batch, BatchRegistry, BatchStatus, current_batch
 from botocore.client import Config
+from botocore.exceptions import ClientError
 from content_types import ExtractContentType, UrlTypes
+from converters import LambdaConverter, LibreOfficeConverter
 from deep_parser import TextFromFile, TextFromWeb
 from deep_parser.helpers.errors import ScannedDocumentError
-from fastapi import BackgroundTasks, FastAPI
-from nlp_modules_utils import (Database, StateHandler, generate_presigned_url,
+from fastapi import FastAPI, HTTPException
+from http_client import http_client
+from image_dedup import DocumentImages, ImageIndex
+from nlp_modules_utils import (Database, StateHandler,
                                prepare_sql_statement_failure,
                                prepare_sql_statement_success,
                                send_request_on_callback, status_update_db,
                                update_db_table_callback_retry, upload_to_s3)
 from ocr_extractor import OCRProcessor
+from ocr_pool import (DOCUMENT_EXTRACTION_TYPE, PAGE_ENGINE_CONFIG,
+                      TABLE_EXTRACTION_TYPE, OCRWorkerPool, engine_config)
+from page_stream import (StructuredPageWriter, copy_page_stream,
+                         finish_page_stream)
+from parallel_extraction import (PageRangeExtraction, count_pdf_pages,
+                                 find_scanned_pages, render_pages)
 from pydantic import BaseModel
-from s3handler import Storage
-from utils import (beautify_extracted_text, create_async_tempfile,
-                   filter_file_by_size, get_words_count,
-                   handle_scanned_doc_or_image, invoke_conversion_lambda,
-                   preprocess_extracted_texts, uploadfile_s3)
+from result_cache import ExtractionResultCache, s3_key_from_presigned_url
+from scheduler import (FairShareScheduler, SchedulerSaturated,
+                       default_max_concurrency)
+from sqs_consumer import SQSConsumerPool
+from s3handler import put_gzip_object
+from text_assembler import (ARTIFACTS_COMPRESSION_ENABLED,
+                            StructuredTextAssembler, TextAssembler)
+from timings import job_timings, span, stage_metrics, tag_job
+from utils import (download_document, filter_file_by_size,
+                   get_words_count,
+                   handle_scanned_doc_or_image, normalize_url, ocr_page_texts,
+                   ocr_pages, preprocess_extracted_texts, presign_s3_key,
+                   uploadfile_s3)
+from web_sessions import WebSessionPool
+from webpage_cache import WebpageCache
 
 logging.getLogger().setLevel(logging.INFO)
 
@@ -37,6 +61,77 @@ ENVIRONMENT = os.environ.get("ENVIRONMENT")
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 SQS_QUEUE_URL = os.environ.get("SQS_QUEUE_URL")
 CLOUDFLARE_PROXY_SERVER_HOST = os.environ.get("CLOUDFLARE_PROXY_SERVER_HOST")
+SQS_CONSUMER_CONCURRENCY = int(os.environ.get("SQS_CONSUMER_CONCURRENCY", 4))
+SQS_VISIBILITY_TIMEOUT_SECS = int(os.environ.get("SQS_VISIBILITY_TIMEOUT_SECS", 120))
+TABLE_EXTRACTION_TIMEOUT_SECS = int(os.environ.get("TABLE_EXTRACTION_TIMEOUT_SECS", 180))
+# Documents with at least PDF_PARALLEL_MIN_PAGES are extracted in page ranges (0 disables it)
+PDF_PAGE_CHUNK_SIZE = int(os.environ.get("PDF_PAGE_CHUNK_SIZE", 50))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 100))
+PDF_CHUNK_TIMEOUT_SECS = int(os.environ.get("PDF_CHUNK_TIMEOUT_SECS", 120))
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+STREAMING_OUTPUT_ENABLED = os.environ.get("STREAMING_OUTPUT_ENABLED", "false").lower() == "true"
+IMAGE_UPLOAD_CONCURRENCY = int(os.environ.get("IMAGE_UPLOAD_CONCURRENCY", 8))
+# Images within IMAGE_DEDUP_MAX_DISTANCE bits of perceptual hash are uploaded once (-1 disables it)
+IMAGE_DEDUP_MAX_DISTANCE = int(os.environ.get("IMAGE_DEDUP_MAX_DISTANCE", 4))
+# Images uploaded for the earlier documents of the client are reused (0 disables the index)
+IMAGE_INDEX_MAX_ENTRIES = int(os.environ.get("IMAGE_INDEX_MAX_ENTRIES", 2000))
+# Must stay below the retention of the images in the bucket
+IMAGE_INDEX_TTL_SECS = int(os.environ.get("IMAGE_INDEX_TTL_SECS", 86400))
+# Pages with images and less than SCANNED_PAGE_MIN_CHARS characters of text are OCRed
+SCANNED_PAGE_MIN_CHARS = int(os.environ.get("SCANNED_PAGE_MIN_CHARS", 20))
+OCR_PAGE_CONCURRENCY = int(os.environ.get("OCR_PAGE_CONCURRENCY", 2))
+OCR_PAGE_DPI = int(os.environ.get("OCR_PAGE_DPI", 200))
+# Long-lived OCR worker processes (0 runs the OCR in the task, OCR_PAGE_CONCURRENCY pages at a time)
+OCR_POOL_WORKERS = int(os.environ.get("OCR_POOL_WORKERS", 2))
+OCR_PAGE_TIMEOUT_SECS = int(os.environ.get("OCR_PAGE_TIMEOUT_SECS", 120))
+OCR_DOCUMENT_TIMEOUT_SECS = int(os.environ.get("OCR_DOCUMENT_TIMEOUT_SECS", 900))
+# The table OCR of the pdfs has its own workers, so that it doesn't wait for the scanned pages
+OCR_TABLE_WORKERS = int(os.environ.get("OCR_TABLE_WORKERS", 1))
+# The table OCR waiting longer for a worker is skipped (the timeout starts with the OCR)
+OCR_TABLE_QUEUE_TIMEOUT_SECS = int(os.environ.get("OCR_TABLE_QUEUE_TIMEOUT_SECS", 300))
+# The page by page OCR of the scanned pdfs skips the images (figure crops)
+OCR_SCANNED_PDF_BY_PAGE = os.environ.get("OCR_SCANNED_PDF_BY_PAGE", "false").lower() == "true"
+EXTRACTION_CACHE_ENABLED = os.environ.get("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_TTL_SECS = int(os.environ.get("EXTRACTION_CACHE_TTL_SECS", 7 * 86400))
+# 0 derives the max concurrent extractions from the CPUs and the memory of the task
+MAX_CONCURRENT_EXTRACTIONS = int(os.environ.get("MAX_CONCURRENT_EXTRACTIONS", 0))
+EXTRACTION_MEMORY_PER_JOB_MB = int(os.environ.get("EXTRACTION_MEMORY_PER_JOB_MB", 512))
+EXTRACTIONS_PER_CPU = int(os.environ.get("EXTRACTIONS_PER_CPU", 2))
+MAX_QUEUED_EXTRACTIONS = int(os.environ.get("MAX_QUEUED_EXTRACTIONS", 100))
+MAX_QUEUED_EXTRACTIONS_PER_CLIENT = int(os.environ.get("MAX_QUEUED_EXTRACTIONS_PER_CLIENT", 20))
+USER_REQUEST_WEIGHT = int(os.environ.get("USER_REQUEST_WEIGHT", 4))
+SYSTEM_REQUEST_WEIGHT = int(os.environ.get("SYSTEM_REQUEST_WEIGHT", 1))
+MEMORY_HIGH_WATERMARK = float(os.environ.get("MEMORY_HIGH_WATERMARK", 0.85))
+SCHEDULER_METRICS_NAMESPACE = os.environ.get("SCHEDULER_METRICS_NAMESPACE", "TextExtraction")
+SCHEDULER_METRICS_INTERVAL_SECS = int(os.environ.get("SCHEDULER_METRICS_INTERVAL_SECS", 60))
+DOCS_CONVERSION_CONCURRENCY = int(os.environ.get("DOCS_CONVERSION_CONCURRENCY", 8))
+DOCS_CONVERTER_BACKEND = os.environ.get("DOCS_CONVERTER_BACKEND", LambdaConverter.name)
+LIBREOFFICE_POOL_SIZE = int(os.environ.get("LIBREOFFICE_POOL_SIZE", 2))
+LIBREOFFICE_TIMEOUT_SECS = int(os.environ.get("LIBREOFFICE_TIMEOUT_SECS", 120))
+HTML_EXTRACTION_CONCURRENCY = int(os.environ.get("HTML_EXTRACTION_CONCURRENCY", 2))
+HTML_EXTRACTION_TIMEOUT_SECS = int(os.environ.get("HTML_EXTRACTION_TIMEOUT_SECS", 120))
+# A browser session is recycled after HTML_SESSION_MAX_USES pages (1 disables the reuse)
+HTML_SESSION_MAX_USES = int(os.environ.get("HTML_SESSION_MAX_USES", 20))
+HTML_SESSION_WARMUP_URL = os.environ.get("HTML_SESSION_WARMUP_URL")
+WEBPAGE_CACHE_ENABLED = os.environ.get("WEBPAGE_CACHE_ENABLED", "true").lower() == "true"
+WEBPAGE_CACHE_MAX_ENTRIES = int(os.environ.get("WEBPAGE_CACHE_MAX_ENTRIES", 500))
+WEBPAGE_CACHE_MAX_MB = int(os.environ.get("WEBPAGE_CACHE_MAX_MB", 64))
+WEBPAGE_CACHE_TTL_SECS = int(os.environ.get("WEBPAGE_CACHE_TTL_SECS", 86400))
+# Concurrent requests of the same url share a single extraction
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 1000))
+# Items of the batches queued in the scheduler or running at a time, across the
+# batches (0 is the max concurrent extractions)
+BATCH_MAX_IN_FLIGHT = int(os.environ.get("BATCH_MAX_IN_FLIGHT", 0))
+# Items of the batches waiting for a slot, the batches beyond it are refused (429)
+MAX_QUEUED_BATCH_ITEMS = int(os.environ.get("MAX_QUEUED_BATCH_ITEMS", 5000))
+BATCH_DB_FLUSH_SIZE = int(os.environ.get("BATCH_DB_FLUSH_SIZE", 50))
+BATCH_DB_FLUSH_SECS = int(os.environ.get("BATCH_DB_FLUSH_SECS", 5))
+BATCH_RETENTION_SECS = int(os.environ.get("BATCH_RETENTION_SECS", 3600))
+STAGE_METRICS_INTERVAL_SECS = int(os.environ.get("STAGE_METRICS_INTERVAL_SECS", 60))
+STAGE_METRICS_NAMESPACE = os.environ.get("STAGE_METRICS_NAMESPACE", "TextExtraction")
+# Stores the per-stage timings of every job next to its extracted text
+JOB_TIMINGS_UPLOAD_ENABLED = os.environ.get("JOB_TIMINGS_UPLOAD_ENABLED", "false").lower() == "true"
 
 sentry_sdk.init(
     SENTRY_DSN, environment=ENVIRONMENT, attach_stacktrace=True, traces_sample_rate=1.0
@@ -52,9 +147,20 @@ s3_client_presigned_url = boto3.client(
 lambda_client = boto3.client(
     "lambda",
     region_name=AWS_REGION,
-    config=Config(read_timeout=120, connect_timeout=600, tcp_keepalive=True),
+    config=Config(
+        read_timeout=120,
+        connect_timeout=600,
+        tcp_keepalive=True,
+        max_pool_connections=DOCS_CONVERSION_CONCURRENCY,
+    ),
+)
+# The conversions wait up to the lambda read timeout, their own threads keep them
+# from using up the default executor shared by the other blocking calls.
+docs_conversion_executor = ThreadPoolExecutor(
+    max_workers=DOCS_CONVERSION_CONCURRENCY, thread_name_prefix="docs-conversion"
 )
 sqs_client = boto3.client("sqs", region_name=AWS_REGION)
+cloudwatch_client = boto3.client("cloudwatch", region_name=AWS_REGION)
 
 
 class RequestType(Enum):
@@ -74,54 +180,104 @@ class RequestSchema(BaseModel):
     request_type: int
 
 
+class BatchItemSchema(BaseModel):
+    """Batch Item Schema"""
+
+    url: str
+    textextraction_id: str
+    callback_url: Optional[str] = None
+
+
+class BatchRequestSchema(BaseModel):
+    """Batch Request Schema"""
+
+    client_id: str
+    items: List[BatchItemSchema]
+    request_type: int = RequestType.SYSTEM.value
+
+
 ecs_app = FastAPI()
 
 
-async def fifo_worker():
-    """Handles the queue for non-priority requests"""
-    logging.info("Starting the FIFO Worker")
-    while True:
-        sqs_response = sqs_client.receive_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageAttributeNames=[
-                "url",
-                "client_id",
-                "textextraction_id",
-                "callback_url",
-            ],
-            MaxNumberOfMessages=1,
-            VisibilityTimeout=5,
-            WaitTimeSeconds=0,
-        )
-        if "Messages" in sqs_response:
-            logging.info("Receiving the request message from the AWS Queue")
-
-            receipt_handle = sqs_response["Messages"][0]["ReceiptHandle"]
-            url = sqs_response["Messages"][0]["MessageAttributes"]["url"]["StringValue"]
-            callback_url = sqs_response["Messages"][0]["MessageAttributes"][
-                "callback_url"
-            ]["StringValue"]
-            textextraction_id = sqs_response["Messages"][0]["MessageAttributes"][
-                "textextraction_id"
-            ]["StringValue"]
-            client_id = sqs_response["Messages"][0]["MessageAttributes"]["client_id"][
-                "StringValue"
-            ]
-
-            await asyncio.ensure_future(
-                text_extraction_handler(client_id, url, textextraction_id, callback_url)
-            )
-            sqs_client.delete_message(
-                QueueUrl=SQS_QUEUE_URL, ReceiptHandle=receipt_handle
-            )
-        else:
-            await asyncio.sleep(10)
+scheduler = FairShareScheduler(
+    max_concurrency=(
+        MAX_CONCURRENT_EXTRACTIONS or
+        default_max_concurrency(EXTRACTION_MEMORY_PER_JOB_MB, EXTRACTIONS_PER_CPU)
+    ),
+    max_queued=MAX_QUEUED_EXTRACTIONS,
+    max_queued_per_client=MAX_QUEUED_EXTRACTIONS_PER_CLIENT,
+    weights={
+        RequestType.USER.value: USER_REQUEST_WEIGHT,
+        RequestType.SYSTEM.value: SYSTEM_REQUEST_WEIGHT,
+    },
+    memory_high_watermark=MEMORY_HIGH_WATERMARK,
+)
+
+batch_registry = BatchRegistry(retention=BATCH_RETENTION_SECS)
+batch_slots = asyncio.Semaphore(BATCH_MAX_IN_FLIGHT or scheduler.max_concurrency)
+
+# The queued requests share the workers of the scheduler with the user requests
+sqs_consumer_pool = SQSConsumerPool(
+    sqs_client=sqs_client,
+    queue_url=SQS_QUEUE_URL,
+    handler=lambda client_id, *args: scheduler.run(
+        client_id, RequestType.SYSTEM.value, text_extraction_handler, client_id, *args
+    ),
+    message_attribute_names=[
+        "url",
+        "client_id",
+        "textextraction_id",
+        "callback_url",
+    ],
+    concurrency=SQS_CONSUMER_CONCURRENCY,
+    visibility_timeout=SQS_VISIBILITY_TIMEOUT_SECS,
+)
 
 
 @ecs_app.on_event("startup")
 async def start_db():
     """Creates task during startup"""
-    asyncio.create_task(fifo_worker())
+    logging.info("Starting the FIFO Worker")
+    asyncio.create_task(scheduler.dispatch())
+    asyncio.create_task(
+        scheduler.publish_metrics(
+            cloudwatch_client,
+            namespace=SCHEDULER_METRICS_NAMESPACE,
+            environment=ENVIRONMENT,
+            interval=SCHEDULER_METRICS_INTERVAL_SECS,
+        )
+    )
+    asyncio.create_task(
+        stage_metrics.publish(
+            cloudwatch_client,
+            namespace=STAGE_METRICS_NAMESPACE,
+            environment=ENVIRONMENT,
+            interval=STAGE_METRICS_INTERVAL_SECS,
+        )
+    )
+    if text_extraction_handler.webpage_cache:
+        asyncio.create_task(
+            text_extraction_handler.webpage_cache.publish_metrics(
+                cloudwatch_client,
+                namespace=STAGE_METRICS_NAMESPACE,
+                environment=ENVIRONMENT,
+                interval=STAGE_METRICS_INTERVAL_SECS,
+            )
+        )
+    asyncio.create_task(sqs_consumer_pool.run())
+    asyncio.create_task(text_extraction_handler.converter.start())
+    asyncio.create_task(text_extraction_handler.web_sessions.start(HTML_SESSION_WARMUP_URL))
+    for ocr_pool in (text_extraction_handler.ocr_pool, text_extraction_handler.table_ocr_pool):
+        if ocr_pool:
+            asyncio.create_task(ocr_pool.start())
+            asyncio.create_task(
+                ocr_pool.publish_metrics(
+                    cloudwatch_client,
+                    namespace=STAGE_METRICS_NAMESPACE,
+                    environment=ENVIRONMENT,
+                    interval=STAGE_METRICS_INTERVAL_SECS,
+                )
+            )
 
 
 @ecs_app.get("/")
@@ -130,6 +286,50 @@ def home():
     return "This is Text Extraction ECS Task"
 
 
+@ecs_app.on_event("shutdown")
+async def close_http_client():
+    """Closes the pooled http connections"""
+    await http_client.aclose()
+    await text_extraction_handler.converter.close()
+    text_extraction_handler.web_sessions.close()
+    for ocr_pool in (text_extraction_handler.ocr_pool, text_extraction_handler.table_ocr_pool):
+        if ocr_pool:
+            ocr_pool.close()
+
+
+@ecs_app.get("/stats")
+async def stats():
+    """Runtime metrics of the task"""
+    return {
+        "http_client": http_client.stats(),
+        "scheduler": scheduler.stats(),
+        "converter": text_extraction_handler.converter.stats(),
+        "html_sessions": text_extraction_handler.web_sessions.stats(),
+        "single_flight": text_extraction_handler.single_flight_stats(),
+        "image_index": (
+            text_extraction_handler.image_index.stats()
+            if text_extraction_handler.image_index
+            else None
+        ),
+        "ocr_pool": (
+            text_extraction_handler.ocr_pool.stats()
+            if text_extraction_handler.ocr_pool
+            else None
+        ),
+        "table_ocr_pool": (
+            text_extraction_handler.table_ocr_pool.stats()
+            if text_extraction_handler.table_ocr_pool
+            else None
+        ),
+        "batches": batch_registry.stats(),
+        "webpage_cache": (
+            text_extraction_handler.webpage_cache.stats()
+            if text_extraction_handler.webpage_cache
+            else None
+        ),
+    }
+
+
 @ecs_app.get("/healthcheck")
 async def healthcheckup():
     """Health check up endpoint"""
@@ -137,7 +337,7 @@ async def healthcheckup():
 
 
 @ecs_app.post("/extract_document")
-async def extract_texts(item: RequestSchema, background_tasks: BackgroundTasks):
+async def extract_texts(item: RequestSchema):
     """Generate reports"""
     client_id = item.client_id
     url = item.url
@@ -165,14 +365,134 @@ async def extract_texts(item: RequestSchema, background_tasks: BackgroundTasks):
             MessageAttributes=sqs_message_attributes,
         )
     else:
+        try:
+            scheduler.submit(
+                client_id,
+                RequestType.USER.value,
+                text_extraction_handler,
+                client_id,
+                url,
+                textextraction_id,
+                callback_url,
+            )
+        except SchedulerSaturated as exc:
+            logging.warning("Request %s is not admitted. %s", textextraction_id, str(exc))
+            raise HTTPException(
+                status_code=429,
+                detail=str(exc),
+                headers={"Retry-After": str(exc.retry_after)},
+            )
         logging.info("Background task initiated.")
-        background_tasks.add_task(
-            text_extraction_handler, client_id, url, textextraction_id, callback_url
-        )
 
     return {"message": "Task received and running in background."}
 
 
+async def run_batch_item(batch: Batch, item: BatchItemSchema):
+    """Extraction job of a batch item, its dispatch uses the resources of the batch"""
+    current_batch.set(batch)
+    batch.set_status(item.textextraction_id, BatchStatus.RUNNING)
+    await text_extraction_handler(
+        batch.client_id, item.url, item.textextraction_id, item.callback_url
+    )
+
+
+async def flush_batch_periodically(batch: Batch):
+    while True:
+        await batch.wait_flush(BATCH_DB_FLUSH_SECS)
+        await asyncio.to_thread(batch.flush)
+
+
+async def submit_batch_item(batch: Batch, item: BatchItemSchema, request_type: int):
+    """Queues the item within the admission limits of the scheduler, waits while it is full"""
+    while True:
+        try:
+            return scheduler.submit(batch.client_id, request_type, run_batch_item, batch, item)
+        except SchedulerSaturated as exc:
+            logging.info(
+                "Item %s of the batch %s is not admitted yet. %s",
+                item.textextraction_id,
+                batch.batch_id,
+                str(exc),
+            )
+            await asyncio.sleep(exc.retry_after)
+
+
+async def run_batch(batch: Batch, items: list, request_type: int):
+    """
+    Feeds the items to the scheduler through its admission limits. The batches share
+    BATCH_MAX_IN_FLIGHT slots, so that they share the workers (and the fair share)
+    with the other requests without filling the scheduler queue.
+    """
+    flush_task = asyncio.create_task(flush_batch_periodically(batch))
+
+    async def run_item(item):
+        try:
+            await (await submit_batch_item(batch, item, request_type))
+        finally:
+            batch_slots.release()
+
+    tasks = []
+    try:
+        for item in items:
+            await batch_slots.acquire()
+            tasks.append(asyncio.create_task(run_item(item)))
+        await asyncio.gather(*tasks)
+    finally:
+        flush_task.cancel()
+        await asyncio.to_thread(batch.close)
+    logging.info("Batch %s of %s items is finished.", batch.batch_id, len(items))
+
+
+@ecs_app.post("/extract_documents")
+async def extract_documents(batch_request: BatchRequestSchema):
+    """Bulk extraction, the progress of the items is returned by GET /extract_documents/{batch_id}"""
+    if not batch_request.items:
+        raise HTTPException(status_code=400, detail="The batch has no items.")
+    if len(batch_request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The batch has more than {MAX_BATCH_SIZE} items.",
+        )
+    textextraction_ids = [item.textextraction_id for item in batch_request.items]
+    if len(set(textextraction_ids)) < len(textextraction_ids):
+        raise HTTPException(
+            status_code=422,
+            detail="The textextraction_id of the batch items must be unique.",
+        )
+    queued_items = batch_registry.stats()["queued_items"]
+    if queued_items + len(batch_request.items) > MAX_QUEUED_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many queued batch items ({queued_items}).",
+            headers={"Retry-After": str(scheduler.retry_after())},
+        )
+    batch = Batch(
+        batch_request.client_id,
+        batch_request.items,
+        db_connect=lambda: Database(**text_extraction_handler.db_config).db_connection(),
+        flush_size=BATCH_DB_FLUSH_SIZE,
+    )
+    batch_registry.add(
+        batch,
+        asyncio.create_task(
+            run_batch(batch, batch_request.items, batch_request.request_type)
+        ),
+    )
+    logging.info(
+        "Batch %s of %s items received.", batch.batch_id, len(batch_request.items)
+    )
+    return {"batch_id": batch.batch_id, "total": len(batch.items)}
+
+
+@ecs_app.get("/extract_documents/{batch_id}")
+async def batch_progress(batch_id: str):
+    """Progress of the items of the batch"""
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return batch.progress()
+
+
 class OCRContentTypes(str, Enum):
     """Types of contents for scanned docs"""
 
@@ -197,7 +517,82 @@ class TextExtractionHandler:
             "DOCS_CONVERT_LAMBDA_FN_NAME", None
         )
 
+        if DOCS_CONVERTER_BACKEND == LibreOfficeConverter.name:
+            self.converter = LibreOfficeConverter(
+                pool_size=LIBREOFFICE_POOL_SIZE, timeout=LIBREOFFICE_TIMEOUT_SECS
+            )
+        else:
+            self.converter = LambdaConverter(
+                lambda_client,
+                s3_client_presigned_url,
+                self.docs_conversion_bucket_name,
+                self.docs_convert_lambda_fn_name,
+                executor=docs_conversion_executor,
+            )
+
+        self.web_sessions = WebSessionPool(
+            factory=lambda url: TextFromWeb(url=url, selenium_ip=CLOUDFLARE_PROXY_SERVER_HOST),
+            size=HTML_EXTRACTION_CONCURRENCY,
+            timeout=HTML_EXTRACTION_TIMEOUT_SECS,
+            max_uses=HTML_SESSION_MAX_USES,
+        )
+
+        self.image_index = (
+            ImageIndex(
+                max_entries=IMAGE_INDEX_MAX_ENTRIES,
+                max_distance=IMAGE_DEDUP_MAX_DISTANCE,
+                ttl=IMAGE_INDEX_TTL_SECS,
+            )
+            if IMAGE_INDEX_MAX_ENTRIES and IMAGE_DEDUP_MAX_DISTANCE >= 0
+            else None
+        )
+
+        self.ocr_pool = (
+            OCRWorkerPool(
+                workers=OCR_POOL_WORKERS,
+                page_timeout=OCR_PAGE_TIMEOUT_SECS,
+                engine_configs=(
+                    PAGE_ENGINE_CONFIG,
+                    engine_config(DOCUMENT_EXTRACTION_TYPE, self.bucket_name),
+                ),
+            )
+            if OCR_POOL_WORKERS
+            else None
+        )
+        self.table_ocr_pool = (
+            OCRWorkerPool(
+                workers=OCR_TABLE_WORKERS,
+                engine_configs=(engine_config(TABLE_EXTRACTION_TYPE, self.bucket_name),),
+                name="table_ocr",
+            )
+            if OCR_POOL_WORKERS and OCR_TABLE_WORKERS
+            else None
+        )
+
+        self.webpage_cache = (
+            WebpageCache(
+                max_entries=WEBPAGE_CACHE_MAX_ENTRIES,
+                max_bytes=WEBPAGE_CACHE_MAX_MB * 1024 * 1024,
+                ttl=WEBPAGE_CACHE_TTL_SECS,
+            )
+            if WEBPAGE_CACHE_ENABLED
+            else None
+        )
+
         self.extract_content_type = ExtractContentType()
+        # In-flight extractions by normalised url, resolved with their results
+        self._in_flight = {}
+        self.coalesced_count = 0
+        self.result_cache = (
+            ExtractionResultCache(
+                self.bucket_name,
+                s3_client_presigned_url,
+                ttl=EXTRACTION_CACHE_TTL_SECS,
+                page_stream=STREAMING_OUTPUT_ENABLED,
+            )
+            if EXTRACTION_CACHE_ENABLED and self.bucket_name
+            else None
+        )
 
         self.headers = {
             "Content-Type": "application/json",
@@ -235,6 +630,35 @@ class TextExtractionHandler:
             )
             return entries_lst
 
+    def upload_artifact(self, contents, contents_type, key):
+        """Uploads the text or json artifact (gzip encoded if enabled), returns its presigned url"""
+        with span("artifact_upload", key=key.rsplit("/", 1)[-1]):
+            return self._upload_artifact(contents, contents_type, key)
+
+    def _upload_artifact(self, contents, contents_type, key):
+        if not ARTIFACTS_COMPRESSION_ENABLED:
+            return upload_to_s3(
+                contents=contents,
+                contents_type=contents_type,
+                bucket_name=self.bucket_name,
+                key=key,
+                aws_region=AWS_REGION,
+                s3_client=s3_client_presigned_url,
+                signed_url_expiry_secs=self.signed_url_expiry_secs,
+            )
+        try:
+            put_gzip_object(
+                s3_client_presigned_url, self.bucket_name, key, contents, contents_type
+            )
+        except ClientError as cexc:
+            logging.error("Could not upload %s. %s", key, str(cexc))
+            return None
+        return s3_client_presigned_url.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name, "Key": key},
+            ExpiresIn=int(self.signed_url_expiry_secs),
+        )
+
     def _common_doc_handler(
         self,
         entries,
@@ -258,14 +682,10 @@ class TextExtractionHandler:
         total_pages = 1 if webpage_extraction else len(entries)
         date_today = date.today().isoformat()
 
-        text_presigned_url = upload_to_s3(
+        text_presigned_url = self.upload_artifact(
             contents=extracted_text,
             contents_type="text/plain; charset=utf-8",
-            bucket_name=self.bucket_name,
             key=f"textextraction/{date_today}/{textextraction_id}/extracted_text.txt",
-            aws_region=AWS_REGION,
-            s3_client=s3_client_presigned_url,
-            signed_url_expiry_secs=self.signed_url_expiry_secs,
         )
 
         # the idea is to push another format of the same text in a structured format.
@@ -274,41 +694,41 @@ class TextExtractionHandler:
         # the document with only the textextraction_id, so it's tricky to known where it's located without the date,
         # so i prefer to save every structured text in the same directory, considering that textextraction_id
         # is a uuid.
-        structured_text_presigned_url = upload_to_s3(
+        structured_text_presigned_url = self.upload_artifact(
             contents=json.dumps(entries),
             contents_type="application/json",
-            bucket_name=self.bucket_name,
             key=f"textextraction/structured/{textextraction_id}/extracted_text.json",
-            aws_region=AWS_REGION,
-            s3_client=s3_client_presigned_url,
-            signed_url_expiry_secs=self.signed_url_expiry_secs,
         )
 
         # during text extraction, also the structured version is stored on s3
         # and sent to the database with a "structured_text_presigned_url"
         if text_presigned_url:
+            results = {
+                "text_presigned_url": text_presigned_url,
+                "structured_text_presigned_url": structured_text_presigned_url,
+                "total_pages": total_pages,
+                "total_words_count": total_words_count,
+            }
             self.dispatch_results(
                 client_id,
                 textextraction_id,
                 callback_url,
                 status=StateHandler.SUCCESS.value,
-                text_presigned_url=text_presigned_url,
-                structured_text_presigned_url=structured_text_presigned_url,
-                total_pages=total_pages,
-                total_words_count=total_words_count,
-            )
-        else:
-            self.dispatch_results(
-                client_id,
-                textextraction_id,
-                callback_url,
-                status=StateHandler.FAILED.value,
+                **results,
             )
+            return results
+        self.dispatch_results(
+            client_id,
+            textextraction_id,
+            callback_url,
+            status=StateHandler.FAILED.value,
+        )
+        return None
 
-    def _common_doc_handler_2(
+    async def _common_doc_handler_2(
         self,
-        text_contents: str,
-        structured_text,
+        text_contents: TextAssembler,
+        structured_text: StructuredTextAssembler,
         table_contents,
         images_dict,
         client_id,
@@ -317,23 +737,27 @@ class TextExtractionHandler:
         webpage_extraction=False,
     ):
         """
-        Common doc handler for pdf and webpages
+        Common doc handler for pdf and webpages, the uploads run in threads
         """
-        extracted_text = preprocess_extracted_texts(text_contents)
-        total_words_count = get_words_count(extracted_text)
+        total_words_count = text_contents.words_count
 
-        total_pages = 1 if webpage_extraction else len(structured_text)
+        total_pages = 1 if webpage_extraction else structured_text.pages_count
         date_today = date.today().isoformat()
 
-        text_presigned_url = upload_to_s3(
-            contents=extracted_text,
-            contents_type="text/plain; charset=utf-8",
-            bucket_name=self.bucket_name,
-            key=f"textextraction/{date_today}/{textextraction_id}/extracted_text.txt",
-            aws_region=AWS_REGION,
-            s3_client=s3_client_presigned_url,
-            signed_url_expiry_secs=self.signed_url_expiry_secs,
-        )
+        try:
+            with span("text_upload"):
+                text_presigned_url = await asyncio.to_thread(
+                    text_contents.upload,
+                    s3_client=s3_client_presigned_url,
+                    bucket_name=self.bucket_name,
+                    key=f"textextraction/{date_today}/{textextraction_id}/extracted_text.txt",
+                    signed_url_expiry_secs=self.signed_url_expiry_secs,
+                )
+        except Exception as exc:
+            logging.error("Could not upload the extracted text. %s", str(exc))
+            text_presigned_url = None
+        finally:
+            text_contents.close()
 
         # the idea is to push another format of the same text in a structured format.
         # the problem is that the text/plain version can't be reversed in its original
@@ -341,194 +765,550 @@ class TextExtractionHandler:
         # the document with only the textextraction_id, so it's tricky to known where it's located without the date,
         # so i prefer to save every structured text in the same directory, considering that textextraction_id
         # is a uuid.
-        structured_text_presigned_url = upload_to_s3(
-            contents=json.dumps(structured_text),
-            contents_type="application/json",
-            bucket_name=self.bucket_name,
-            key=f"textextraction/structured/{textextraction_id}/extracted_text.json",
-            aws_region=AWS_REGION,
-            s3_client=s3_client_presigned_url,
-            signed_url_expiry_secs=self.signed_url_expiry_secs,
-        )
+        try:
+            with span("artifact_upload", key="extracted_text.json"):
+                structured_text_presigned_url = await asyncio.to_thread(
+                    structured_text.upload,
+                    s3_client=s3_client_presigned_url,
+                    bucket_name=self.bucket_name,
+                    key=f"textextraction/structured/{textextraction_id}/extracted_text.json",
+                    signed_url_expiry_secs=self.signed_url_expiry_secs,
+                )
+        except Exception as exc:
+            logging.error("Could not upload the structured text. %s", str(exc))
+            structured_text_presigned_url = None
+        finally:
+            structured_text.close()
 
         # during text extraction, also the structured version is stored on s3
         # and sent to the database with a "structured_text_presigned_url"
         if text_presigned_url:
+            results = {
+                "text_presigned_url": text_presigned_url,
+                "structured_text_presigned_url": structured_text_presigned_url,
+                "total_pages": total_pages,
+                "total_words_count": total_words_count,
+                "table_contents": table_contents if table_contents else None,
+                "images_contents": images_dict,
+            }
             self.dispatch_results(
                 client_id,
                 textextraction_id,
                 callback_url,
                 status=StateHandler.SUCCESS.value,
-                text_presigned_url=text_presigned_url,
-                structured_text_presigned_url=structured_text_presigned_url,
-                total_pages=total_pages,
-                total_words_count=total_words_count,
-                table_contents=table_contents if table_contents else None,
-                images_contents=images_dict,
-            )
-        else:
-            self.dispatch_results(
-                client_id,
-                textextraction_id,
-                callback_url,
-                status=StateHandler.FAILED.value,
+                **results,
             )
+            return results
+        self.dispatch_results(
+            client_id,
+            textextraction_id,
+            callback_url,
+            status=StateHandler.FAILED.value,
+        )
+        return None
 
-    async def handle_table_elements(self, url, textextraction_id):
+    async def handle_table_elements(self, file_path, textextraction_id):
         """Handle Table elements from the document"""
         date_today = date.today().isoformat()
 
-        tempf = await create_async_tempfile(url=url, headers=self.headers, timeout=30)
-
+        ocr_config = {
+            **engine_config(TABLE_EXTRACTION_TYPE, self.bucket_name),
+            "s3_bucket_key": f"textextraction/{date_today}/{textextraction_id}/tables",
+        }
         try:
-            ocr_table_engine = OCRProcessor(
-                extraction_type=2,
-                show_log=False,
-                use_s3=True,
-                s3_bucket_name=self.bucket_name,
-                s3_bucket_key=f"textextraction/{date_today}/{textextraction_id}/tables",
-            )
-            ocr_table_engine.load_file(file_path=tempf.name, is_image=False)
-            ocr_results = await ocr_table_engine.handler()
+            with span("table_ocr"):
+                if self.table_ocr_pool:
+                    # The timeout starts once a table worker picks it up
+                    ocr_results = await self.table_ocr_pool.ocr_document(
+                        ocr_config,
+                        file_path,
+                        is_image=False,
+                        timeout=TABLE_EXTRACTION_TIMEOUT_SECS,
+                        queue_timeout=OCR_TABLE_QUEUE_TIMEOUT_SECS,
+                    )
+                else:
+                    ocr_table_engine = OCRProcessor(**ocr_config)
+                    await asyncio.to_thread(
+                        ocr_table_engine.load_file, file_path=file_path, is_image=False
+                    )
+                    ocr_results = await ocr_table_engine.handler()
             table_contents = ocr_results["table"]
             return table_contents
         except Exception as exc:
             logging.warning("Exception occurred while extracting tables %s", exc)
             return None
 
-    async def handle_block_elements(self, blocks, images_dir, textextraction_id):
-        """Handles block elements"""
+    async def handle_table_elements_with_timeout(self, file_path, textextraction_id):
+        """Table extraction with its own timeout, it never fails the text extraction"""
+        if self.table_ocr_pool:
+            # The pool applies the timeouts, a table that times out is None
+            return await self.handle_table_elements(file_path, textextraction_id)
+        try:
+            return await asyncio.wait_for(
+                self.handle_table_elements(file_path, textextraction_id),
+                timeout=TABLE_EXTRACTION_TIMEOUT_SECS,
+            )
+        except asyncio.exceptions.TimeoutError:
+            logging.warning("Timeout occurred while extracting tables.")
+            return None
+
+    async def upload_image(self, semaphore, imgfile_path, textextraction_id, document_images=None):
+        """
+        Uploads the image if it is big enough, returns its presigned url.
+        The copies of an image (document_images) are uploaded once.
+        """
+
+        async def upload(image_path):
+            return await uploadfile_s3(
+                image_path,
+                self.bucket_name,
+                textextraction_id,
+                s3_client_presigned_url,
+            )
+
+        async def presign(key):
+            return await presign_s3_key(self.bucket_name, key, s3_client_presigned_url)
+
+        async with semaphore:
+            if not await asyncio.to_thread(filter_file_by_size, imgfile_path):
+                return None
+            if document_images:
+                return await document_images.upload(imgfile_path, upload, presign)
+            _, presigned_url = await upload(imgfile_path)
+            return presigned_url
+
+    async def handle_block_elements(
+        self,
+        block_chunks,
+        images_dir,
+        textextraction_id,
+        total_pages=None,
+        page_writer=None,
+        ocr_task=None,
+        client_id=None,
+    ):
+        """
+        Handles block elements.
+        The blocks come in chunks (lists, or an async iterator of lists) covering
+        consecutive pages in page order, e.g. the page ranges. Every chunk is consumed
+        page by page and the finished pages are written out (text, structured text and
+        page_writer) and released, so only the pending blocks are held in memory.
+        Pages without blocks (e.g. the pages of a failed page range) are kept as empty pages.
+        The ocr texts of the scanned pages (ocr_task, by page) are added after the blocks
+        of their page.
+        """
+        upload_semaphore = asyncio.Semaphore(IMAGE_UPLOAD_CONCURRENCY)
+        document_images = (
+            DocumentImages(self.image_index, client_id, IMAGE_DEDUP_MAX_DISTANCE)
+            if IMAGE_DEDUP_MAX_DISTANCE >= 0
+            else None
+        )
+        ocr_texts = None
         page_num = 0
-        final_text_contents = ""
-        temp_texts = ""
+        final_text_contents = TextAssembler()
+        structured_text = StructuredTextAssembler()
+        temp_texts = []
         flag = False
-        structured_text = []
         structured_text_temp = []
         images_dict = []
         images_lst = []
 
+        def add_page(page_idx, page_texts, page_structured_text, page_images):
+            if page_idx in ocr_texts:
+                page_texts = page_texts + ocr_page_texts(
+                    [content + "\n\n\n" for content in ocr_texts[page_idx]]
+                )
+                page_structured_text = page_structured_text + ocr_texts[page_idx]
+            final_text_contents.add_page(page_idx + 1, page_texts)
+            if page_images:
+                images_dict.append({"page_number": page_idx + 1, "images": page_images})
+            structured_text.add_page(page_structured_text)
+            if page_writer:
+                page_writer.add_page(structured_text.pages_count, page_structured_text)
+
+        async def iter_chunks():
+            if hasattr(block_chunks, "__aiter__"):
+                async for chunk in block_chunks:
+                    yield chunk
+            else:
+                for chunk in block_chunks:
+                    yield chunk
+
         # ocr_processor = OCRProcessor(
         #     extraction_type=1,
         #     show_log=False,
         #     use_s3=False
         # )
-        # Sort blocks by 'page', y0 and then x0
-        block_items = sorted(blocks, key=operator.itemgetter("page", "y0", "x0"))
-        for block in block_items:
-            if block["page"] == page_num:
-                flag = True
-                if block["type"] == OCRContentTypes.TEXT:
-                    temp_texts += "\n\n\n" + block["text"] + "\n\n\n"
-                    structured_text_temp.append(block["text"])
-                if block["type"] == OCRContentTypes.IMAGE:
-                    imgfile_path = f"{images_dir}/{block['imageLink']}"
-                    if os.path.isfile(imgfile_path) and filter_file_by_size(
-                        imgfile_path
-                    ):
-                        presigned_url = await uploadfile_s3(
-                            imgfile_path,
-                            self.bucket_name,
-                            textextraction_id,
-                            s3_client_presigned_url,
-                        )
-                        if presigned_url:
-                            images_lst.append(presigned_url)
-                        # ocr_processor.load_file(file_path=imgfile_path, is_image=True)
-                        # ocr_results = await ocr_processor.handler()
-                        # text_contents = ocr_results["text"]
-                        # ocr_texts = ""
-                        # for item in text_contents:
-                        #     ocr_texts += item["content"] + "\n\n"
-                        # if ocr_texts:
-                        #     temp_texts += beautify_ocr_text(ocr_texts)
-                        #     structured_text_temp.append(ocr_texts)
-                        # await asyncio.sleep(0)
-            else:
-                flag = False
-                final_text_contents += beautify_extracted_text(temp_texts, page_num + 1)
-                if images_lst:
-                    images_dict.append(
-                        {"page_number": page_num + 1, "images": images_lst}
-                    )
-                images_lst = []
-                structured_text.append(structured_text_temp)
-                structured_text_temp = []
-                temp_texts = ""
-                if block["type"] == OCRContentTypes.TEXT:
-                    temp_texts += "\n\n\n" + block["text"] + "\n\n\n"
-                    structured_text_temp.append(block["text"])
-                page_num += 1
-        if flag:
-            final_text_contents += beautify_extracted_text(temp_texts, page_num + 1)
-            if images_lst:
-                images_dict.append({"page_number": page_num + 1, "images": images_lst})
-            structured_text.append(structured_text_temp)
+        try:
+            async for block_items in iter_chunks():
+                if ocr_texts is None:
+                    # The OCR of the scanned pages ran alongside the parser
+                    ocr_texts = (await ocr_task if ocr_task else None) or {}
+                # Sort blocks by 'page', y0 and then x0, in reverse so that the blocks are
+                # popped in order (the ties keep the parser order) and released once handled
+                block_items.reverse()
+                block_items.sort(key=operator.itemgetter("page", "y0", "x0"), reverse=True)
+                while block_items:
+                    block = block_items.pop()
+                    if block["page"] != page_num:
+                        add_page(page_num, temp_texts, structured_text_temp, images_lst)
+                        images_lst = []
+                        structured_text_temp = []
+                        temp_texts = []
+                        for empty_page_num in range(page_num + 1, block["page"]):
+                            add_page(empty_page_num, [], [], [])
+                        page_num = block["page"]
+                    flag = True
+                    if block["type"] == OCRContentTypes.TEXT:
+                        temp_texts.append("\n\n\n" + block["text"] + "\n\n\n")
+                        structured_text_temp.append(block["text"])
+                    if block["type"] == OCRContentTypes.IMAGE:
+                        imgfile_path = f"{images_dir}/{block['imageLink']}"
+                        if os.path.isfile(imgfile_path):
+                            # The uploads run concurrently, the urls are collected below
+                            images_lst.append(
+                                asyncio.create_task(
+                                    self.upload_image(
+                                        upload_semaphore,
+                                        imgfile_path,
+                                        textextraction_id,
+                                        document_images,
+                                    )
+                                )
+                            )
+                            # ocr_processor.load_file(file_path=imgfile_path, is_image=True)
+                            # ocr_results = await ocr_processor.handler()
+                            # text_contents = ocr_results["text"]
+                            # ocr_texts = ""
+                            # for item in text_contents:
+                            #     ocr_texts += item["content"] + "\n\n"
+                            # if ocr_texts:
+                            #     temp_texts += beautify_ocr_text(ocr_texts)
+                            #     structured_text_temp.append(ocr_texts)
+                            # await asyncio.sleep(0)
+            if ocr_texts is None:
+                ocr_texts = (await ocr_task if ocr_task else None) or {}
+            if flag:
+                add_page(page_num, temp_texts, structured_text_temp, images_lst)
+            for empty_page_num in range(structured_text.pages_count, total_pages or 0):
+                add_page(empty_page_num, [], [], [])
+        except BaseException:
+            final_text_contents.close()
+            structured_text.close()
+            for page_images in images_dict:
+                for task in page_images["images"]:
+                    task.cancel()
+            for task in images_lst:
+                task.cancel()
+            raise
+        # The uploads started with the blocks, this is the time left waiting for them
+        with span("image_uploads", images=sum(len(page["images"]) for page in images_dict)):
+            images_dict = await self.collect_uploaded_images(images_dict)
+        if document_images and document_images.images_count:
+            tag_job(**{f"images_{name}": value for name, value in document_images.stats().items()})
         return final_text_contents, structured_text, images_dict
 
+    async def collect_uploaded_images(self, images_dict):
+        """Waits for the image uploads keeping the page order"""
+        pages_images = []
+        for page_images in images_dict:
+            results = await asyncio.gather(*page_images["images"], return_exceptions=True)
+            presigned_urls = []
+            for result in results:
+                if isinstance(result, Exception):
+                    logging.warning("Could not upload the image. %s", str(result))
+                elif result:
+                    presigned_urls.append(result)
+            if presigned_urls:
+                pages_images.append(
+                    {"page_number": page_images["page_number"], "images": presigned_urls}
+                )
+        return pages_images
+
     async def process_with_timeout(self, document):
         """Process doc"""
         return await asyncio.to_thread(document.extract)
 
+    async def count_pages(self, document):
+        """Number of pages of the pdf, 0 if it can't be read"""
+        try:
+            return await asyncio.to_thread(count_pdf_pages, document.name)
+        except Exception as exc:
+            logging.warning("Could not count the pages of the document. %s", str(exc))
+            return 0
+
+    async def find_scanned_pages(self, document):
+        """Pages of the pdf without a text layer, none if it can't be read"""
+        try:
+            return await asyncio.to_thread(
+                find_scanned_pages, document.name, SCANNED_PAGE_MIN_CHARS
+            )
+        except Exception as exc:
+            logging.warning("Could not check the text layer of the pages. %s", str(exc))
+            return []
+
+    async def ocr_scanned_pages(self, document, scanned_pages, images_dir):
+        """
+        OCR texts of the scanned pages (by page). The pages that can't be rendered or
+        OCRed are missing, the document is extracted without them (partially).
+        """
+        ocr_images_dir = os.path.join(images_dir, "ocr_pages")
+        os.makedirs(ocr_images_dir, exist_ok=True)
+        with span("page_ocr", pages=len(scanned_pages)):
+            try:
+                page_images = await asyncio.to_thread(
+                    render_pages, document.name, scanned_pages, ocr_images_dir, OCR_PAGE_DPI
+                )
+            except Exception as exc:
+                logging.warning("Could not render the scanned pages. %s", str(exc))
+                return {}
+            if self.ocr_pool:
+                return await self.ocr_pool.ocr_pages(page_images)
+            return await ocr_pages(page_images, OCR_PAGE_CONCURRENCY)
+
+    async def ocr_document_pages(self, document, textextraction_id, table_task=None):
+        """
+        OCR of the scanned document page by page, the pages are spread across the
+        OCR workers. The tables come from the table extraction (table_task, if
+        already started), the pages that failed are kept as empty pages, and the
+        extraction is not complete.
+        """
+        if table_task is None:
+            table_task = asyncio.create_task(
+                self.handle_table_elements_with_timeout(document.name, textextraction_id)
+            )
+        total_pages = await self.count_pages(document)
+        with tempfile.TemporaryDirectory() as pages_dir:
+            with span("document_ocr", pages=total_pages):
+                page_images = await asyncio.to_thread(
+                    render_pages, document.name, range(total_pages), pages_dir, OCR_PAGE_DPI
+                )
+                page_texts = await self.ocr_pool.ocr_pages(page_images)
+        text_contents = TextAssembler()
+        structured_text = []
+        for page_number in range(total_pages):
+            texts = page_texts.get(page_number, [])
+            text_contents.add_page(
+                page_number + 1, ocr_page_texts([content + "\n\n\n" for content in texts])
+            )
+            structured_text.append(texts)
+        with span("table_ocr_wait"):
+            table_contents = await table_task
+        complete = bool(total_pages) and len(page_texts) == total_pages and table_contents is not None
+        return text_contents, structured_text, table_contents, [], complete
+
+    async def handle_scanned_pdf(
+        self, document, textextraction_id, page_writer=None, table_task=None
+    ):
+        """
+        OCR of the whole scanned document (it extracts the tables and the images as well).
+        Returns the texts, the structured text, the tables, the images and whether the OCR is complete.
+        The page by page OCR doesn't extract the images yet, so it is opt-in.
+        """
+        if self.ocr_pool and OCR_SCANNED_PDF_BY_PAGE:
+            text_contents, structured_text, table_contents, images_dict, complete = (
+                await self.ocr_document_pages(document, textextraction_id, table_task)
+            )
+        else:
+            if table_task:
+                table_task.cancel()
+            with span("document_ocr"):
+                text_contents, structured_text, table_contents, images_dict, complete = (
+                    await handle_scanned_doc_or_image(
+                        file_path=document.name,
+                        is_image=False,
+                        s3_bucket_name=self.bucket_name,
+                        textextraction_id=textextraction_id,
+                        ocr_pool=self.ocr_pool,
+                        timeout=OCR_DOCUMENT_TIMEOUT_SECS,
+                    )
+                )
+        if page_writer:
+            for page_idx, page_texts in enumerate(structured_text):
+                page_writer.add_page(page_idx + 1, page_texts)
+        structured_text = StructuredTextAssembler.from_pages(structured_text)
+        return text_contents, structured_text, table_contents, images_dict, complete
+
+    async def fail_extraction(self, page_writer, client_id, textextraction_id, callback_url):
+        """Marks the structured output and the extraction as failed"""
+        if page_writer:
+            await page_writer.abort()
+        self.dispatch_results(
+            client_id,
+            textextraction_id,
+            callback_url,
+            status=StateHandler.FAILED.value,
+        )
+
+    def dispatch_cached_results(
+        self, cached_results, client_id, textextraction_id, callback_url
+    ):
+        """Dispatch the results of an earlier extraction of the same document"""
+        logging.info("Extraction results found in the cache.")
+        self.dispatch_results(
+            client_id,
+            textextraction_id,
+            callback_url,
+            status=StateHandler.SUCCESS.value,
+            **cached_results,
+        )
+
     async def handle_pdf_text_from_url(
-        self, url, client_id, textextraction_id, callback_url
+        self,
+        url,
+        client_id,
+        textextraction_id,
+        callback_url,
+        document=None,
+        validators=None,
     ):
         """Extract texts from url link which is a pdf document"""
         logging.info("The Text Extraction process is initiated.")
-        try:
-            document = TextFromFile(stream=None, ext="pdf", from_web=True, url=url)
-            deepex_op = await asyncio.wait_for(
-                self.process_with_timeout(document), timeout=240
+        if document is None:
+            try:
+                with span("download"):
+                    document = await download_document(url, self.headers)
+            except Exception as exc:
+                logging.error("Could not download the document. %s", str(exc))
+                self.dispatch_results(
+                    client_id,
+                    textextraction_id,
+                    callback_url,
+                    status=StateHandler.FAILED.value,
+                )
+                return
+        doc_hash = document.content_hash() if self.result_cache else None
+        if doc_hash:
+            cached_results = await self.result_cache.get(doc_hash, textextraction_id)
+            if cached_results:
+                await self.result_cache.put_url(url, validators, doc_hash)
+                self.dispatch_cached_results(
+                    cached_results, client_id, textextraction_id, callback_url
+                )
+                return cached_results
+        # The tables are extracted alongside the text blocks
+        table_task = asyncio.create_task(
+            self.handle_table_elements_with_timeout(document.name, textextraction_id)
+        )
+        page_writer = None
+        if STREAMING_OUTPUT_ENABLED:
+            page_writer = StructuredPageWriter(
+                s3_client_presigned_url, self.bucket_name, textextraction_id
             )
-            temp_img_dir = os.path.join("/tmp", uuid.uuid4().hex)
+            await page_writer.start()
+        ocr_task = None
+        temp_img_dir = os.path.join("/tmp", uuid.uuid4().hex)
+        try:
             os.makedirs(temp_img_dir, exist_ok=True)
-            deepex_op.save_pics(temp_img_dir)
-            deepex_op = deepex_op.to_json()
-            block_items = deepex_op["blocks"]
-            text_contents, structured_text, images_dict = (
-                await self.handle_block_elements(
-                    block_items, temp_img_dir, textextraction_id
+            total_pages = await self.count_pages(document)
+            tag_job(total_pages=total_pages)
+            with span("scanned_pages_detection"):
+                scanned_pages = await self.find_scanned_pages(document)
+            if total_pages and len(scanned_pages) == total_pages:
+                logging.warning("Scanned document found. Applying OCR on this document")
+                text_contents, structured_text, table_contents, images_dict, complete = (
+                    await self.handle_scanned_pdf(
+                        document, textextraction_id, page_writer, table_task
+                    )
                 )
-            )
-            table_contents = await self.handle_table_elements(url, textextraction_id)
-            # Delete the images temp directory
-            try:
-                shutil.rmtree(temp_img_dir)
-            except (OSError, Exception):
-                logging.warning("Could not delete the images temporary directory.")
+            else:
+                if scanned_pages:
+                    # Only the pages without a text layer go through OCR, alongside the parser
+                    logging.info("Applying OCR on %s scanned pages.", len(scanned_pages))
+                    ocr_task = asyncio.create_task(
+                        self.ocr_scanned_pages(document, scanned_pages, temp_img_dir)
+                    )
+                page_range_extraction = None
+                if PDF_PAGE_CHUNK_SIZE and total_pages and total_pages >= PDF_PARALLEL_MIN_PAGES:
+                    # The page ranges are parsed while the finished ones are handled,
+                    # the "blocks" span covers both
+                    logging.info("Extracting %s pages in page ranges.", total_pages)
+                    page_range_extraction = PageRangeExtraction(
+                        document.name,
+                        temp_img_dir,
+                        total_pages=total_pages,
+                        chunk_size=PDF_PAGE_CHUNK_SIZE,
+                        chunk_timeout=PDF_CHUNK_TIMEOUT_SECS,
+                        max_workers=PDF_EXTRACTION_WORKERS,
+                    )
+                    block_chunks = page_range_extraction
+                else:
+                    with span("parse", page_ranges=False):
+                        parser_document = TextFromFile(
+                            stream=document.read_base64(), ext="pdf"
+                        )
+                        deepex_op = await asyncio.wait_for(
+                            self.process_with_timeout(parser_document), timeout=240
+                        )
+                    with span("save_pics"):
+                        deepex_op.save_pics(temp_img_dir)
+                    # Only the blocks are kept, the parser output is released
+                    block_chunks = [deepex_op.to_json()["blocks"]]
+                    del parser_document, deepex_op
+                with span("blocks", page_ranges=page_range_extraction is not None):
+                    text_contents, structured_text, images_dict = (
+                        await self.handle_block_elements(
+                            block_chunks,
+                            temp_img_dir,
+                            textextraction_id,
+                            total_pages=total_pages,
+                            page_writer=page_writer,
+                            ocr_task=ocr_task,
+                            client_id=client_id,
+                        )
+                    )
+                failed_pages = set(page_range_extraction.failed_pages if page_range_extraction else [])
+                if ocr_task:
+                    # The OCR results are missing the scanned pages that failed
+                    failed_pages.update(set(scanned_pages) - set(await ocr_task))
+                if failed_pages:
+                    logging.warning("Partial extraction, %s pages failed.", len(failed_pages))
+                with span("table_ocr_wait"):
+                    table_contents = await table_task
+                complete = not failed_pages and table_contents is not None
 
         except ScannedDocumentError:
             logging.warning("Scanned document found. Applying OCR on this document")
-            text_contents, structured_text, table_contents, images_dict = (
-                await handle_scanned_doc_or_image(
-                    url=url,
-                    is_image=False,
-                    s3_bucket_name=self.bucket_name,
-                    textextraction_id=textextraction_id,
-                    headers=self.headers,
+            try:
+                text_contents, structured_text, table_contents, images_dict, complete = (
+                    await self.handle_scanned_pdf(
+                        document, textextraction_id, page_writer, table_task
+                    )
                 )
-            )
+            except (
+                asyncio.exceptions.TimeoutError,
+                asyncio.exceptions.CancelledError,
+            ) as texc:
+                logging.warning("Asyncio timeout exception occurred. %s", str(texc))
+                await self.fail_extraction(page_writer, client_id, textextraction_id, callback_url)
+                return
+            except Exception as exc:
+                logging.error("Extraction failed: %s", str(exc), exc_info=True)
+                await self.fail_extraction(page_writer, client_id, textextraction_id, callback_url)
+                return
         except (
             asyncio.exceptions.TimeoutError,
             asyncio.exceptions.CancelledError,
         ) as texc:
             logging.warning("Asyncio timeout exception occurred. %s", str(texc))
-            self.dispatch_results(
-                client_id,
-                textextraction_id,
-                callback_url,
-                status=StateHandler.FAILED.value,
-            )
+            await self.fail_extraction(page_writer, client_id, textextraction_id, callback_url)
             return
         except Exception as exc:
             logging.error("Extraction failed: %s", str(exc), exc_info=True)
-            self.dispatch_results(
-                client_id,
-                textextraction_id,
-                callback_url,
-                status=StateHandler.FAILED.value,
-            )
+            await self.fail_extraction(page_writer, client_id, textextraction_id, callback_url)
             return
-        self._common_doc_handler_2(
+        finally:
+            table_task.cancel()
+            if ocr_task:
+                ocr_task.cancel()
+            # Delete the images temp directory (the extracted and the OCR page images)
+            try:
+                shutil.rmtree(temp_img_dir)
+            except (OSError, Exception):
+                logging.warning("Could not delete the images temporary directory.")
+        if page_writer:
+            await page_writer.finish(total_pages=structured_text.pages_count)
+        results = await self._common_doc_handler_2(
             text_contents,
             structured_text,
             table_contents,
@@ -537,14 +1317,34 @@ class TextExtractionHandler:
             textextraction_id,
             callback_url,
         )
+        if results and doc_hash:
+            if complete:
+                await self.result_cache.put(doc_hash, results)
+                await self.result_cache.put_url(url, validators, doc_hash)
+            else:
+                # A partial extraction (failed pages, tables or OCR) is not reused
+                logging.info("The results of the partial extraction are not cached.")
+        return results
 
-    def handle_html_text(
-        self, url, file_name, client_id, textextraction_id, callback_url
+    async def handle_html_text(
+        self, url, file_name, client_id, textextraction_id, callback_url, validators=None
     ):
-        """Extract html texts"""
+        """
+        Extract html texts, the page is rendered by a session of the pool.
+        The entries of pages with validators are cached for the conditional requests.
+        """
         try:
-            web_text = TextFromWeb(url=url, selenium_ip=CLOUDFLARE_PROXY_SERVER_HOST)
-            entries = web_text.extract_text(output_format="list", url=url)
+            with span("html_extraction"):
+                entries = await self.web_sessions.extract(url)
+        except asyncio.exceptions.TimeoutError:
+            logging.error("Timeout occurred while extracting the website %s.", url)
+            self.dispatch_results(
+                client_id,
+                textextraction_id,
+                callback_url,
+                status=StateHandler.FAILED.value,
+            )
+            return
         except Exception as exc:
             logging.error("Extraction from website failed. %s", str(exc), exc_info=True)
             self.dispatch_results(
@@ -554,12 +1354,61 @@ class TextExtractionHandler:
                 status=StateHandler.FAILED.value,
             )
             return
+        if self.webpage_cache:
+            self.webpage_cache.put(url, validators, entries)
         # TODO: use extract all to use blocks
         logging.info("Extracting web page contents")
-        self._common_doc_handler(
+        return self._common_doc_handler(
             entries, client_id, textextraction_id, callback_url, webpage_extraction=True
         )
 
+    async def handle_office_document(
+        self, document, ext_type, client_id, textextraction_id, callback_url
+    ):
+        """Converts docx, xlsx, doc, xls, ppt, pptx documents to pdf and extracts texts"""
+        doc_hash = document.content_hash()
+        converted_document = None
+        if self.result_cache:
+            converted_document = await self.result_cache.get_converted(doc_hash)
+            if converted_document:
+                logging.info("Reusing the cached pdf conversion of %s", textextraction_id)
+        if converted_document is None:
+            with span("conversion", backend=self.converter.name):
+                converted_document = await self.converter.convert(document, ext_type)
+            if converted_document and self.result_cache:
+                await self.result_cache.put_converted(doc_hash, converted_document)
+
+        if converted_document is None:
+            self.dispatch_results(
+                client_id,
+                textextraction_id,
+                callback_url,
+                status=StateHandler.FAILED.value,
+            )
+            return
+        with converted_document:
+            return await self.handle_pdf_text_from_url(
+                url=document.url,
+                client_id=client_id,
+                textextraction_id=textextraction_id,
+                callback_url=callback_url,
+                document=converted_document,
+            )
+
+    def upload_job_timings(self, job):
+        """Stores the per-stage timings of the job next to its extracted text"""
+        date_today = date.today().isoformat()
+        key = f"textextraction/{date_today}/{job.textextraction_id}/timings.json"
+        try:
+            s3_client_presigned_url.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=json.dumps(job.to_dict(), default=str).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except ClientError as cexc:
+            logging.warning("Could not upload the job timings. %s", str(cexc))
+
     async def __call__(
         self,
         client_id,
@@ -568,17 +1417,217 @@ class TextExtractionHandler:
         callback_url,
         file_name="extract_text.txt",
     ):
-        content_type = await self.extract_content_type.get_content_type(
-            url, self.headers
+        with job_timings(textextraction_id, url) as job:
+            try:
+                if not SINGLE_FLIGHT_ENABLED:
+                    await self.extract_document(
+                        client_id, url, textextraction_id, callback_url, file_name
+                    )
+                else:
+                    await self.extract_document_once(
+                        client_id, url, textextraction_id, callback_url, file_name
+                    )
+            finally:
+                if STREAMING_OUTPUT_ENABLED and self.bucket_name:
+                    # Every job ends with a final status of its progressive structured output
+                    await asyncio.to_thread(
+                        finish_page_stream, s3_client_presigned_url, self.bucket_name, textextraction_id
+                    )
+        if JOB_TIMINGS_UPLOAD_ENABLED and self.bucket_name:
+            await asyncio.to_thread(self.upload_job_timings, job)
+
+    async def extract_document_once(
+        self, client_id, url, textextraction_id, callback_url, file_name
+    ):
+        """
+        Single flight extraction: the first request of a url does the extraction,
+        the requests of the same url arriving meanwhile wait for its results and
+        dispatch them with their own textextraction_id.
+        """
+        flight_key = normalize_url(url)
+        flight = self._in_flight.get(flight_key)
+        if flight is not None:
+            self.coalesced_count += 1
+            logging.info(
+                "Attaching %s to the in-flight extraction of the same url.", textextraction_id
+            )
+            with span("coalesced_wait"):
+                # Shielded, a cancelled follower must not cancel the shared results
+                results = await asyncio.shield(flight)
+            await self.dispatch_shared_results(
+                results, client_id, url, textextraction_id, callback_url, file_name
+            )
+            return
+
+        flight = asyncio.get_running_loop().create_future()
+        self._in_flight[flight_key] = flight
+        results = None
+        try:
+            results = await self.extract_document(
+                client_id, url, textextraction_id, callback_url, file_name
+            )
+        finally:
+            del self._in_flight[flight_key]
+            flight.set_result(results)
+
+    def copy_structured_text(self, results, textextraction_id):
+        """
+        Results of the same document for another textextraction_id. The entry extraction
+        reads the structured text by the textextraction_id, so it is copied (with the
+        page stream of the progressive structured output).
+        """
+        source_key = s3_key_from_presigned_url(
+            results.get("structured_text_presigned_url") or "", self.bucket_name
+        )
+        if not source_key:
+            return {**results, "structured_text_presigned_url": None}
+        structured_text_key = f"textextraction/structured/{textextraction_id}/extracted_text.json"
+        s3_client_presigned_url.copy_object(
+            Bucket=self.bucket_name,
+            Key=structured_text_key,
+            CopySource={"Bucket": self.bucket_name, "Key": source_key},
+        )
+        if STREAMING_OUTPUT_ENABLED:
+            copy_page_stream(
+                s3_client_presigned_url, self.bucket_name, source_key, textextraction_id
+            )
+        return {
+            **results,
+            "structured_text_presigned_url": s3_client_presigned_url.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket_name, "Key": structured_text_key},
+                ExpiresIn=int(self.signed_url_expiry_secs),
+            ),
+        }
+
+    async def dispatch_shared_results(
+        self, results, client_id, url, textextraction_id, callback_url, file_name
+    ):
+        """Dispatches the results of the in-flight extraction of the same url"""
+        if not results:
+            self.dispatch_results(
+                client_id,
+                textextraction_id,
+                callback_url,
+                status=StateHandler.FAILED.value,
+            )
+            return
+        try:
+            shared_results = await asyncio.to_thread(
+                self.copy_structured_text, results, textextraction_id
+            )
+        except ClientError as cexc:
+            logging.warning(
+                "Could not share the results, extracting the document again. %s", str(cexc)
+            )
+            await self.extract_document(
+                client_id, url, textextraction_id, callback_url, file_name
+            )
+            return
+        self.dispatch_results(
+            client_id,
+            textextraction_id,
+            callback_url,
+            status=StateHandler.SUCCESS.value,
+            **shared_results,
+        )
+
+    def single_flight_stats(self):
+        return {"in_flight": len(self._in_flight), "coalesced": self.coalesced_count}
+
+    async def extract_document(
+        self, client_id, url, textextraction_id, callback_url, file_name
+    ):
+        """
+        Extracts the texts of the document at the url and dispatches the results.
+        Returns the dispatched results, None if the extraction failed.
+        """
+        url_entry = None
+        if self.result_cache:
+            with span("cache_lookup"):
+                url_entry = await self.result_cache.get_url_entry(url)
+
+        # The document is downloaded only once and shared by all the stages.
+        # Webpages are rendered by the web extractor, so their body is not downloaded.
+        # The documents already extracted from the url (and the cached webpages) are
+        # revalidated with a conditional request, a 304 reuses their results.
+        cached_page = self.webpage_cache.get(url) if self.webpage_cache else None
+        try:
+            with span("download"):
+                document = await self.download(url, url_entry or cached_page)
+                if document.not_modified and url_entry:
+                    document.close()
+                    cached_results = await self.result_cache.get(
+                        url_entry["content_hash"], textextraction_id
+                    )
+                    if cached_results:
+                        self.dispatch_cached_results(
+                            cached_results, client_id, textextraction_id, callback_url
+                        )
+                        return cached_results
+                    # The cached results are gone, the document is downloaded again
+                    cached_page = None
+                    document = await self.download(url)
+        except Exception as exc:
+            logging.error("Could not download the document from %s. %s", url, str(exc))
+            self.dispatch_results(
+                client_id,
+                textextraction_id,
+                callback_url,
+                status=StateHandler.FAILED.value,
+            )
+            return
+
+        with document:
+            if document.not_modified and cached_page:
+                logging.info("The webpage is not modified, reusing its extraction.")
+                tag_job(content_type=UrlTypes.HTML.value)
+                return self._common_doc_handler(
+                    self.webpage_cache.hit(cached_page),
+                    client_id,
+                    textextraction_id,
+                    callback_url,
+                    webpage_extraction=True,
+                )
+            return await self.handle_document(
+                document, client_id, url, textextraction_id, callback_url, file_name
+            )
+
+    async def download(self, url, revalidated_entry=None):
+        """Downloads the document, with a conditional request if the entry has validators"""
+        return await download_document(
+            url,
+            {**self.headers, **WebpageCache.conditional_headers(revalidated_entry)},
+            resolve_content_type=self.extract_content_type.document_content_type,
+            skip_body_types=(UrlTypes.HTML,),
         )
 
+    async def handle_document(
+        self, document, client_id, url, textextraction_id, callback_url, file_name
+    ):
+        """Extracts the texts from the downloaded document based on its content type, returns the results"""
+        tag_job(size_bytes=document.size)
+        with span("content_type"):
+            content_type = self.extract_content_type.document_content_type(document)
+        tag_job(content_type=content_type)
+
         if content_type == UrlTypes.PDF.value:  # assume it is http/https pdf weblink
-            await self.handle_pdf_text_from_url(
-                url, client_id, textextraction_id, callback_url
+            return await self.handle_pdf_text_from_url(
+                url,
+                client_id,
+                textextraction_id,
+                callback_url,
+                document=document,
+                validators=document.validators,
             )
         elif content_type == UrlTypes.HTML.value:  # assume it is a static webpage
-            self.handle_html_text(
-                url, file_name, client_id, textextraction_id, callback_url
+            return await self.handle_html_text(
+                url,
+                file_name,
+                client_id,
+                textextraction_id,
+                callback_url,
+                validators=document.validators,
             )
         elif content_type in [
             UrlTypes.DOCX.value,
@@ -588,72 +1637,27 @@ class TextExtractionHandler:
             UrlTypes.PPTX.value,
             UrlTypes.PPT.value,
         ]:
-            ext_type = content_type
-            tmp_filename = f"{uuid.uuid4().hex}.{ext_type}"
-            flag = False
-
-            s3_uploader = Storage(self.docs_conversion_bucket_name, "")
-            tempf = await create_async_tempfile(
-                url=url, headers=self.headers, timeout=60
-            )
-            with open(tempf.name, "rb") as tmpf:
-                s3_uploader.upload(tmp_filename, tmpf)
-                # Converts docx, xlsx, doc, xls, ppt, pptx type files to pdf using lambda
-                docs_conversion_lambda_response_json = await invoke_conversion_lambda(
-                    lambda_client,
-                    self.docs_conversion_bucket_name,
-                    self.docs_convert_lambda_fn_name,
-                    tmp_filename,
-                    ext_type,
-                )
-
-                if (
-                    docs_conversion_lambda_response_json and
-                    "statusCode" in docs_conversion_lambda_response_json and
-                    docs_conversion_lambda_response_json["statusCode"] == 200
-                ):
-                    bucket_name = docs_conversion_lambda_response_json["bucket"]
-                    file_path = docs_conversion_lambda_response_json["file"]
-
-                    presigned_url = generate_presigned_url(
-                        bucket_name=bucket_name,
-                        key=file_path,
-                        s3_client=s3_client_presigned_url,
-                    )
-                    if presigned_url:
-                        await self.handle_pdf_text_from_url(
-                            url=presigned_url,
-                            client_id=client_id,
-                            textextraction_id=textextraction_id,
-                            callback_url=callback_url,
-                        )
-                    else:
-                        flag = True
-                else:
-                    flag = True
-            if flag:
-                self.dispatch_results(
-                    client_id,
-                    textextraction_id,
-                    callback_url,
-                    status=StateHandler.FAILED.value,
-                )
+            return await self.handle_office_document(
+                document, content_type, client_id, textextraction_id, callback_url
+            )
         elif content_type == UrlTypes.IMG.value:
             logging.info(
                 "The input document is an image file. Applying OCR on this document."
             )
-            text_contents, structured_text, table_contents, images_dict = (
-                await handle_scanned_doc_or_image(
-                    url=url,
-                    is_image=True,
-                    s3_bucket_name=self.bucket_name,
-                    textextraction_id=textextraction_id,
-                    headers=self.headers,
+            with span("document_ocr"):
+                text_contents, structured_text, table_contents, images_dict, _ = (
+                    await handle_scanned_doc_or_image(
+                        file_path=document.name,
+                        is_image=True,
+                        s3_bucket_name=self.bucket_name,
+                        textextraction_id=textextraction_id,
+                        ocr_pool=self.ocr_pool,
+                        timeout=OCR_DOCUMENT_TIMEOUT_SECS,
+                    )
                 )
-            )
-            self._common_doc_handler_2(
+            return await self._common_doc_handler_2(
                 text_contents,
-                structured_text,
+                StructuredTextAssembler.from_pages(structured_text),
                 table_contents,
                 images_dict,
                 client_id,
@@ -688,6 +1692,56 @@ class TextExtractionHandler:
         """
         Dispatch results to callback url or write to database
         """
+        with span("dispatch", status=status):
+            self._dispatch_results(
+                client_id,
+                textextraction_id,
+                callback_url,
+                status,
+                text_presigned_url=text_presigned_url,
+                structured_text_presigned_url=structured_text_presigned_url,
+                total_pages=total_pages,
+                total_words_count=total_words_count,
+                table_contents=table_contents,
+                images_contents=images_contents,
+            )
+
+    def update_status_row(self, sql_statement):
+        db_client = Database(**self.db_config)
+        db_conn, db_cursor = db_client.db_connection()
+        status_update_db(db_conn, db_cursor, sql_statement)
+
+    def send_callback(self, callback_url, response_data, textextraction_id):
+        callback_response = send_request_on_callback(
+            callback_url, response_data=response_data, headers=self.headers
+        )
+        if not callback_response:
+            # Its own connection, the callback retry closes it
+            db_client = Database(**self.db_config)
+            db_conn, db_cursor = db_client.db_connection()
+            update_db_table_callback_retry(
+                db_conn,
+                db_cursor,
+                textextraction_id,
+                self.db_table_callback_tracker,
+            )
+
+    def _dispatch_results(
+        self,
+        client_id,
+        textextraction_id,
+        callback_url,
+        status,
+        text_presigned_url=None,
+        structured_text_presigned_url=None,
+        total_pages=None,
+        total_words_count=None,
+        table_contents=None,
+        images_contents=None,
+    ):
+        batch = current_batch.get()
+        if batch:
+            batch.set_status(textextraction_id, status)
         response_data = {
             "client_id": client_id,
             "text_path": text_presigned_url,
@@ -699,40 +1753,35 @@ class TextExtractionHandler:
             "status": status,
             "text_extraction_id": textextraction_id,
         }
-        if callback_url:
-            callback_response = send_request_on_callback(
-                callback_url, response_data=response_data, headers=self.headers
-            )
-            if not callback_response:
-                db_client = Database(**self.db_config)
-                db_conn, db_cursor = db_client.db_connection()
-                update_db_table_callback_retry(
-                    db_conn,
-                    db_cursor,
-                    textextraction_id,
-                    self.db_table_callback_tracker,
-                )
-        # Setup database connections
-        db_client = Database(**self.db_config)
-        db_conn, db_cursor = db_client.db_connection()
-
+        sql_statement = None
         if text_presigned_url and self.db_table_name:  # update for presigned url
             sql_statement = prepare_sql_statement_success(
                 textextraction_id, self.db_table_name, status, response_data
             )
-            status_update_db(db_conn, db_cursor, sql_statement)
-            logging.info("Updated the db table with event status %s", str(status))
         elif self.db_table_name:
             # Presigned url generation failed
             sql_statement = prepare_sql_statement_failure(
                 textextraction_id, self.db_table_name, status
             )
-            status_update_db(db_conn, db_cursor, sql_statement)
-            logging.info("Updated the db table with event status %s", str(status))
         else:
             logging.error(
                 "Callback url / presigned s3 url / Database table name are not found."
             )
+        send_callback = (
+            functools.partial(self.send_callback, callback_url, response_data, textextraction_id)
+            if callback_url
+            else None
+        )
+        # The status row is written before the callback, so that the client finds it
+        if sql_statement and batch:
+            # Written in bulk by the batch, which sends the callback once the row is written
+            batch.add_statement(sql_statement, on_written=send_callback)
+            return
+        if sql_statement:
+            self.update_status_row(sql_statement)
+            logging.info("Updated the db table with event status %s", str(status))
+        if send_callback:
+            send_callback()
 
 
 text_extraction_handler = TextExtractionHandler()
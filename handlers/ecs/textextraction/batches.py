@@ -0,0 +1,216 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import uuid
+
+logging.getLogger().setLevel(logging.INFO)
+
+# The batch of the running job, None for the single requests
+current_batch = contextvars.ContextVar("current_batch", default=None)
+
+
+class BatchStatus:
+    """Progress of the items of a batch (besides the dispatched statuses)"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+
+
+class Batch:
+    """
+    Items of a bulk extraction request, their progress and the resources shared
+    by their jobs: a single database connection, opened on the first dispatch,
+    and the status rows which are buffered and written in bulk (one transaction
+    every flush_size rows, and when the batch is flushed or closed). The callback
+    of a status row is sent once the row is written. The rows of a failed write
+    are kept and written again after a backoff, at most max_retries times.
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        items: list,
+        db_connect=None,
+        flush_size: int = 50,
+        max_retries: int = 5,
+        max_backoff: int = 60,
+    ):
+        self.batch_id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.items = {
+            item.textextraction_id: {"url": item.url, "status": BatchStatus.QUEUED}
+            for item in items
+        }
+        self.created_at = time.time()
+        self.finished_at = None
+        self.flush_size = flush_size
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._db_connect = db_connect
+        self._db_conn = None
+        self._db_cursor = None
+        self._statements = []  # (sql_statement, on_written)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = None
+        self._failures_count = 0
+        self._retry_at = 0.0
+
+    def set_status(self, textextraction_id: str, status):
+        if textextraction_id in self.items:
+            self.items[textextraction_id]["status"] = status
+
+    def db_connection(self):
+        """Connection and cursor shared by the dispatches of the batch"""
+        if self._db_conn is None:
+            self._db_conn, self._db_cursor = self._db_connect()
+        return self._db_conn, self._db_cursor
+
+    def add_statement(self, sql_statement, on_written=None):
+        """
+        Buffers the status update, written with the next flush. on_written (e.g.
+        the callback of the item) is called after the row is written.
+        """
+        with self._lock:
+            self._statements.append((sql_statement, on_written))
+            flush_due = len(self._statements) >= self.flush_size
+        if flush_due and self._flush_event is not None:
+            self._flush_event.set()
+
+    async def wait_flush(self, timeout: float):
+        """Waits for flush_size buffered rows, at most timeout secs"""
+        if self._flush_event is None:
+            self._flush_event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._flush_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_event.clear()
+
+    def flush(self, force: bool = False):
+        """
+        Writes the buffered status updates in a single transaction (blocking, run it
+        in a thread). After an error the connection is dropped and the rows are put
+        back, the next flush after the backoff (or a forced one) opens a new connection.
+        """
+        with self._flush_lock:
+            if not force and time.monotonic() < self._retry_at:
+                return
+            with self._lock:
+                statements, self._statements = self._statements, []
+            if not statements:
+                return
+            try:
+                db_conn, db_cursor = self.db_connection()
+                for sql_statement, _ in statements:
+                    db_cursor.execute(sql_statement)
+                db_conn.commit()
+                logging.info("Updated %s status rows of the batch %s", len(statements), self.batch_id)
+            except Exception as exc:
+                logging.error(
+                    "Could not update the status rows of the batch %s. %s", self.batch_id, str(exc)
+                )
+                if self._db_conn is not None:
+                    try:
+                        self._db_conn.rollback()
+                    except Exception as rexc:
+                        logging.warning("Could not roll back the batch transaction. %s", str(rexc))
+                self._close_connection()
+                self._failures_count += 1
+                if self._failures_count <= self.max_retries:
+                    self._retry_at = time.monotonic() + min(self.max_backoff, 2 ** self._failures_count)
+                    with self._lock:
+                        self._statements[:0] = statements
+                    return
+                logging.error(
+                    "Dropped %s status rows of the batch %s after %s failed writes.",
+                    len(statements),
+                    self.batch_id,
+                    self._failures_count,
+                )
+            self._failures_count = 0
+            self._retry_at = 0.0
+        self._run_on_written(statements)
+
+    def _run_on_written(self, statements):
+        for _, on_written in statements:
+            if on_written:
+                try:
+                    on_written()
+                except Exception as exc:
+                    logging.error("Could not dispatch the status row of the batch. %s", str(exc))
+
+    def _close_connection(self):
+        if self._db_conn is not None:
+            try:
+                self._db_conn.close()
+            except Exception as exc:
+                logging.warning("Could not close the batch db connection. %s", str(exc))
+        self._db_conn = self._db_cursor = None
+
+    def close(self):
+        """Writes the remaining rows (a last attempt) and closes the connection"""
+        self.flush(force=True)
+        with self._lock:
+            statements, self._statements = self._statements, []
+        if statements:
+            logging.error(
+                "Dropped %s status rows of the batch %s on close.", len(statements), self.batch_id
+            )
+            self._run_on_written(statements)
+        self._close_connection()
+        self.finished_at = time.time()
+
+    def progress(self):
+        counts = {}
+        for item in self.items.values():
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return {
+            "batch_id": self.batch_id,
+            "client_id": self.client_id,
+            "total": len(self.items),
+            "finished": self.finished_at is not None,
+            "counts": counts,
+            "items": [
+                {"textextraction_id": textextraction_id, **item}
+                for textextraction_id, item in self.items.items()
+            ],
+        }
+
+
+class BatchRegistry:
+    """Batches of the task by id, the finished ones are kept for retention secs"""
+
+    def __init__(self, retention: int = 3600):
+        self.retention = retention
+        self._batches = {}
+        self._tasks = set()
+
+    def _expire(self):
+        now = time.time()
+        for batch_id, batch in list(self._batches.items()):
+            if batch.finished_at and now - batch.finished_at > self.retention:
+                del self._batches[batch_id]
+
+    def add(self, batch: Batch, task):
+        self._expire()
+        self._batches[batch.batch_id] = batch
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def get(self, batch_id: str):
+        self._expire()
+        return self._batches.get(batch_id)
+
+    def stats(self):
+        return {
+            "running": sum(1 for batch in self._batches.values() if not batch.finished_at),
+            "queued_items": sum(
+                1
+                for batch in self._batches.values()
+                for item in batch.items.values()
+                if item["status"] == BatchStatus.QUEUED
+            ),
+        }
@@ -0,0 +1,401 @@
+"""
+Local stand-ins of the AWS services used by the text extraction.
+
+A single threaded http server plays the origin websites (the fixture corpus
+under /corpus/), a minimal S3 (path style PUT/GET/HEAD, copy and multipart
+uploads) and the document conversion Lambda. install() makes every boto3
+s3 and lambda client created afterwards point to it, and replaces the SQS and
+CloudWatch clients with in-memory ones. The webpages are read from the corpus
+by StandInWebExtractor instead of the selenium endpoint.
+"""
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import zipfile
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from urllib.request import urlopen
+
+import boto3
+import fitz
+from benchmarks.corpus import CONTENT_TYPES
+
+LAMBDA_INVOKE_PATH = re.compile(r"^/2015-03-31/functions/(?P<name>[^/]+)/invocations$")
+XML_TAGS = re.compile(r"<[^>]+>")
+HTML_BLOCK_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "li", "p", "td", "th"}
+
+
+class ObjectStore:
+    """Objects of the S3 stand-in, by (bucket, key)"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, body, headers):
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                "body": body,
+                "content_type": headers.get("Content-Type", "binary/octet-stream"),
+                "content_encoding": headers.get("Content-Encoding"),
+                "etag": hashlib.md5(body).hexdigest(),
+            }
+
+    def get(self, bucket, key):
+        with self.lock:
+            return self.objects.get((bucket, key))
+
+
+def office_text(body: bytes):
+    """Text of the office package (stand-in of the LibreOffice conversion)"""
+    texts = []
+    with zipfile.ZipFile(io.BytesIO(body)) as package:
+        for name in sorted(package.namelist()):
+            if name.endswith(".xml") and not name.startswith(("[", "_rels")):
+                text = XML_TAGS.sub(" ", package.read(name).decode("utf-8", "ignore"))
+                texts.append(" ".join(text.split()))
+    return "\n\n".join(text for text in texts if text)
+
+
+def text_to_pdf(text: str, chars_per_page: int = 2500):
+    pdf_document = fitz.open()
+    for start in range(0, max(len(text), 1), chars_per_page):
+        page = pdf_document.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text[start:start + chars_per_page], fontsize=10)
+    contents = pdf_document.tobytes()
+    pdf_document.close()
+    return contents
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StandIn/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def _send(self, status, body=b"", headers=None, head_only=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            if value is not None:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and not head_only:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _s3_error(self, status, code, head_only=False):
+        body = f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode()
+        self._send(status, body, {"Content-Type": "application/xml"}, head_only=head_only)
+
+    def _bucket_key(self, path):
+        bucket, _, key = unquote(path).lstrip("/").partition("/")
+        return bucket, key
+
+    # origin websites
+    def _serve_corpus(self, path, head_only):
+        file_name = os.path.basename(unquote(path))
+        file_path = os.path.join(self.server.corpus_dir, file_name)
+        if not os.path.isfile(file_path):
+            self._send(404, b"not found", head_only=head_only)
+            return
+        time.sleep(self.server.origin_latency)
+        with open(file_path, "rb") as f:
+            body = f.read()
+        headers = {
+            "Content-Type": CONTENT_TYPES.get(file_name.rsplit(".", 1)[-1]),
+            "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+            "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+        }
+        if self.headers.get("If-None-Match") == headers["ETag"]:
+            self._send(304, headers={"ETag": headers["ETag"]}, head_only=True)
+            return
+        range_match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if range_match:
+            first = int(range_match.group(1))
+            last = int(range_match.group(2) or len(body) - 1)
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(body)}"
+            self._send(206, body[first:last + 1], headers, head_only=head_only)
+            return
+        self._send(200, body, headers, head_only=head_only)
+
+    # lambda
+    def _invoke_lambda(self):
+        payload = json.loads(self._read_body() or b"{}")
+        time.sleep(self.server.lambda_latency)
+        source = self.store.get(payload["bucket"], payload["file"])
+        if source is None:
+            self._send(200, json.dumps({"statusCode": 404}).encode())
+            return
+        pdf_key = payload["file"].rsplit(".", 1)[0] + ".pdf"
+        self.store.put(
+            payload["bucket"],
+            pdf_key,
+            text_to_pdf(office_text(source["body"])),
+            {"Content-Type": "application/pdf"},
+        )
+        response = {"statusCode": 200, "bucket": payload["bucket"], "file": pdf_key}
+        self._send(200, json.dumps(response).encode(), {"Content-Type": "application/json"})
+
+    # s3
+    def do_HEAD(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path.startswith("/corpus/"):
+            self._serve_corpus(parsed_url.path, head_only=True)
+            return
+        obj = self.store.get(*self._bucket_key(parsed_url.path))
+        if obj is None:
+            self._s3_error(404, "NoSuchKey", head_only=True)
+            return
+        self._send(
+            200,
+            obj["body"],
+            {
+                "Content-Type": obj["content_type"],
+                "Content-Encoding": obj["content_encoding"],
+                "ETag": f'"{obj["etag"]}"',
+            },
+            head_only=True,
+        )
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path.startswith("/corpus/"):
+            self._serve_corpus(parsed_url.path, head_only=False)
+            return
+        obj = self.store.get(*self._bucket_key(parsed_url.path))
+        if obj is None:
+            self._s3_error(404, "NoSuchKey")
+            return
+        self._send(
+            200,
+            obj["body"],
+            {
+                "Content-Type": obj["content_type"],
+                "Content-Encoding": obj["content_encoding"],
+                "ETag": f'"{obj["etag"]}"',
+            },
+        )
+
+    def do_PUT(self):
+        parsed_url = urlparse(self.path)
+        params = parse_qs(parsed_url.query)
+        bucket, key = self._bucket_key(parsed_url.path)
+        body = self._read_body()
+        if "uploadId" in params:
+            with self.store.lock:
+                self.store.uploads[params["uploadId"][0]]["parts"][
+                    int(params["partNumber"][0])
+                ] = body
+            self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+            return
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source:
+            source = self.store.get(*self._bucket_key(unquote(copy_source).split("?")[0]))
+            if source is None:
+                self._s3_error(404, "NoSuchKey")
+                return
+            headers = {
+                "Content-Type": source["content_type"],
+                "Content-Encoding": source["content_encoding"],
+            }
+            if self.headers.get("x-amz-metadata-directive") == "REPLACE":
+                headers = self.headers
+            self.store.put(bucket, key, source["body"], headers)
+            result = (
+                f'<CopyObjectResult><ETag>"{source["etag"]}"</ETag>'
+                "<LastModified>2024-01-01T00:00:00.000Z</LastModified></CopyObjectResult>"
+            )
+            self._send(200, result.encode(), {"Content-Type": "application/xml"})
+            return
+        self.store.put(bucket, key, body, self.headers)
+        self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_POST(self):
+        parsed_url = urlparse(self.path)
+        lambda_match = LAMBDA_INVOKE_PATH.match(parsed_url.path)
+        if lambda_match:
+            self._invoke_lambda()
+            return
+        params = parse_qs(parsed_url.query, keep_blank_values=True)
+        bucket, key = self._bucket_key(parsed_url.path)
+        self._read_body()
+        if "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {"headers": dict(self.headers), "parts": {}}
+            result = (
+                f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+            self._send(200, result.encode(), {"Content-Type": "application/xml"})
+            return
+        if "uploadId" in params:
+            with self.store.lock:
+                upload = self.store.uploads.pop(params["uploadId"][0])
+            contents = b"".join(upload["parts"][number] for number in sorted(upload["parts"]))
+            self.store.put(bucket, key, contents, upload["headers"])
+            result = (
+                f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f'<ETag>"{hashlib.md5(contents).hexdigest()}"</ETag></CompleteMultipartUploadResult>'
+            )
+            self._send(200, result.encode(), {"Content-Type": "application/xml"})
+            return
+        self._s3_error(400, "InvalidRequest")
+
+
+class StandInServer:
+    """Origin, S3 and Lambda stand-in running in a background thread"""
+
+    def __init__(self, corpus_dir: str, origin_latency: float = 0.0, lambda_latency: float = 0.5):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = ObjectStore()
+        self.httpd.corpus_dir = corpus_dir
+        self.httpd.origin_latency = origin_latency
+        self.httpd.lambda_latency = lambda_latency
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def endpoint_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def corpus_url(self, file_name: str):
+        return f"{self.endpoint_url}/corpus/{file_name}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+class _BlockTextParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self._texts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_BLOCK_TAGS:
+            self._texts = []
+
+    def handle_endtag(self, tag):
+        if tag in HTML_BLOCK_TAGS and self._texts is not None:
+            text = " ".join("".join(self._texts).split())
+            if text:
+                self.entries.append(text)
+            self._texts = None
+
+    def handle_data(self, data):
+        if self._texts is not None:
+            self._texts.append(data)
+
+
+class StandInWebExtractor:
+    """Web extractor stand-in (of TextFromWeb), reads the page without a browser"""
+
+    def __init__(self, url: str = None):
+        self.url = url
+
+    def extract_text(self, output_format: str = "list", url: str = None):
+        with urlopen(url or self.url, timeout=30) as response:
+            page = response.read().decode("utf-8", "ignore")
+        parser = _BlockTextParser()
+        parser.feed(page)
+        parser.close()
+        if output_format == "list":
+            return parser.entries
+        return "\n\n".join(parser.entries)
+
+    def close(self):
+        pass
+
+
+class InMemorySQSClient:
+    """SQS stand-in with the calls of the consumer pool"""
+
+    def __init__(self):
+        self.messages = queue.Queue()
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        message_id = uuid.uuid4().hex
+        self.messages.put(
+            {
+                "MessageId": message_id,
+                "ReceiptHandle": message_id,
+                "Body": MessageBody,
+                "MessageAttributes": MessageAttributes or {},
+            }
+        )
+        return {"MessageId": message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        messages = []
+        try:
+            if WaitTimeSeconds:
+                messages.append(self.messages.get(timeout=min(WaitTimeSeconds, 0.2)))
+            else:
+                messages.append(self.messages.get_nowait())
+            while len(messages) < MaxNumberOfMessages:
+                messages.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return {"Messages": messages}
+
+    def delete_message(self, **kwargs):
+        return {}
+
+    def change_message_visibility(self, **kwargs):
+        return {}
+
+
+class InMemoryCloudWatchClient:
+    def __init__(self):
+        self.metric_data = []
+
+    def put_metric_data(self, Namespace, MetricData, **kwargs):
+        self.metric_data.extend(MetricData)
+        return {}
+
+
+def install(endpoint_url: str):
+    """Points the boto3 clients to the stand-ins, to be called before importing app"""
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stand-in")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stand-in")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    # The stand-in doesn't decode the aws-chunked bodies of the newer botocore checksums
+    os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    sqs_client = InMemorySQSClient()
+    cloudwatch_client = InMemoryCloudWatchClient()
+    original_client = boto3.session.Session.client
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name == "sqs":
+            return sqs_client
+        if service_name == "cloudwatch":
+            return cloudwatch_client
+        if service_name in ("s3", "lambda"):
+            kwargs["endpoint_url"] = endpoint_url
+        return original_client(self, service_name, *args, **kwargs)
+
+    boto3.session.Session.client = client
+    boto3.DEFAULT_SESSION = None
+    return sqs_client, cloudwatch_client
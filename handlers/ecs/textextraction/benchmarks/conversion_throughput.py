@@ -0,0 +1,97 @@
+"""
+Throughput of the office to pdf conversion backends.
+
+Run from handlers/ecs/textextraction, e.g.
+    python -m benchmarks.conversion_throughput --backend libreoffice --file sample.docx \
+        --documents 20 --concurrency 4 --pool-size 4
+
+The lambda backend needs the AWS credentials and the DOCS_CONVERSION_BUCKET_NAME
+and DOCS_CONVERT_LAMBDA_FN_NAME environment variables, the libreoffice backend
+only needs soffice in the PATH (or SOFFICE_PATH).
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.client import Config
+from converters import LambdaConverter, LibreOfficeConverter, load_local_document
+from http_client import percentile
+
+
+def create_converter(args):
+    if args.backend == LibreOfficeConverter.name:
+        return LibreOfficeConverter(pool_size=args.pool_size, timeout=args.timeout)
+    aws_region = os.environ.get("AWS_REGION", "us-east-1")
+    return LambdaConverter(
+        boto3.client(
+            "lambda",
+            region_name=aws_region,
+            config=Config(read_timeout=args.timeout, max_pool_connections=args.concurrency),
+        ),
+        boto3.client("s3", region_name=aws_region),
+        os.environ.get("DOCS_CONVERSION_BUCKET_NAME"),
+        os.environ.get("DOCS_CONVERT_LAMBDA_FN_NAME"),
+        executor=ThreadPoolExecutor(max_workers=args.concurrency),
+    )
+
+
+async def run_benchmark(args):
+    converter = create_converter(args)
+    ext_type = args.file.rsplit(".", 1)[-1].lower()
+    start_time = time.perf_counter()
+    await converter.start()
+    start_up_secs = time.perf_counter() - start_time
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def convert_one():
+        async with semaphore:
+            with load_local_document(args.file, args.file, content_type=None) as document:
+                conversion_start_time = time.perf_counter()
+                converted_document = await converter.convert(document, ext_type)
+                latencies.append(time.perf_counter() - conversion_start_time)
+                if converted_document:
+                    converted_document.close()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[convert_one() for _ in range(args.documents)])
+    elapsed_secs = time.perf_counter() - start_time
+    await converter.close()
+
+    stats = converter.stats()
+    return {
+        "backend": args.backend,
+        "documents": args.documents,
+        "concurrency": args.concurrency,
+        "failures": stats["failures"],
+        "start_up_secs": round(start_up_secs, 3),
+        "elapsed_secs": round(elapsed_secs, 3),
+        "documents_per_sec": round(args.documents / elapsed_secs, 3),
+        "latency_p50_secs": round(percentile(latencies, 50), 3),
+        "latency_p95_secs": round(percentile(latencies, 95), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backend",
+        choices=[LambdaConverter.name, LibreOfficeConverter.name],
+        default=LibreOfficeConverter.name,
+    )
+    parser.add_argument("--file", required=True, help="docx, xlsx, pptx, ... document")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=4, help="LibreOffice workers")
+    parser.add_argument("--timeout", type=int, default=120)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_benchmark(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Fixture corpus of the benchmarks, generated on the fly so that no binary
+fixture is kept in the repository: text, scanned and mixed pdfs, minimal
+docx/xlsx/pptx packages, an html page and a png image.
+"""
+import os
+import random
+import zipfile
+
+import fitz
+
+WORDS = (
+    "access affected area assessment assistance camp children community coverage "
+    "crisis displaced distribution drought education emergency food health "
+    "households humanitarian needs nutrition people population protection region "
+    "response risk sanitation security shelter support vulnerable water women"
+).split()
+
+OFFICE_CONTENT_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "html": "text/html; charset=utf-8",
+    "png": "image/png",
+    **OFFICE_CONTENT_TYPES,
+}
+
+
+def paragraphs(seed: int, count: int, words: int = 60):
+    rnd = random.Random(seed)
+    return [
+        " ".join(rnd.choice(WORDS) for _ in range(words)).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def text_pdf(pages: int, seed: int = 0):
+    """pdf with a text layer on every page"""
+    pdf_document = fitz.open()
+    for page_idx in range(pages):
+        page = pdf_document.new_page()
+        page.insert_textbox(
+            fitz.Rect(50, 50, 550, 800), "\n\n".join(paragraphs(seed + page_idx, 4)), fontsize=10
+        )
+    return pdf_document
+
+
+def scanned_pages_pdf(source_document, page_numbers, dpi: int = 100):
+    """Replaces the pages with their rendered image, i.e. pages without a text layer"""
+    pdf_document = fitz.open()
+    for page_idx in range(source_document.page_count):
+        source_page = source_document[page_idx]
+        if page_idx in page_numbers:
+            page = pdf_document.new_page(
+                width=source_page.rect.width, height=source_page.rect.height
+            )
+            page.insert_image(page.rect, pixmap=source_page.get_pixmap(dpi=dpi))
+        else:
+            pdf_document.insert_pdf(source_document, from_page=page_idx, to_page=page_idx)
+    return pdf_document
+
+
+def _write_package(file_path: str, parts: dict):
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as package:
+        for name, contents in parts.items():
+            package.writestr(name, contents)
+
+
+def _content_types_xml(overrides: dict):
+    override_tags = "".join(
+        f'<Override PartName="/{part}" ContentType="{content_type}"/>'
+        for part, content_type in overrides.items()
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f"{override_tags}</Types>"
+    )
+
+
+def _rels_xml(target: str):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+        f'relationships/officeDocument" Target="{target}"/></Relationships>'
+    )
+
+
+def write_docx(file_path: str, texts: list):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in texts)
+    _write_package(
+        file_path,
+        {
+            "[Content_Types].xml": _content_types_xml(
+                {
+                    "word/document.xml": "application/vnd.openxmlformats-officedocument."
+                    "wordprocessingml.document.main+xml"
+                }
+            ),
+            "_rels/.rels": _rels_xml("word/document.xml"),
+            "word/document.xml": (
+                '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w='
+                '"http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f"<w:body>{body}</w:body></w:document>"
+            ),
+        },
+    )
+
+
+def write_xlsx(file_path: str, texts: list):
+    rows = "".join(
+        f'<row r="{idx}"><c r="A{idx}" t="inlineStr"><is><t>{text}</t></is></c></row>'
+        for idx, text in enumerate(texts, start=1)
+    )
+    _write_package(
+        file_path,
+        {
+            "[Content_Types].xml": _content_types_xml(
+                {
+                    "xl/workbook.xml": "application/vnd.openxmlformats-officedocument."
+                    "spreadsheetml.sheet.main+xml",
+                    "xl/worksheets/sheet1.xml": "application/vnd.openxmlformats-officedocument."
+                    "spreadsheetml.worksheet+xml",
+                }
+            ),
+            "_rels/.rels": _rels_xml("xl/workbook.xml"),
+            "xl/workbook.xml": (
+                '<?xml version="1.0" encoding="UTF-8"?><workbook xmlns='
+                '"http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r='
+                '"http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+            ),
+            "xl/_rels/workbook.xml.rels": (
+                '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns='
+                '"http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+                'officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                "</Relationships>"
+            ),
+            "xl/worksheets/sheet1.xml": (
+                '<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns='
+                '"http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                f"<sheetData>{rows}</sheetData></worksheet>"
+            ),
+        },
+    )
+
+
+def write_pptx(file_path: str, texts: list):
+    """Minimal package, enough for the content type detection and the stand-in converter"""
+    slides = {
+        f"ppt/slides/slide{idx}.xml": (
+            '<?xml version="1.0" encoding="UTF-8"?><p:sld xmlns:p='
+            '"http://schemas.openxmlformats.org/presentationml/2006/main" xmlns:a='
+            '"http://schemas.openxmlformats.org/drawingml/2006/main"><p:cSld><p:spTree>'
+            f"<p:sp><p:txBody><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:txBody></p:sp>"
+            "</p:spTree></p:cSld></p:sld>"
+        )
+        for idx, text in enumerate(texts, start=1)
+    }
+    _write_package(
+        file_path,
+        {
+            "[Content_Types].xml": _content_types_xml(
+                {
+                    "ppt/presentation.xml": "application/vnd.openxmlformats-officedocument."
+                    "presentationml.presentation.main+xml"
+                }
+            ),
+            "_rels/.rels": _rels_xml("ppt/presentation.xml"),
+            "ppt/presentation.xml": (
+                '<?xml version="1.0" encoding="UTF-8"?><p:presentation xmlns:p='
+                '"http://schemas.openxmlformats.org/presentationml/2006/main"/>'
+            ),
+            **slides,
+        },
+    )
+
+
+def write_html(file_path: str, texts: list):
+    body = "".join(f"<p>{text}</p>" for text in texts)
+    with open(file_path, "w") as f:
+        f.write(
+            "<!DOCTYPE html><html><head><title>Situation report</title></head>"
+            f"<body><h1>Situation report</h1>{body}</body></html>"
+        )
+
+
+def build_corpus(corpus_dir: str, large_pdf_pages: int = 120):
+    """Writes the fixtures, returns {fixture name: file name}"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    fixtures = {}
+
+    for name, pages in (("text_pdf_small", 2), ("text_pdf_medium", 20), ("text_pdf_large", large_pdf_pages)):
+        with text_pdf(pages, seed=pages) as pdf_document:
+            pdf_document.save(os.path.join(corpus_dir, f"{name}.pdf"))
+        fixtures[name] = f"{name}.pdf"
+
+    with text_pdf(5, seed=5) as source_document:
+        with scanned_pages_pdf(source_document, range(5)) as pdf_document:
+            pdf_document.save(os.path.join(corpus_dir, "scanned_pdf.pdf"))
+        fixtures["scanned_pdf"] = "scanned_pdf.pdf"
+    with text_pdf(10, seed=10) as source_document:
+        with scanned_pages_pdf(source_document, (3, 6, 9)) as pdf_document:
+            pdf_document.save(os.path.join(corpus_dir, "mixed_pdf.pdf"))
+        fixtures["mixed_pdf"] = "mixed_pdf.pdf"
+
+    texts = paragraphs(seed=42, count=30)
+    for ext, writer in (("docx", write_docx), ("xlsx", write_xlsx), ("pptx", write_pptx)):
+        writer(os.path.join(corpus_dir, f"office.{ext}"), texts)
+        fixtures[ext] = f"office.{ext}"
+
+    write_html(os.path.join(corpus_dir, "page.html"), texts)
+    fixtures["html"] = "page.html"
+
+    with text_pdf(1, seed=7) as pdf_document:
+        pdf_document[0].get_pixmap(dpi=100).save(os.path.join(corpus_dir, "image.png"))
+    fixtures["image"] = "image.png"
+    return fixtures
@@ -0,0 +1,265 @@
+"""
+Offline throughput benchmark of the text extraction.
+
+The fixture corpus is served by a local http server which also stands in for
+S3 and the conversion Lambda (SQS and CloudWatch are in memory, the webpages
+are read without the selenium endpoint), so no AWS account or origin website
+is needed. The jobs are driven through
+TextExtractionHandler.__call__ ("handler" mode), the /extract_document
+endpoint with user requests ("endpoint" mode) and with system requests
+going through the queue consumer ("queue" mode), at several concurrency
+levels. The report has the throughput, the job and per-stage latency
+percentiles (from the stage spans of the timings module) and the peak RSS
+(including the worker processes).
+
+Run from handlers/ecs/textextraction, e.g.
+    python -m benchmarks.harness --concurrency 1 4 8 --repeat 2 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import psutil
+from benchmarks import aws_stand_ins
+from benchmarks.corpus import build_corpus
+from http_client import percentile
+from timings import stage_metrics
+
+MODES = ("handler", "endpoint", "queue")
+
+
+class RSSSampler:
+    """Peak resident memory of the process and its children"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+class JobTracker:
+    """Replaces the dispatch (callback / database) and resolves the job futures"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.futures = {}
+
+    def new_job(self):
+        textextraction_id = uuid.uuid4().hex
+        self.futures[textextraction_id] = self.loop.create_future()
+        return textextraction_id
+
+    def dispatch_results(self, client_id, textextraction_id, callback_url, status, **kwargs):
+        future = self.futures.get(textextraction_id)
+        if future is not None:
+            self.loop.call_soon_threadsafe(
+                lambda: future.done() or future.set_result(status)
+            )
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "p50_secs": round(percentile(values, 50), 3) if values else None,
+        "p95_secs": round(percentile(values, 95), 3) if values else None,
+        "p99_secs": round(percentile(values, 99), 3) if values else None,
+    }
+
+
+async def submit_to_endpoint(client, item: dict):
+    while True:
+        response = await client.post("/extract_document", json=item)
+        if response.status_code != 429:
+            response.raise_for_status()
+            return
+        await asyncio.sleep(min(2, int(response.headers.get("Retry-After", 1))))
+
+
+async def run_level(app, mode, concurrency, jobs, tracker, job_timeout):
+    """Runs the jobs at the concurrency level, returns the report of the run"""
+    handler = app.text_extraction_handler
+    app.scheduler.max_concurrency = concurrency
+    app.sqs_consumer_pool.concurrency = concurrency
+    stage_metrics.drain()
+    latencies = defaultdict(list)
+    statuses = defaultdict(int)
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app.ecs_app)
+
+    async def run_job(client, idx, fixture, url):
+        textextraction_id = tracker.new_job()
+        client_id = f"client_{idx % 4}"
+        start_time = time.perf_counter()
+        if mode == "handler":
+            async with semaphore:
+                await handler(client_id, url, textextraction_id, None)
+        else:
+            request_type = app.RequestType.USER if mode == "endpoint" else app.RequestType.SYSTEM
+            await submit_to_endpoint(
+                client,
+                {
+                    "client_id": client_id,
+                    "url": url,
+                    "textextraction_id": textextraction_id,
+                    "callback_url": None,
+                    "request_type": request_type.value,
+                },
+            )
+        try:
+            status = await asyncio.wait_for(tracker.futures[textextraction_id], job_timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        latencies[fixture].append(time.perf_counter() - start_time)
+        statuses[str(status)] += 1
+
+    with RSSSampler() as rss_sampler:
+        start_time = time.perf_counter()
+        async with httpx.AsyncClient(transport=transport, base_url="http://textextraction") as client:
+            await asyncio.gather(
+                *[run_job(client, idx, fixture, url) for idx, (fixture, url) in enumerate(jobs)]
+            )
+        elapsed_secs = time.perf_counter() - start_time
+    stage_durations = stage_metrics.drain()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "jobs": len(jobs),
+        "statuses": dict(statuses),
+        "elapsed_secs": round(elapsed_secs, 3),
+        "jobs_per_sec": round(len(jobs) / elapsed_secs, 3),
+        "peak_rss_mb": round(rss_sampler.peak_rss / 1024 / 1024, 1),
+        "job_latency": latency_summary(all_latencies),
+        "fixture_latency": {fixture: latency_summary(values) for fixture, values in latencies.items()},
+        "stage_latency": {
+            stage: latency_summary(values) for stage, values in sorted(stage_durations.items())
+        },
+    }
+
+
+def print_report(report):
+    print(
+        f"\n{report['mode']} concurrency={report['concurrency']} jobs={report['jobs']} "
+        f"{report['jobs_per_sec']} jobs/s peak_rss={report['peak_rss_mb']} MB "
+        f"statuses={report['statuses']}"
+    )
+    print(f"  {'stage':<28}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = [("job", report["job_latency"])] + list(report["stage_latency"].items())
+    for name, summary in rows:
+        print(
+            f"  {name:<28}{summary['count']:>7}{summary['p50_secs']:>9}"
+            f"{summary['p95_secs']:>9}{summary['p99_secs']:>9}"
+        )
+
+
+async def run_benchmark(args, app, server, fixtures):
+    tracker = JobTracker(asyncio.get_running_loop())
+    app.text_extraction_handler._dispatch_results = tracker.dispatch_results
+    background_tasks = [
+        asyncio.create_task(app.scheduler.dispatch()),
+        asyncio.create_task(app.sqs_consumer_pool.run()),
+    ]
+    await app.text_extraction_handler.converter.start()
+
+    selected_fixtures = args.fixtures or list(fixtures)
+    jobs = [
+        (fixture, server.corpus_url(fixtures[fixture]))
+        for _ in range(args.repeat)
+        for fixture in selected_fixtures
+    ]
+    reports = []
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            report = await run_level(
+                app, mode, concurrency, jobs, tracker, args.job_timeout
+            )
+            print_report(report)
+            reports.append(report)
+
+    for task in background_tasks:
+        task.cancel()
+    await app.text_extraction_handler.converter.close()
+    await app.http_client.aclose()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline text extraction benchmark")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["handler", "endpoint"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=2, help="submissions of every fixture")
+    parser.add_argument("--fixtures", nargs="+", help="subset of the fixtures (all by default)")
+    parser.add_argument("--large-pdf-pages", type=int, default=120)
+    parser.add_argument("--origin-latency", type=float, default=0.0, help="secs per origin request")
+    parser.add_argument("--lambda-latency", type=float, default=0.5, help="secs per conversion")
+    parser.add_argument("--job-timeout", type=float, default=600)
+    parser.add_argument("--cache", action="store_true", help="keep the extraction cache enabled")
+    parser.add_argument("--output", help="writes the report as json")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp(prefix="textextraction_corpus_")
+    fixtures = build_corpus(corpus_dir, large_pdf_pages=args.large_pdf_pages)
+    server = aws_stand_ins.StandInServer(
+        corpus_dir, origin_latency=args.origin_latency, lambda_latency=args.lambda_latency
+    ).start()
+    aws_stand_ins.install(server.endpoint_url)
+
+    os.environ.setdefault("S3_BUCKET_NAME", "benchmark-results")
+    os.environ.setdefault("DOCS_CONVERSION_BUCKET_NAME", "benchmark-conversion")
+    os.environ.setdefault("DOCS_CONVERT_LAMBDA_FN_NAME", "benchmark-docs-convert")
+    os.environ.setdefault("SQS_QUEUE_URL", f"{server.endpoint_url}/queue")
+    os.environ["EXTRACTION_CACHE_ENABLED"] = "true" if args.cache else "false"
+
+    import app  # noqa: E402, the stand-ins have to be installed before the clients are created
+
+    # The webpages are read from the stand-in server, not through the selenium endpoint
+    app.text_extraction_handler.web_sessions.factory = aws_stand_ins.StandInWebExtractor
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    try:
+        reports = asyncio.run(run_benchmark(args, app, server, fixtures))
+    finally:
+        server.stop()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"fixtures": fixtures, "runs": reports}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,6 @@
 import logging
 from enum import Enum
 
-import httpx
-from wget import download
-
 logging.getLogger().setLevel(logging.INFO)
 
 
@@ -37,6 +34,72 @@ extension_to_enum_map = {
     "bmp": UrlTypes.IMG,
 }
 
+# Only the first bytes of the document are needed to sniff its type
+SNIFF_SIZE = 8 * 1024
+
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_SIGNATURE = b"PK\x03\x04"
+IMAGE_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF87a",
+    b"GIF89a",
+    b"BM",
+    b"II*\x00",  # tiff (little endian)
+    b"MM\x00*",  # tiff (big endian)
+)
+# Directories of the OOXML zip archives
+OOXML_DIRECTORIES = {
+    b"word/": UrlTypes.DOCX,
+    b"xl/": UrlTypes.XLSX,
+    b"ppt/": UrlTypes.PPTX,
+}
+# Stream names (utf-16-le) of the OLE2 compound documents
+OLE2_STREAMS = {
+    "WordDocument".encode("utf-16-le"): UrlTypes.MSWORD,
+    "Workbook".encode("utf-16-le"): UrlTypes.XLS,
+    "Book".encode("utf-16-le"): UrlTypes.XLS,
+    "PowerPoint Document".encode("utf-16-le"): UrlTypes.PPT,
+}
+HTML_MARKERS = (b"<!doctype html", b"<html", b"<head", b"<body")
+
+
+def sniff_content_type(prefix: bytes, extension: str = None):
+    """
+    Classifies the document by the signature of its first bytes.
+    The extension is only used when the signature is ambiguous
+    (e.g. a zip/OLE2 container whose parts are not in the prefix).
+    """
+    if not prefix:
+        return None
+    hinted_type = extension_to_enum_map.get(extension)
+    if prefix.startswith(b"%PDF-"):
+        return UrlTypes.PDF
+    if prefix.startswith(ZIP_SIGNATURE):
+        if b"[Content_Types].xml" not in prefix and hinted_type is None:
+            return None
+        for directory, url_type in OOXML_DIRECTORIES.items():
+            if directory in prefix:
+                return url_type
+        if hinted_type in (UrlTypes.DOCX, UrlTypes.XLSX, UrlTypes.PPTX):
+            return hinted_type
+        return None
+    if prefix.startswith(OLE2_SIGNATURE):
+        for stream_name, url_type in OLE2_STREAMS.items():
+            if stream_name in prefix:
+                return url_type
+        if hinted_type in (UrlTypes.MSWORD, UrlTypes.XLS, UrlTypes.PPT):
+            return hinted_type
+        return None
+    if prefix.startswith(IMAGE_SIGNATURES) or (
+        prefix.startswith(b"RIFF") and prefix[8:12] == b"WEBP"
+    ):
+        return UrlTypes.IMG
+    text_prefix = prefix[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if any(marker in text_prefix for marker in HTML_MARKERS):
+        return UrlTypes.HTML
+    return None
+
 
 class ExtractContentType:
     """
@@ -53,18 +116,19 @@ class ExtractContentType:
             "text/html;charset=utf-8",
             "text/plain",
         )
+        # Tuples, a missing Content-Type (None) is not in any of them
         self.content_types_docx = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         )
-        self.content_types_doc = "application/msword"
+        self.content_types_doc = ("application/msword",)
         self.content_types_pptx = (
-            "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
         )
-        self.content_types_ppt = "application/vnd.ms-powerpoint"
+        self.content_types_ppt = ("application/vnd.ms-powerpoint",)
         self.content_types_xlsx = (
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-        self.content_types_xls = "application/vnd.ms-excel"
+        self.content_types_xls = ("application/vnd.ms-excel",)
         self.content_types_img = (
             "image/jpeg",
             "image/gif",
@@ -75,36 +139,32 @@ class ExtractContentType:
             "image/tiff",
         )
 
-    async def get_content_type(self, url: str, req_headers: dict, timeout: int = 30):
+    def document_content_type(self, document):
+        """Content type of the (partially) downloaded document, from its headers and first bytes"""
+        return self._resolve_content_type(
+            document.url, document.content_type, document.prefix, document.extension
+        )
+
+    def _resolve_content_type(
+        self, url: str, content_type: str, prefix: bytes = None, extension: str = None
+    ):
         """
-        Retrieve the content type of the url
+        Maps the url and its Content-Type header to the url type.
+        Falls back to the signature of the first bytes and then to the file extension.
         """
-        try:
-            async with httpx.AsyncClient() as httpx_client:
-                response = await httpx_client.head(
-                    url, headers=req_headers, timeout=timeout
-                )
-            content_type = response.headers.get("Content-Type", None)
-            if not content_type:
-                return None
-        except httpx.InvalidURL as url_err:
-            logging.error("The URL is invalid %s", str(url_err))
-            return None
-        except httpx.TimeoutException as timeout_err:
-            logging.warning("Timeout occurred: %s", str(timeout_err))
-            return None
-        except httpx.HTTPError as httperr:
-            logging.warning(
-                "Error occurred while requesting information from the url. %s",
-                str(httperr),
-            )
-            return None
-        except Exception as exc:
-            logging.warning(
-                "Error occurred while requesting information from the url. %s", str(exc)
-            )
-            return None
+        url_type = self._content_type_from_headers(url, content_type)
+        if url_type:
+            return url_type
+        url_type = sniff_content_type(prefix, extension)
+        if url_type:
+            return url_type.value
+        if extension in extension_to_enum_map:
+            return extension_to_enum_map[extension].value
+        logging.warning("Could not determine the content-type of the %s", url)
+        return None
 
+    def _content_type_from_headers(self, url: str, content_type: str):
+        """Maps the url and its Content-Type header to the url type"""
         logging.info("The content type of %s is %s", url, content_type)
 
         if url.endswith(".pdf"):
@@ -132,19 +192,4 @@ class ExtractContentType:
             ]
         ):
             return UrlTypes.IMG.value
-        else:
-            try:
-                logging.info("Downloading the file to check for the extension.")
-                temp_filepath = download(url, out="/tmp/")
-            except Exception:
-                logging.error(
-                    "Error while downloading the file from %s to check the file extension.",
-                    url,
-                )
-                return None
-
-            file_extension = temp_filepath.split(".")[-1]
-            if file_extension not in extension_to_enum_map:
-                logging.warning("Could not determine the content-type of the %s", url)
-                return None
-            return extension_to_enum_map[file_extension].value
+        return None
@@ -0,0 +1,247 @@
+import abc
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from document import SpooledDocument
+from s3handler import Storage
+from utils import download_s3_document, invoke_conversion_lambda
+
+logging.getLogger().setLevel(logging.INFO)
+
+SOFFICE_PATH = os.environ.get("SOFFICE_PATH", "soffice")
+
+
+def load_local_document(file_path: str, url: str, content_type: str = "application/pdf"):
+    """Copies the local file into a spooled document"""
+    document = SpooledDocument(url, {"Content-Type": content_type})
+    try:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                document.write(chunk)
+    except Exception:
+        document.close()
+        raise
+    document.flush()
+    return document
+
+
+class DocumentConverter(abc.ABC):
+    """
+    Converts the office documents (docx, xlsx, doc, xls, ppt, pptx) to pdf.
+    The backends implement _convert which returns the local copy of the pdf
+    or None if the conversion failed.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.conversions_count = 0
+        self.failures_count = 0
+        self.total_secs = 0.0
+
+    async def start(self):
+        """Prepares the backend, called once at startup"""
+
+    async def close(self):
+        """Releases the resources of the backend"""
+
+    @abc.abstractmethod
+    async def _convert(self, document, ext_type: str):
+        """Local copy of the pdf conversion of the document, None if it failed"""
+
+    async def convert(self, document, ext_type: str):
+        """Returns the pdf conversion of the document, None on failure"""
+        start_time = time.perf_counter()
+        try:
+            converted_document = await self._convert(document, ext_type)
+        except Exception as exc:
+            logging.error(
+                "The %s conversion of the document failed. %s", self.name, repr(exc)
+            )
+            converted_document = None
+        self.conversions_count += 1
+        self.total_secs += time.perf_counter() - start_time
+        if converted_document is None:
+            self.failures_count += 1
+        return converted_document
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "conversions": self.conversions_count,
+            "failures": self.failures_count,
+            "avg_conversion_secs": (
+                round(self.total_secs / self.conversions_count, 3)
+                if self.conversions_count
+                else None
+            ),
+        }
+
+
+class LambdaConverter(DocumentConverter):
+    """Converts the documents with the LibreOffice lambda function through s3"""
+
+    name = "lambda"
+
+    def __init__(
+        self, lambda_client, s3_client, bucket_name: str, function_name: str, executor=None
+    ):
+        super().__init__()
+        self.lambda_client = lambda_client
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.function_name = function_name
+        self.executor = executor
+
+    async def _convert(self, document, ext_type: str):
+        # The content hash is a collision free name, the same document is simply overwritten
+        tmp_filename = f"{document.content_hash()}.{ext_type}"
+
+        s3_uploader = Storage(self.bucket_name, "")
+        with document.open() as tmpf:
+            await s3_uploader.aupload(tmp_filename, tmpf)
+        docs_conversion_lambda_response_json = await invoke_conversion_lambda(
+            self.lambda_client,
+            self.bucket_name,
+            self.function_name,
+            tmp_filename,
+            ext_type,
+            executor=self.executor,
+        )
+        if (
+            not docs_conversion_lambda_response_json or
+            docs_conversion_lambda_response_json.get("statusCode") != 200
+        ):
+            return None
+        return await asyncio.to_thread(
+            download_s3_document,
+            self.s3_client,
+            docs_conversion_lambda_response_json["bucket"],
+            docs_conversion_lambda_response_json["file"],
+        )
+
+
+class LibreOfficeConverter(DocumentConverter):
+    """
+    Converts the documents with headless LibreOffice inside the container.
+    LibreOffice can't run two instances on the same user profile, so every
+    worker of the pool has its own profile, initialised once at startup by a
+    warm-up conversion. The conversions then skip the first start cost and
+    up to pool_size of them run in parallel.
+    """
+
+    name = "libreoffice"
+
+    def __init__(self, pool_size: int = 2, timeout: int = 120, soffice_path: str = SOFFICE_PATH):
+        super().__init__()
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.soffice_path = soffice_path
+        self._work_dir = None
+        self._profiles = None
+        self._start_lock = asyncio.Lock()
+
+    def _profile_dir(self, worker_id: int):
+        return os.path.join(self._work_dir, f"profile_{worker_id}")
+
+    async def _run_soffice(self, profile_dir: str, input_path: str, output_dir: str):
+        process = await asyncio.create_subprocess_exec(
+            self.soffice_path,
+            f"-env:UserInstallation=file://{profile_dir}",
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--norestore",
+            "--nolockcheck",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            output_dir,
+            input_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,  # soffice forks soffice.bin, both are killed on timeout
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Also when the job is cancelled, the conversion would outlive it otherwise
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            # The profile may be left inconsistent, it is created again by the next run
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode("utf-8", "ignore").strip())
+
+    async def _warm_up(self, worker_id: int):
+        profile_dir = self._profile_dir(worker_id)
+        warm_up_dir = tempfile.mkdtemp(dir=self._work_dir)
+        try:
+            input_path = os.path.join(warm_up_dir, "warm_up.txt")
+            with open(input_path, "w") as f:
+                f.write("warm up")
+            await self._run_soffice(profile_dir, input_path, warm_up_dir)
+        finally:
+            shutil.rmtree(warm_up_dir, ignore_errors=True)
+
+    async def start(self):
+        async with self._start_lock:
+            if self._profiles is not None:
+                return
+            self._work_dir = tempfile.mkdtemp(prefix="libreoffice_")
+            start_time = time.perf_counter()
+            results = await asyncio.gather(
+                *[self._warm_up(worker_id) for worker_id in range(self.pool_size)],
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logging.warning("Could not warm up the LibreOffice worker. %s", repr(result))
+            logging.info(
+                "Started %s LibreOffice workers in %.2f secs",
+                self.pool_size,
+                time.perf_counter() - start_time,
+            )
+            profiles = asyncio.Queue()
+            for worker_id in range(self.pool_size):
+                profiles.put_nowait(self._profile_dir(worker_id))
+            self._profiles = profiles
+
+    async def close(self):
+        if self._work_dir:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+
+    async def _convert(self, document, ext_type: str):
+        if self._profiles is None:
+            await self.start()
+        profile_dir = await self._profiles.get()
+        job_dir = tempfile.mkdtemp(dir=self._work_dir)
+        try:
+            # LibreOffice picks the import filter by the file extension
+            input_path = os.path.join(job_dir, f"source.{ext_type}")
+            await asyncio.to_thread(shutil.copyfile, document.name, input_path)
+            await self._run_soffice(profile_dir, input_path, job_dir)
+            output_path = os.path.join(job_dir, "source.pdf")
+            if not os.path.isfile(output_path):
+                return None
+            return await asyncio.to_thread(load_local_document, output_path, document.url)
+        finally:
+            self._profiles.put_nowait(profile_dir)
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "pool_size": self.pool_size,
+            "idle_workers": self._profiles.qsize() if self._profiles is not None else None,
+        }
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import logging
+import tempfile
+
+from content_types import SNIFF_SIZE
+from wget import filename_from_headers, filename_from_url
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def validators_from_headers(headers):
+    """ETag and Last-Modified validators of the response, empty if none is present"""
+    validators = {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+    if not any(validators.values()):
+        return {}
+    return validators
+
+
+class SpooledDocument:
+    """
+    Local copy of the document shared by every stage of a job
+    (content type detection, text extraction, table OCR and conversion).
+    The document is fetched only once from the origin.
+    """
+
+    def __init__(self, url: str, response_headers=None):
+        self.url = url
+        self.response_headers = response_headers or {}
+        self.content_type = self.response_headers.get("Content-Type", None)
+        self.filename = filename_from_headers(
+            self.response_headers
+        ) or filename_from_url(url)
+        self.size = 0
+        self.prefix = b""
+        self.has_body = False
+        # The origin answered a conditional request with 304 Not Modified
+        self.not_modified = False
+        self._sha256 = hashlib.sha256()
+        self._tempf = tempfile.NamedTemporaryFile(mode="w+b")
+
+    @property
+    def name(self):
+        """Path of the local copy"""
+        return self._tempf.name
+
+    @property
+    def validators(self):
+        """Validators of the origin response"""
+        return validators_from_headers(self.response_headers)
+
+    @property
+    def extension(self):
+        """File extension from the Content-Disposition header or the url"""
+        if self.filename and "." in self.filename:
+            return self.filename.rsplit(".", 1)[-1].lower()
+        return None
+
+    def write(self, chunk: bytes):
+        """Appends the chunk to the local copy"""
+        self._tempf.write(chunk)
+        self._sha256.update(chunk)
+        if len(self.prefix) < SNIFF_SIZE:
+            self.prefix += chunk[: SNIFF_SIZE - len(self.prefix)]
+        self.size += len(chunk)
+        self.has_body = True
+
+    def flush(self):
+        """Makes the local copy readable from its path"""
+        self._tempf.flush()
+        self._tempf.seek(0)
+
+    def content_hash(self):
+        """sha256 of the document contents"""
+        return self._sha256.hexdigest()
+
+    def open(self):
+        """Opens the local copy for reading"""
+        return open(self.name, "rb")
+
+    def read_base64(self):
+        """Document contents in the format expected by the deep parser"""
+        with self.open() as f:
+            return base64.b64encode(f.read())
+
+    def close(self):
+        """Deletes the local copy"""
+        try:
+            self._tempf.close()
+        except OSError:
+            logging.warning("Could not delete the document temporary file.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logging.getLogger().setLevel(logging.INFO)
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 6))
+HTTP_KEEPALIVE_EXPIRY_SECS = int(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SECS", 30))
+
+
+class HostSlot:
+    """Concurrent requests cap of a host, with the number of requests holding or waiting for it"""
+
+    def __init__(self, max_connections: int):
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.users = 0
+
+
+def percentile(values, pct: float):
+    """Nearest rank percentile of the values"""
+    if not values:
+        return None
+    sorted_values = sorted(values)
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class PooledHttpClient:
+    """
+    Process wide async http client used for all the outbound fetches.
+    Connections are kept alive and reused (HTTP/2 is negotiated when the h2
+    package is installed), and the concurrent requests to a single host are
+    capped so that one slow domain can't use up the whole pool. The cap of a
+    host is dropped once it has no request, so only the busy hosts are tracked.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_expiry: int = HTTP_KEEPALIVE_EXPIRY_SECS,
+        latency_window: int = 1000,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        self._client = None
+        self._host_slots = {}
+        self.requests_count = 0
+        self.new_connections_count = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    @property
+    def client(self):
+        """The underlying httpx client, created lazily inside the running event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=self.limits)
+        return self._client
+
+    @asynccontextmanager
+    async def _host_slot(self, url):
+        host = urlparse(str(url)).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = HostSlot(self.max_connections_per_host)
+        slot.users += 1
+        try:
+            async with slot.semaphore:
+                yield
+        finally:
+            slot.users -= 1
+            if not slot.users and self._host_slots.get(host) is slot:
+                del self._host_slots[host]
+
+    async def _trace(self, event_name: str, info: dict):
+        """httpcore trace hook to count the requests and the newly opened connections"""
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections_count += 1
+        elif event_name.endswith("send_request_headers.started"):
+            self.requests_count += 1
+
+    def _record_latency(self, start_time: float):
+        self._latencies.append(time.perf_counter() - start_time)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """Streams the response, see httpx.AsyncClient.stream"""
+        async with self._host_slot(url):
+            start_time = time.perf_counter()
+            async with self.client.stream(
+                method, url, extensions={"trace": self._trace}, **kwargs
+            ) as response:
+                self._record_latency(start_time)
+                yield response
+
+    async def request(self, method: str, url: str, **kwargs):
+        """Sends the request, see httpx.AsyncClient.request"""
+        async with self._host_slot(url):
+            start_time = time.perf_counter()
+            response = await self.client.request(
+                method, url, extensions={"trace": self._trace}, **kwargs
+            )
+            self._record_latency(start_time)
+            return response
+
+    async def head(self, url: str, **kwargs):
+        return await self.request("HEAD", url, **kwargs)
+
+    def stats(self):
+        """Connection reuse and latency (time to the response headers) metrics"""
+        latencies = list(self._latencies)
+        reused_connections = max(0, self.requests_count - self.new_connections_count)
+        return {
+            "http2_enabled": HTTP2_AVAILABLE,
+            "busy_hosts": len(self._host_slots),
+            "requests": self.requests_count,
+            "new_connections": self.new_connections_count,
+            "reused_connections": reused_connections,
+            "connection_reuse_ratio": (
+                round(reused_connections / self.requests_count, 3)
+                if self.requests_count
+                else None
+            ),
+            "latency_p50_secs": percentile(latencies, 50),
+            "latency_p95_secs": percentile(latencies, 95),
+            "latency_p99_secs": percentile(latencies, 99),
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+http_client = PooledHttpClient()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def perceptual_hash(file_path: str, hash_size: int = 8):
+    """
+    Difference hash of the image: the brightness gradients of a downscaled grayscale
+    copy, so that resized or re-encoded copies of an image get the same (or a close) hash.
+    """
+    with Image.open(file_path) as img:
+        img.draft("L", (hash_size * 4, hash_size * 4))
+        pixels = list(
+            img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+        )
+    image_hash = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            image_hash = (image_hash << 1) | (left > right)
+    return image_hash
+
+
+def hash_distance(hash_a: int, hash_b: int):
+    return bin(hash_a ^ hash_b).count("1")
+
+
+class ImageIndex:
+    """
+    Small LRU index of the uploaded images by perceptual hash, shared by the
+    documents of a client (scope), so that an image already uploaded for an
+    earlier document is presigned again instead of uploaded. The entries are
+    kept ttl secs, which must stay below the retention of the images in s3.
+    """
+
+    def __init__(self, max_entries: int = 2000, max_distance: int = 4, ttl: int = 86400):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._images = OrderedDict()
+        self.hits_count = 0
+        self.misses_count = 0
+
+    def find(self, scope: str, image_hash: int):
+        """S3 key of the same (or a near identical) image of the scope, None otherwise"""
+        now = time.monotonic()
+        for entry_key in list(self._images):
+            if now - self._images[entry_key]["stored_at"] <= self.ttl:
+                break
+            del self._images[entry_key]
+        entry_key = (scope, image_hash)
+        if entry_key not in self._images:
+            entry_key = next(
+                (
+                    (entry_scope, entry_hash)
+                    for entry_scope, entry_hash in reversed(self._images)
+                    if entry_scope == scope and
+                    hash_distance(entry_hash, image_hash) <= self.max_distance
+                ),
+                None,
+            )
+        if entry_key is None:
+            self.misses_count += 1
+            return None
+        self.hits_count += 1
+        self._images.move_to_end(entry_key)
+        return self._images[entry_key]["key"]
+
+    def add(self, scope: str, image_hash: int, key: str):
+        self._images.pop((scope, image_hash), None)
+        self._images[(scope, image_hash)] = {"key": key, "stored_at": time.monotonic()}
+        while len(self._images) > self.max_entries:
+            self._images.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits_count + self.misses_count
+        return {
+            "images": len(self._images),
+            "hits": self.hits_count,
+            "misses": self.misses_count,
+            "hit_rate": round(self.hits_count / lookups, 3) if lookups else None,
+        }
+
+
+class DocumentImages:
+    """
+    Uploads of the images of a document, deduplicated by perceptual hash: a copy
+    of an image of the document (a logo or a banner repeated on every page) gets
+    the presigned url of the first one, and an image found in the index (scope)
+    is presigned from its existing s3 key. The other images are uploaded once.
+    If the upload of the first copy fails, the copies are uploaded on their own.
+    """
+
+    def __init__(self, index: ImageIndex = None, scope: str = None, max_distance: int = 4):
+        self.index = index if scope else None
+        self.scope = scope
+        self.max_distance = max_distance
+        self._uploads = []
+        self.images_count = 0
+        self.duplicates_count = 0
+        self.reused_count = 0
+
+    def _find(self, image_hash: int):
+        for upload_hash, upload in self._uploads:
+            if hash_distance(upload_hash, image_hash) <= self.max_distance:
+                return upload
+        return None
+
+    async def upload(self, image_path: str, upload_image, presign_key):
+        """
+        Presigned url of the image. upload_image(image_path) uploads the image and
+        returns its s3 key and presigned url, presign_key(key) presigns an uploaded image.
+        """
+        self.images_count += 1
+        try:
+            image_hash = await asyncio.to_thread(perceptual_hash, image_path)
+        except Exception as exc:
+            logging.warning("Could not hash the image %s. %s", image_path, str(exc))
+            _, presigned_url = await upload_image(image_path)
+            return presigned_url
+
+        original = self._find(image_hash)
+        if original is not None:
+            presigned_url = await asyncio.shield(original)
+            if presigned_url:
+                self.duplicates_count += 1
+                return presigned_url
+
+        upload = asyncio.get_running_loop().create_future()
+        self._uploads.append((image_hash, upload))
+        presigned_url = None
+        try:
+            key = self.index.find(self.scope, image_hash) if self.index else None
+            if key:
+                presigned_url = await presign_key(key)
+                self.reused_count += 1
+            else:
+                key, presigned_url = await upload_image(image_path)
+                if self.index:
+                    self.index.add(self.scope, image_hash, key)
+            return presigned_url
+        finally:
+            upload.set_result(presigned_url)
+
+    def stats(self):
+        return {
+            "images": self.images_count,
+            "duplicates": self.duplicates_count,
+            "reused": self.reused_count,
+        }
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+logging.getLogger().setLevel(logging.INFO)
+
+# Max metrics of a single put_metric_data call
+MAX_METRIC_DATA = 1000
+
+
+def module_dimensions(environment: str):
+    """Dimensions of the metrics of the module (as add_metric_data sets them)"""
+    return {"Module": "TextExtraction", "Environment": str(environment)}
+
+
+def metric_datum(metric_name: str, value, dimensions: dict, unit: str = None):
+    datum = {
+        "MetricName": metric_name,
+        "Dimensions": [
+            {"Name": dimension_name, "Value": dimension_value}
+            for dimension_name, dimension_value in dimensions.items()
+        ],
+        "Value": value,
+    }
+    if unit:
+        datum["Unit"] = unit
+    return datum
+
+
+async def put_metric_data(cw_client, namespace: str, metric_data: list):
+    """
+    Publishes the metrics in as few put_metric_data calls as possible (off the event
+    loop), the errors are logged.
+    """
+    for idx in range(0, len(metric_data), MAX_METRIC_DATA):
+        try:
+            await asyncio.to_thread(
+                cw_client.put_metric_data,
+                Namespace=namespace,
+                MetricData=metric_data[idx:idx + MAX_METRIC_DATA],
+            )
+        except (BotoCoreError, ClientError) as exc:
+            logging.warning("Could not publish the %s metrics. %s", namespace, str(exc))
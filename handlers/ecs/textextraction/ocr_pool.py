@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import metric_datum, module_dimensions, put_metric_data
+from ocr_extractor import OCRProcessor
+from timings import stage_metrics
+
+logging.getLogger().setLevel(logging.INFO)
+
+# Text only OCR of a page image, the engine is loaded once per worker
+PAGE_ENGINE_CONFIG = {"extraction_type": 1, "show_log": False, "use_s3": False}
+TABLE_EXTRACTION_TYPE = 2
+DOCUMENT_EXTRACTION_TYPE = 4
+# Keys of the configuration which change with every job (the s3 key of the document),
+# they are set on the loaded engine instead of loading a new one
+JOB_CONFIG_KEYS = ("s3_bucket_key",)
+
+# Engines of the worker process by configuration and the loop running their handlers
+_engines = {}
+_loop = None
+
+
+def engine_config(extraction_type: int, s3_bucket_name: str):
+    """Configuration of an engine uploading its results to the bucket"""
+    return {
+        "extraction_type": extraction_type,
+        "show_log": False,
+        "use_s3": True,
+        "s3_bucket_name": s3_bucket_name,
+    }
+
+
+def _engine_key(config: dict):
+    return tuple(sorted((name, value) for name, value in config.items() if name not in JOB_CONFIG_KEYS))
+
+
+def _get_engine(config: dict):
+    """
+    Loaded engine of the configuration with the keys of the job set, the engine is
+    loaded (and kept) on the first job. An engine without the attributes of the job
+    keys can't be reused, a new one is created for the job.
+    """
+    engine_key = _engine_key(config)
+    engine = _engines.get(engine_key)
+    if engine is None:
+        engine = _engines[engine_key] = OCRProcessor(**config)
+        return engine
+    job_keys = [name for name in JOB_CONFIG_KEYS if name in config]
+    if not all(hasattr(engine, name) for name in job_keys):
+        return OCRProcessor(**config)
+    for name in job_keys:
+        setattr(engine, name, config[name])
+    return engine
+
+
+def _init_worker(engine_configs):
+    """Loads the engines of the worker process once, before its first job"""
+    global _loop
+    _loop = asyncio.new_event_loop()
+    for config in engine_configs:
+        try:
+            _engines[_engine_key(config)] = OCRProcessor(**config)
+        except Exception as exc:
+            logging.warning("Could not load the OCR engine %s. %s", config, str(exc))
+
+
+def _ping():
+    return True
+
+
+def _run_ocr(config: dict, file_path: str, is_image: bool):
+    """
+    Runs the OCR of the file (in a worker process) with the loaded engine of the
+    configuration. Returns the results and the OCR time.
+    """
+    start_time = time.perf_counter()
+    engine = _get_engine(config)
+    engine.load_file(file_path=file_path, is_image=is_image)
+    results = _loop.run_until_complete(engine.handler())
+    return results, time.perf_counter() - start_time
+
+
+class OCRWorkerPool:
+    """
+    Long-lived OCR worker processes, their engines are loaded once per worker
+    (at startup, or on the first job of the configuration) instead of per request.
+    The page images wait in the pool queue for a free worker, so the pages of a
+    document are spread across the workers. The timeout of a job starts once a
+    worker picks it up, a job waiting longer than its queue timeout is dropped.
+    A job that times out keeps its worker until the OCR returns.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        page_timeout: int = 120,
+        engine_configs=(PAGE_ENGINE_CONFIG,),
+        name: str = "ocr",
+    ):
+        self.name = name
+        self.workers = max(1, workers)
+        self.page_timeout = page_timeout
+        self.engine_configs = list(engine_configs)
+        self._executor = None
+        self._slots = None
+        self._busy = 0
+        self._waiting = 0
+        self.max_waiting = 0
+        self.pages_count = 0
+        self.documents_count = 0
+        self.failures_count = 0
+        self.timeouts_count = 0
+        self.busy_secs = 0.0
+        self.total_page_secs = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.engine_configs,),
+            )
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._executor
+
+    async def start(self):
+        """Starts the workers and loads their engines before the first request"""
+        start_time = time.perf_counter()
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(executor, _ping) for _ in range(self.workers)],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning("Could not start the OCR worker. %s", str(result))
+                if isinstance(result, BrokenProcessPool):
+                    self._restart(executor)
+        logging.info(
+            "Started %s workers of the %s pool in %.2f secs",
+            self.workers,
+            self.name,
+            time.perf_counter() - start_time,
+        )
+
+    def _release(self, future):
+        if not future.cancelled() and not future.exception():
+            self.busy_secs += future.result()[1]
+        self._busy -= 1
+        self._slots.release()
+
+    def _restart(self, executor):
+        """A worker died (e.g. out of memory), the next job starts a new pool"""
+        if self._executor is executor:
+            logging.error("The %s worker pool is broken, restarting it.", self.name)
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, timeout, config, file_path, is_image, queue_timeout=None):
+        executor = self._get_executor()
+        self._waiting += 1
+        self.max_waiting = max(self.max_waiting, self._waiting)
+        wait_start = time.perf_counter()
+        try:
+            # A job cancelled (or timed out) while it waits is never started
+            await asyncio.wait_for(self._slots.acquire(), timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts_count += 1
+            self.failures_count += 1
+            raise
+        finally:
+            self._waiting -= 1
+        stage_metrics.record(f"{self.name}_queue_wait", round(time.perf_counter() - wait_start, 3))
+        self._busy += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                executor, _run_ocr, config, file_path, is_image
+            )
+            future.add_done_callback(self._release)
+        except BaseException as exc:
+            self._busy -= 1
+            self._slots.release()
+            self.failures_count += 1
+            if isinstance(exc, BrokenProcessPool):
+                self._restart(executor)
+            raise
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts_count += 1
+            self.failures_count += 1
+            raise
+        except BrokenProcessPool:
+            self._restart(executor)
+            self.failures_count += 1
+            raise
+        except Exception:
+            self.failures_count += 1
+            raise
+
+    async def ocr_page(self, image_path: str):
+        """Texts of the page image"""
+        results, ocr_secs = await self._run(self.page_timeout, PAGE_ENGINE_CONFIG, image_path, True)
+        self.pages_count += 1
+        self.total_page_secs += ocr_secs
+        stage_metrics.record("ocr_page", round(ocr_secs, 3))
+        return [text_block["content"] for text_block in results["text"]]
+
+    async def ocr_pages(self, page_images: dict):
+        """
+        OCR of the page images across the workers. Returns the texts of every page,
+        the pages that failed are missing.
+        """
+        page_numbers = list(page_images)
+        results = await asyncio.gather(
+            *[self.ocr_page(page_images[page_number]) for page_number in page_numbers],
+            return_exceptions=True,
+        )
+        page_texts = {}
+        for page_number, result in zip(page_numbers, results):
+            if isinstance(result, Exception):
+                logging.warning("OCR of the page %s failed. %s", page_number + 1, repr(result))
+            else:
+                page_texts[page_number] = result
+        return page_texts
+
+    async def ocr_document(
+        self, config: dict, file_path: str, is_image: bool, timeout=None, queue_timeout=None
+    ):
+        """
+        OCR results of the whole document (or image) with the engine of the configuration,
+        within timeout secs once a worker picks it up and queue_timeout secs of waiting.
+        """
+        results, _ = await self._run(timeout, config, file_path, is_image, queue_timeout)
+        self.documents_count += 1
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "waiting": self._waiting,
+            "max_waiting": self.max_waiting,
+            "utilisation": round(self._busy / self.workers, 2),
+            "pages": self.pages_count,
+            "documents": self.documents_count,
+            "failures": self.failures_count,
+            "timeouts": self.timeouts_count,
+            "avg_page_secs": (
+                round(self.total_page_secs / self.pages_count, 3) if self.pages_count else None
+            ),
+        }
+
+    async def publish_metrics(self, cw_client, namespace: str, environment: str, interval: int = 60):
+        """
+        Publishes the saturation of the pool every interval, runs forever: the share
+        of the worker time spent on OCR and the max number of jobs waiting for a worker.
+        """
+        busy_secs = self.busy_secs
+        while True:
+            await asyncio.sleep(interval)
+            utilisation = (self.busy_secs - busy_secs) / (interval * self.workers)
+            busy_secs = self.busy_secs
+            max_waiting, self.max_waiting = self.max_waiting, self._waiting
+            dimensions = module_dimensions(environment)
+            await put_metric_data(
+                cw_client,
+                namespace,
+                [
+                    metric_datum(f"{self.name}_pool_utilisation", round(min(utilisation, 1.0), 3), dimensions),
+                    metric_datum(f"{self.name}_pool_max_waiting", max_waiting, dimensions),
+                ],
+            )
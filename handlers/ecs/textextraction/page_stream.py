@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+
+from botocore.exceptions import ClientError
+from s3handler import read_object
+
+logging.getLogger().setLevel(logging.INFO)
+
+TERMINAL_STATUSES = ("complete", "failed")
+
+
+def structured_prefix(textextraction_id: str):
+    return f"textextraction/structured/{textextraction_id}"
+
+
+def page_key(prefix: str, page_number: int):
+    return f"{prefix}/pages/{page_number:05d}.jsonl"
+
+
+class StructuredPageWriter:
+    """
+    Progressive structured output. Every finished page is written as a JSON Lines
+    object under textextraction/structured/{textextraction_id}/pages/ so that the
+    downstream consumers can start before the whole document is parsed.
+    status.json is the readiness marker ("in_progress", "complete" or "failed") and
+    manifest.json lists the page objects once all of them are written.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, textextraction_id: str, concurrency: int = 4):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = structured_prefix(textextraction_id)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = []
+        self.page_keys = {}
+
+    async def _put_object(self, key: str, body: str, content_type: str = "application/json"):
+        await asyncio.to_thread(
+            self.s3_client.put_object,
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=body,
+            ContentType=content_type,
+        )
+
+    async def _write_status(self, status: str, **extra):
+        try:
+            await self._put_object(
+                f"{self.prefix}/status.json", json.dumps({"status": status, **extra})
+            )
+        except ClientError as cexc:
+            logging.warning("Could not write the structured output status. %s", str(cexc))
+
+    async def start(self):
+        """Marks the structured output as in progress"""
+        await self._write_status("in_progress")
+
+    async def _write_page(self, page_number: int, blocks: list):
+        key = page_key(self.prefix, page_number)
+        async with self._semaphore:
+            await self._put_object(
+                key,
+                json.dumps({"page_number": page_number, "blocks": blocks}) + "\n",
+                content_type="application/x-ndjson",
+            )
+        self.page_keys[page_number] = key
+
+    def add_page(self, page_number: int, blocks: list):
+        """Writes the finished page in background"""
+        self._tasks.append(asyncio.create_task(self._write_page(page_number, blocks)))
+
+    async def finish(self, total_pages: int):
+        """Waits for the pages and writes the manifest and the readiness marker"""
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        failed_writes = [result for result in results if isinstance(result, Exception)]
+        if failed_writes:
+            logging.warning(
+                "Could not write %s structured pages. %s",
+                len(failed_writes),
+                str(failed_writes[0]),
+            )
+            await self._write_status("failed")
+            return
+        try:
+            await self._put_object(
+                f"{self.prefix}/manifest.json",
+                json.dumps(
+                    {
+                        "total_pages": total_pages,
+                        "pages": [self.page_keys[key] for key in sorted(self.page_keys)],
+                    }
+                ),
+            )
+        except ClientError as cexc:
+            logging.warning("Could not write the structured output manifest. %s", str(cexc))
+            await self._write_status("failed")
+            return
+        await self._write_status("complete", total_pages=total_pages)
+
+    async def abort(self):
+        """Marks the structured output as failed"""
+        for task in self._tasks:
+            task.cancel()
+        await self._write_status("failed")
+
+
+def _read_json(s3_client, bucket_name: str, key: str):
+    return json.loads(read_object(s3_client, bucket_name, key))
+
+
+def _put_json(s3_client, bucket_name: str, key: str, contents, content_type: str = "application/json"):
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=contents, ContentType=content_type)
+
+
+def copy_page_stream(s3_client, bucket_name: str, source_key: str, textextraction_id: str):
+    """
+    Progressive structured output of a reused extraction (a cache hit or a coalesced
+    request) for another textextraction_id, so that its streaming consumers don't
+    wait forever. The pages of the earlier extraction are copied, or written from its
+    structured text (source_key) if it has no complete page stream (or is the structured
+    text of the same textextraction_id), then the manifest and the readiness marker are written.
+    """
+    source_prefix = source_key.rsplit("/", 1)[0]
+    prefix = structured_prefix(textextraction_id)
+    try:
+        try:
+            manifest = (
+                _read_json(s3_client, bucket_name, f"{source_prefix}/manifest.json")
+                if source_prefix != prefix
+                else None
+            )
+        except ClientError:
+            manifest = None
+        page_keys = []
+        if manifest:
+            for source_page_key in manifest["pages"]:
+                page_keys.append(f"{prefix}/pages/{source_page_key.rsplit('/', 1)[1]}")
+                s3_client.copy_object(
+                    Bucket=bucket_name,
+                    Key=page_keys[-1],
+                    CopySource={"Bucket": bucket_name, "Key": source_page_key},
+                )
+            total_pages = manifest["total_pages"]
+        else:
+            pages = _read_json(s3_client, bucket_name, source_key)
+            if not all(isinstance(page, list) for page in pages):
+                # The structured text of a webpage is a single page of entries
+                pages = [pages]
+            for page_number, blocks in enumerate(pages, start=1):
+                page_keys.append(page_key(prefix, page_number))
+                _put_json(
+                    s3_client,
+                    bucket_name,
+                    page_keys[-1],
+                    json.dumps({"page_number": page_number, "blocks": blocks}) + "\n",
+                    content_type="application/x-ndjson",
+                )
+            total_pages = len(pages)
+        _put_json(
+            s3_client,
+            bucket_name,
+            f"{prefix}/manifest.json",
+            json.dumps({"total_pages": total_pages, "pages": page_keys}),
+        )
+        _put_json(
+            s3_client,
+            bucket_name,
+            f"{prefix}/status.json",
+            json.dumps({"status": "complete", "total_pages": total_pages}),
+        )
+    except (ClientError, KeyError, OSError, ValueError) as exc:
+        logging.warning("Could not copy the structured output pages. %s", str(exc))
+        try:
+            _put_json(
+                s3_client, bucket_name, f"{prefix}/status.json", json.dumps({"status": "failed"})
+            )
+        except ClientError as cexc:
+            logging.warning("Could not write the structured output status. %s", str(cexc))
+
+
+def finish_page_stream(s3_client, bucket_name: str, textextraction_id: str):
+    """
+    Makes sure that the progressive structured output of the job has a final status.
+    The extractions without a page stream (webpages, images) get one written from
+    their structured text, the jobs without a structured text a failed status.
+    """
+    prefix = structured_prefix(textextraction_id)
+    try:
+        status = _read_json(s3_client, bucket_name, f"{prefix}/status.json").get("status")
+    except (ClientError, ValueError, AttributeError):
+        status = None
+    if status not in TERMINAL_STATUSES:
+        copy_page_stream(s3_client, bucket_name, f"{prefix}/extracted_text.json", textextraction_id)
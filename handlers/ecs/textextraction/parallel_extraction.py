@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import collections
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+from deep_parser import TextFromFile
+from deep_parser.helpers.errors import ScannedDocumentError
+
+logging.getLogger().setLevel(logging.INFO)
+
+_executor = None
+_worker_slots = None
+
+
+def get_executor(max_workers: int):
+    """Process pool shared by the page range extractions"""
+    global _executor, _worker_slots
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        _worker_slots = asyncio.Semaphore(max_workers)
+    return _executor
+
+
+def count_pdf_pages(file_path: str):
+    """Number of pages of the pdf document"""
+    with fitz.open(file_path) as pdf_document:
+        return pdf_document.page_count
+
+
+def find_scanned_pages(file_path: str, min_chars: int):
+    """Pages (0 based) without a text layer, i.e. with images but almost no text"""
+    with fitz.open(file_path) as pdf_document:
+        return [
+            page.number
+            for page in pdf_document
+            if len(page.get_text("text").strip()) < min_chars and page.get_images()
+        ]
+
+
+def render_pages(file_path: str, page_numbers: list, output_dir: str, dpi: int = 200):
+    """
+    Renders the pages as png images, returns the image path of every page.
+    The pages that can't be rendered are missing.
+    """
+    page_images = {}
+    with fitz.open(file_path) as pdf_document:
+        for page_number in page_numbers:
+            image_path = os.path.join(output_dir, f"page_{page_number}.png")
+            try:
+                pdf_document[page_number].get_pixmap(dpi=dpi).save(image_path)
+            except Exception as exc:
+                logging.warning("Could not render the page %s. %s", page_number + 1, str(exc))
+                continue
+            page_images[page_number] = image_path
+    return page_images
+
+
+def page_ranges(total_pages: int, chunk_size: int):
+    """Splits the pages in (first_page, last_page) ranges, both inclusive"""
+    return [
+        (first_page, min(first_page + chunk_size, total_pages) - 1)
+        for first_page in range(0, total_pages, chunk_size)
+    ]
+
+
+def extract_page_range(file_path: str, first_page: int, last_page: int, images_dir: str):
+    """
+    Extracts the blocks of the page range (runs in a worker process).
+    The page numbers and the image names are shifted to the whole document.
+    """
+    with fitz.open(file_path) as src_document, fitz.open() as chunk_document:
+        chunk_document.insert_pdf(src_document, from_page=first_page, to_page=last_page)
+        stream = base64.b64encode(chunk_document.tobytes())
+
+    deepex_op = TextFromFile(stream=stream, ext="pdf").extract()
+    chunk_images_dir = os.path.join(images_dir, f"pages_{first_page}")
+    os.makedirs(chunk_images_dir, exist_ok=True)
+    deepex_op.save_pics(chunk_images_dir)
+
+    blocks = deepex_op.to_json()["blocks"]
+    for block in blocks:
+        block["page"] += first_page
+        if block.get("imageLink"):
+            image_name = f"p{first_page}_{block['imageLink']}"
+            src_path = os.path.join(chunk_images_dir, block["imageLink"])
+            if os.path.isfile(src_path):
+                os.replace(src_path, os.path.join(images_dir, image_name))
+            block["imageLink"] = image_name
+    return blocks
+
+
+async def _run_page_range(executor, timeout: int, *args):
+    """
+    Runs the page range extraction once a worker is free, so that the timeout
+    doesn't include the time spent waiting in the pool queue. The worker slot is
+    released only when the worker is actually done, even after a timeout.
+    """
+    await _worker_slots.acquire()
+    future = asyncio.get_running_loop().run_in_executor(
+        executor, extract_page_range, *args
+    )
+    future.add_done_callback(lambda _: _worker_slots.release())
+    return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+
+
+class PageRangeExtraction:
+    """
+    Extracts the page ranges of the pdf in parallel worker processes and yields
+    the blocks of every range in page order, as soon as it is extracted, so that
+    the pages can be processed (and released) while the next ranges are parsed.
+    At most `window` ranges are scheduled ahead of the consumer, which bounds the
+    blocks held in memory. Every range has its own timeout. The blocks of the
+    failed ranges are missing (their pages are in failed_pages) instead of failing
+    the whole document, which is only considered scanned if none of the ranges
+    has a text layer.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        images_dir: str,
+        total_pages: int,
+        chunk_size: int,
+        chunk_timeout: int,
+        max_workers: int,
+        window: int = None,
+    ):
+        self.file_path = file_path
+        self.images_dir = images_dir
+        self.ranges = page_ranges(total_pages, chunk_size)
+        self.chunk_timeout = chunk_timeout
+        self.max_workers = max_workers
+        self.window = max(1, window or max_workers + 1)
+        self.failed_pages = []
+
+    def __aiter__(self):
+        return self._iter_ranges()
+
+    async def _iter_ranges(self):
+        executor = get_executor(self.max_workers)
+        pending = collections.deque()
+        next_range = 0
+        errors = []
+        try:
+            while pending or next_range < len(self.ranges):
+                while next_range < len(self.ranges) and len(pending) < self.window:
+                    first_page, last_page = self.ranges[next_range]
+                    task = asyncio.ensure_future(
+                        _run_page_range(
+                            executor,
+                            self.chunk_timeout,
+                            self.file_path,
+                            first_page,
+                            last_page,
+                            self.images_dir,
+                        )
+                    )
+                    pending.append((first_page, last_page, task))
+                    next_range += 1
+                first_page, last_page, task = pending.popleft()
+                try:
+                    blocks = await task
+                except Exception as exc:
+                    errors.append(exc)
+                    logging.warning(
+                        "Extraction of the pages %s-%s failed. %s",
+                        first_page + 1,
+                        last_page + 1,
+                        repr(exc),
+                    )
+                    self.failed_pages.extend(range(first_page, last_page + 1))
+                    continue
+                yield blocks
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+        if len(errors) == len(self.ranges):
+            scanned_errors = [err for err in errors if isinstance(err, ScannedDocumentError)]
+            # All the ranges failed, the document is scanned only if none has a text layer
+            raise scanned_errors[0] if len(scanned_errors) == len(errors) else errors[0]
@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from urllib.parse import unquote, urlparse
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+from nlp_modules_utils import generate_presigned_url
+from page_stream import copy_page_stream
+from s3handler import read_object
+from utils import download_s3_document
+
+logging.getLogger().setLevel(logging.INFO)
+
+# Bump it whenever the extraction output changes so that old entries are not reused.
+CACHE_VERSION = "v1"
+S3_URI_PREFIX = "s3://"
+
+
+def s3_key_from_presigned_url(url: str, bucket_name: str):
+    """Returns the object key of a presigned url of the bucket, None otherwise"""
+    parsed_url = urlparse(url)
+    path = unquote(parsed_url.path).lstrip("/")
+    if parsed_url.netloc.startswith(f"{bucket_name}."):
+        return path
+    if path.startswith(f"{bucket_name}/"):
+        return path[len(bucket_name) + 1:]
+    return None
+
+
+class ExtractionResultCache:
+    """
+    Content addressed cache of the extraction results stored in s3.
+    An entry maps the sha256 of the document to the already uploaded artifacts
+    (text, structured text, tables and images). Another small index maps the url
+    to the content hash and the ETag/Last-Modified validators so that unchanged
+    documents don't even need to be downloaded.
+    The pdf conversions of the office documents are kept by the hash of the
+    source document as well. Only the complete extractions are stored, and the
+    entries older than ttl secs are misses, so that a document is extracted again
+    from time to time. With page_stream, a hit gets the progressive structured
+    output of the cached extraction as well.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        s3_client,
+        prefix: str = "textextraction/cache",
+        ttl: int = 7 * 86400,
+        page_stream: bool = False,
+    ):
+        self.bucket_name = bucket_name
+        self.s3_client = s3_client
+        self.prefix = f"{prefix}/{CACHE_VERSION}"
+        self.ttl = ttl
+        self.page_stream = page_stream
+
+    def _content_key(self, doc_hash: str):
+        return f"{self.prefix}/content/{doc_hash}.json"
+
+    def _converted_key(self, doc_hash: str):
+        return f"{self.prefix}/converted/{doc_hash}.pdf"
+
+    def _url_key(self, url: str):
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return f"{self.prefix}/url/{url_hash}.json"
+
+    def _read_json(self, key: str):
+        try:
+            return json.loads(read_object(self.s3_client, self.bucket_name, key))
+        except ClientError:
+            return None
+        except ValueError as verr:
+            logging.warning("Invalid cache entry %s. %s", key, str(verr))
+            return None
+
+    def _write_json(self, key: str, contents: dict):
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=json.dumps({**contents, "stored_at": time.time()}),
+            ContentType="application/json",
+        )
+
+    def _expired(self, entry: dict):
+        """The entries written before the ttl (or without a write time) are expired"""
+        return time.time() - entry.get("stored_at", 0) > self.ttl
+
+    def _object_exists(self, key: str):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def _urls_to_uris(self, item):
+        """Replaces the presigned urls of the bucket with s3 uris (recursively)"""
+        if isinstance(item, dict):
+            return {key: self._urls_to_uris(value) for key, value in item.items()}
+        if isinstance(item, list):
+            return [self._urls_to_uris(value) for value in item]
+        if isinstance(item, str) and item.startswith("http"):
+            key = s3_key_from_presigned_url(item, self.bucket_name)
+            if key:
+                return f"{S3_URI_PREFIX}{self.bucket_name}/{key}"
+        return item
+
+    def _uris_to_urls(self, item):
+        """Replaces the s3 uris with fresh presigned urls (recursively)"""
+        if isinstance(item, dict):
+            return {key: self._uris_to_urls(value) for key, value in item.items()}
+        if isinstance(item, list):
+            return [self._uris_to_urls(value) for value in item]
+        if isinstance(item, str) and item.startswith(S3_URI_PREFIX):
+            bucket_name, key = item[len(S3_URI_PREFIX):].split("/", 1)
+            return generate_presigned_url(
+                bucket_name=bucket_name, key=key, s3_client=self.s3_client
+            )
+        return item
+
+    def _get(self, doc_hash: str, textextraction_id: str):
+        entry = self._read_json(self._content_key(doc_hash))
+        # An entry without the structured text can't be shared, it is a miss
+        if not entry or self._expired(entry) or not entry.get("structured_text_key"):
+            return None
+        if not self._object_exists(entry["text_key"]):
+            return None
+        # Entry extraction reads the structured text by the textextraction_id
+        structured_text_key = (
+            f"textextraction/structured/{textextraction_id}/extracted_text.json"
+        )
+        if entry["structured_text_key"] != structured_text_key:
+            self.s3_client.copy_object(
+                Bucket=self.bucket_name,
+                Key=structured_text_key,
+                CopySource={"Bucket": self.bucket_name, "Key": entry["structured_text_key"]},
+            )
+            if self.page_stream:
+                copy_page_stream(
+                    self.s3_client, self.bucket_name, entry["structured_text_key"], textextraction_id
+                )
+        return {
+            "text_presigned_url": generate_presigned_url(
+                bucket_name=self.bucket_name,
+                key=entry["text_key"],
+                s3_client=self.s3_client,
+            ),
+            "structured_text_presigned_url": generate_presigned_url(
+                bucket_name=self.bucket_name,
+                key=structured_text_key,
+                s3_client=self.s3_client,
+            ),
+            "total_pages": entry["total_pages"],
+            "total_words_count": entry["total_words_count"],
+            "table_contents": self._uris_to_urls(entry["table_contents"]),
+            "images_contents": self._uris_to_urls(entry["images_contents"]),
+        }
+
+    async def get(self, doc_hash: str, textextraction_id: str):
+        """Returns the cached results with fresh presigned urls, None on a miss"""
+        try:
+            return await asyncio.to_thread(self._get, doc_hash, textextraction_id)
+        except (BotoCoreError, ClientError, KeyError) as exc:
+            logging.warning("Could not read the extraction cache. %s", str(exc))
+            return None
+
+    async def get_url_entry(self, url: str):
+        """
+        Validators and content hash of the document last extracted from the url,
+        None on a miss. The validators revalidate the document with a conditional GET.
+        """
+        url_entry = await asyncio.to_thread(self._read_json, self._url_key(url))
+        if not url_entry or self._expired(url_entry):
+            return None
+        if not url_entry.get("validators") or not url_entry.get("content_hash"):
+            return None
+        return url_entry
+
+    def _put(self, doc_hash: str, results: dict):
+        if not results.get("text_presigned_url") or not results.get("structured_text_presigned_url"):
+            logging.info("The results without a structured text are not cached.")
+            return
+        self._write_json(
+            self._content_key(doc_hash),
+            {
+                "text_key": s3_key_from_presigned_url(
+                    results["text_presigned_url"], self.bucket_name
+                ),
+                "structured_text_key": s3_key_from_presigned_url(
+                    results["structured_text_presigned_url"], self.bucket_name
+                ),
+                "total_pages": results["total_pages"],
+                "total_words_count": results["total_words_count"],
+                "table_contents": self._urls_to_uris(results["table_contents"]),
+                "images_contents": self._urls_to_uris(results["images_contents"]),
+            },
+        )
+
+    async def put(self, doc_hash: str, results: dict):
+        """Stores the results of a complete extraction"""
+        try:
+            await asyncio.to_thread(self._put, doc_hash, results)
+        except (ClientError, KeyError, TypeError) as exc:
+            logging.warning("Could not write the extraction cache. %s", str(exc))
+
+    async def put_url(self, url: str, validators: dict, doc_hash: str):
+        """Maps the url (with its validators) to the content hash"""
+        if not validators:
+            return
+        try:
+            await asyncio.to_thread(
+                self._write_json,
+                self._url_key(url),
+                {"validators": validators, "content_hash": doc_hash},
+            )
+        except ClientError as cexc:
+            logging.warning("Could not write the url cache entry. %s", str(cexc))
+
+    async def get_converted(self, doc_hash: str):
+        """Returns the local copy of the cached pdf conversion, None on a miss"""
+        key = self._converted_key(doc_hash)
+        try:
+            return await asyncio.to_thread(
+                download_s3_document, self.s3_client, self.bucket_name, key
+            )
+        except ClientError as cexc:
+            if cexc.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logging.warning("Could not read the conversion cache. %s", str(cexc))
+            return None
+
+    async def put_converted(self, doc_hash: str, converted_document):
+        """Stores the converted pdf under the hash of the source document"""
+        try:
+            await asyncio.to_thread(
+                self.s3_client.upload_file,
+                converted_document.name,
+                self.bucket_name,
+                self._converted_key(doc_hash),
+                ExtraArgs={"ContentType": "application/pdf"},
+            )
+        except (ClientError, S3UploadFailedError) as exc:
+            logging.warning("Could not write the conversion cache. %s", str(exc))
@@ -2,17 +2,42 @@
 # SOURCE: https://github.com/jschneier/django-storages/blob/master/storages/backends/s3boto3.py
 # NOTE: Only copied used part.
 
+import asyncio
+import gzip
 import io
 import mimetypes
 import os
 import posixpath
 import secrets
+import threading
 from gzip import GzipFile
 from tempfile import SpooledTemporaryFile
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
+MB = 1024 * 1024
+
+# Files above the threshold are uploaded in parts, up to max_concurrency parts at once
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.environ.get("S3_MULTIPART_THRESHOLD_MB", 16)) * MB,
+    multipart_chunksize=int(os.environ.get("S3_MULTIPART_CHUNKSIZE_MB", 16)) * MB,
+    max_concurrency=int(os.environ.get("S3_MULTIPART_MAX_CONCURRENCY", 8)),
+)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """s3 client shared by the Storage instances (boto3 clients are thread safe)"""
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.session.Session().client("s3")
+    return _s3_client
+
 
 def get_random_string(
     length,
@@ -59,6 +84,42 @@ def safe_join(base, *paths):
     return final_path.lstrip("/")
 
 
+def gzip_content(content, compresslevel=9):
+    """Gzip a given file-like content."""
+    content.seek(0)
+    zbuf = io.BytesIO()
+    zfile = GzipFile(mode="wb", fileobj=zbuf, mtime=0.0, compresslevel=compresslevel)
+    try:
+        zfile.write(force_bytes(content.read()))
+    finally:
+        zfile.close()
+    zbuf.seek(0)
+    return zbuf
+
+
+def put_gzip_object(s3_client, bucket_name, key, contents, content_type):
+    """
+    Stores the contents gzip compressed with the Content-Encoding header, so that
+    the http clients (e.g. presigned url downloads) decompress them transparently.
+    """
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=gzip_content(io.BytesIO(force_bytes(contents)), compresslevel=6),
+        ContentType=content_type,
+        ContentEncoding="gzip",
+    )
+
+
+def read_object(s3_client, bucket_name, key):
+    """Reads the contents of the object, gzip encoded objects are decompressed"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    body = response["Body"].read()
+    if response.get("ContentEncoding") == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
 class Storage:
     DEFAULT_CONTENT_TYPE = "application/octet-stream"
     DEFAULT_QUERYSTRING_EXPIRE = 3600  # 1 hour
@@ -86,6 +147,10 @@ class Storage:
             self._connection = session.resource("s3")
         return self._connection
 
+    @property
+    def client(self):
+        return get_s3_client()
+
     @property
     def bucket(self):
         bucket = getattr(self, "_bucket", None)
@@ -126,15 +191,7 @@ class Storage:
 
     def _compress_content(self, content):
         """Gzip a given string content."""
-        content.seek(0)
-        zbuf = io.BytesIO()
-        zfile = GzipFile(mode="wb", fileobj=zbuf, mtime=0.0)
-        try:
-            zfile.write(force_bytes(content.read()))
-        finally:
-            zfile.close()
-        zbuf.seek(0)
-        return zbuf
+        return gzip_content(content)
 
     def _clean_name(self, name):
         clean_name = posixpath.normpath(name).replace("\\", "/")
@@ -158,24 +215,35 @@ class Storage:
             params["ContentEncoding"] = encoding
         return params
 
-    def upload(self, name, content, gzip=True):
+    def upload(self, name, content, compress=True, unique_name=False):
+        """
+        Uploads the content under name, the caller is expected to give a collision
+        free name (e.g. a uuid or a content hash). With unique_name, the existing
+        keys are probed and a random suffix is added until the name is free.
+        """
         if not name:
             raise Exception("Name is required")
         name = self._normalize_name(self._clean_name(name))
-        name = self.get_available_name(name)
+        if unique_name:
+            name = self.get_available_name(name)
         params = self._get_write_parameters(name, content)
         if (
-            gzip and
+            compress and
             params["ContentType"] in self.GZIP_CONTENT_TYPES and
             "ContentEncoding" not in params
         ):
             content = self._compress_content(content)
             params["ContentEncoding"] = "gzip"
-        obj = self.bucket.Object(name)
         content.seek(0, os.SEEK_SET)
-        obj.upload_fileobj(content, ExtraArgs=params)
+        self.client.upload_fileobj(
+            content, self.bucket_name, name, ExtraArgs=params, Config=TRANSFER_CONFIG
+        )
         return name
 
+    async def aupload(self, name, content, compress=True, unique_name=False):
+        """Same as upload, off the event loop"""
+        return await asyncio.to_thread(self.upload, name, content, compress, unique_name)
+
     def url(self, name, parameters=None, expire=None, http_method=None):
         name = self._normalize_name(self._clean_name(name))
         if expire is None:
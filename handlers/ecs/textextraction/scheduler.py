@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import Counter
+
+import psutil
+from metrics import metric_datum, put_metric_data
+
+logging.getLogger().setLevel(logging.INFO)
+
+MB = 1024 * 1024
+CGROUP_MEMORY_FILES = (
+    ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.max"),  # cgroup v2
+    (
+        "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ),  # cgroup v1
+)
+
+
+def _read_cgroup_value(path: str):
+    try:
+        with open(path, "r") as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if not value.isdigit():  # "max" when unlimited
+        return None
+    return int(value)
+
+
+def memory_usage():
+    """
+    Used and total memory (bytes) of the container. The cgroup limit is used
+    when set, psutil reports the memory of the whole host otherwise.
+    """
+    host_memory = psutil.virtual_memory()
+    for usage_file, limit_file in CGROUP_MEMORY_FILES:
+        usage, limit = _read_cgroup_value(usage_file), _read_cgroup_value(limit_file)
+        if usage is not None and limit is not None and limit < host_memory.total:
+            return usage, limit
+    return host_memory.total - host_memory.available, host_memory.total
+
+
+def default_max_concurrency(memory_per_job_mb: int, jobs_per_cpu: int):
+    """Concurrent jobs that fit the CPUs and the memory of the container"""
+    _, total_memory = memory_usage()
+    by_cpu = (os.cpu_count() or 1) * jobs_per_cpu
+    by_memory = total_memory // (memory_per_job_mb * MB)
+    return max(1, min(by_cpu, by_memory))
+
+
+class SchedulerSaturated(Exception):
+    """Raised when a job is not admitted because the queue is full"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("flow", "handler", "args", "future", "enqueued_at")
+
+    def __init__(self, flow: tuple, handler, args: tuple, future):
+        self.flow = flow
+        self.handler = handler
+        self.args = args
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class FairShareScheduler:
+    """
+    In process scheduler of the extraction jobs.
+    Every (client_id, request_type) pair is a flow and the flows share the
+    workers by start-time fair queuing: a flow with weight w gets w/sum(w) of
+    the dispatches while it has queued jobs, so a burst from a single client
+    is interleaved with the jobs of the others instead of running ahead of them.
+    At most max_concurrency jobs run at once and no new job is started while
+    the memory usage is above memory_high_watermark. Jobs are refused once the
+    queue (or the queue of the client) is full.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queued: int,
+        max_queued_per_client: int,
+        weights: dict,
+        memory_high_watermark: float = 0.85,
+        default_job_secs: float = 30.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.weights = weights
+        self.memory_high_watermark = memory_high_watermark
+        self._queue = []  # heap of (start_tag, seq, job)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish_tags = {}
+        self._queued_per_client = Counter()
+        self._running = 0
+        self._tasks = set()
+        self._wakeup = None
+        self._avg_job_secs = default_job_secs
+        self.rejected_count = 0
+        self.completed_count = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    @property
+    def running(self):
+        return self._running
+
+    def retry_after(self):
+        """Estimated seconds until the queued jobs are drained"""
+        waves = math.ceil((self.queue_depth + 1) / self.max_concurrency)
+        return max(1, min(600, int(waves * self._avg_job_secs)))
+
+    def _check_admission(self, client_id: str):
+        if self.queue_depth >= self.max_queued:
+            message = "The extraction queue is full."
+        elif self._queued_per_client[client_id] >= self.max_queued_per_client:
+            message = f"Too many queued extractions for the client {client_id}."
+        else:
+            return
+        self.rejected_count += 1
+        raise SchedulerSaturated(message, self.retry_after())
+
+    def submit(
+        self, client_id: str, request_type: int, handler, *args, enforce_limits: bool = True
+    ):
+        """
+        Queues the job and returns the future of its completion (the errors of
+        the job are logged, not propagated). Raises SchedulerSaturated if
+        enforce_limits is set and the queue is full.
+        """
+        if enforce_limits:
+            self._check_admission(client_id)
+
+        flow = (client_id, request_type)
+        start_tag = max(self._virtual_time, self._flow_finish_tags.get(flow, 0.0))
+        self._flow_finish_tags[flow] = start_tag + 1.0 / self.weights.get(request_type, 1)
+        if len(self._flow_finish_tags) > 10 * self.max_queued:
+            # The idle flows start from the virtual time anyway
+            self._flow_finish_tags = {
+                key: tag
+                for key, tag in self._flow_finish_tags.items()
+                if tag > self._virtual_time
+            }
+
+        job = _Job(flow, handler, args, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (start_tag, next(self._seq), job))
+        self._queued_per_client[client_id] += 1
+        self._notify()
+        return job.future
+
+    async def run(self, client_id: str, request_type: int, handler, *args):
+        """Queues the job without admission limits and waits for it to complete"""
+        return await self.submit(client_id, request_type, handler, *args, enforce_limits=False)
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _memory_pressure(self):
+        used, total = memory_usage()
+        return used / total >= self.memory_high_watermark
+
+    async def _run_job(self, job: _Job):
+        start_time = time.monotonic()
+        result = None
+        try:
+            result = await job.handler(*job.args)
+        except Exception as exc:
+            logging.error("Error occurred while running the job. %s", str(exc), exc_info=True)
+        finally:
+            if not job.future.done():
+                job.future.set_result(result)
+            self._running -= 1
+            self.completed_count += 1
+            # Moving average of the job duration for the Retry-After estimation
+            job_secs = time.monotonic() - start_time
+            self._avg_job_secs = 0.9 * self._avg_job_secs + 0.1 * job_secs
+            self._notify()
+
+    def _start_next_job(self):
+        start_tag, _, job = heapq.heappop(self._queue)
+        self._virtual_time = start_tag
+        self._queued_per_client[job.flow[0]] -= 1
+        if not self._queued_per_client[job.flow[0]]:
+            del self._queued_per_client[job.flow[0]]
+        self._running += 1
+        logging.info(
+            "Starting the job of %s (request type %s) after %.2f secs in the queue",
+            job.flow[0],
+            job.flow[1],
+            time.monotonic() - job.enqueued_at,
+        )
+        task = asyncio.create_task(self._run_job(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def dispatch(self):
+        """Starts the queued jobs as soon as a worker is free, runs forever"""
+        self._wakeup = asyncio.Event()
+        logging.info("Starting the scheduler with max concurrency %s", self.max_concurrency)
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue and self._running < self.max_concurrency:
+                if self._running and self._memory_pressure():
+                    # Checked again shortly, or as soon as a running job is done
+                    asyncio.get_running_loop().call_later(1, self._notify)
+                    break
+                self._start_next_job()
+
+    def stats(self):
+        """Queue metrics"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queue_depth": self.queue_depth,
+            "queued_per_client": dict(self._queued_per_client),
+            "rejected": self.rejected_count,
+            "completed": self.completed_count,
+            "avg_job_secs": round(self._avg_job_secs, 2),
+        }
+
+    async def publish_metrics(
+        self, cw_client, namespace: str, environment: str, interval: int = 60
+    ):
+        """Publishes the backlog to CloudWatch for the autoscaling alarms, runs forever"""
+        while True:
+            await asyncio.sleep(interval)
+            await put_metric_data(
+                cw_client,
+                namespace,
+                [
+                    metric_datum(
+                        metric_name, value, {"Environment": str(environment)}, unit="Count"
+                    )
+                    for metric_name, value in (
+                        ("QueuedJobs", self.queue_depth),
+                        ("RunningJobs", self._running),
+                    )
+                ],
+            )
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from botocore.exceptions import ClientError
+
+logging.getLogger().setLevel(logging.INFO)
+
+SQS_MAX_BATCH_SIZE = 10  # hard limit of receive_message
+SQS_MAX_WAIT_TIME_SECS = 20  # hard limit of long polling
+
+
+class SQSConsumerPool:
+    """
+    Consumes the queued (non-priority) requests with long polling and runs
+    them concurrently. Every message is deleted only once its own job is done,
+    and its visibility timeout is extended while the job is still running.
+    """
+
+    def __init__(
+        self,
+        sqs_client,
+        queue_url: str,
+        handler,
+        message_attribute_names: list,
+        concurrency: int = 4,
+        visibility_timeout: int = 120,
+        wait_time_secs: int = SQS_MAX_WAIT_TIME_SECS,
+    ):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.handler = handler
+        self.message_attribute_names = message_attribute_names
+        self.concurrency = max(1, concurrency)
+        self.visibility_timeout = visibility_timeout
+        self.wait_time_secs = min(wait_time_secs, SQS_MAX_WAIT_TIME_SECS)
+        self._inflight = set()
+
+    async def _receive_messages(self, max_messages: int):
+        """Long polls the queue off the event loop"""
+        sqs_response = await asyncio.to_thread(
+            self.sqs_client.receive_message,
+            QueueUrl=self.queue_url,
+            MessageAttributeNames=self.message_attribute_names,
+            MaxNumberOfMessages=max_messages,
+            VisibilityTimeout=self.visibility_timeout,
+            WaitTimeSeconds=self.wait_time_secs,
+        )
+        return sqs_response.get("Messages", [])
+
+    async def _extend_visibility(self, receipt_handle: str):
+        """Keeps the message invisible to other consumers while it is processed"""
+        interval = max(1, self.visibility_timeout // 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(
+                    self.sqs_client.change_message_visibility,
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=receipt_handle,
+                    VisibilityTimeout=self.visibility_timeout,
+                )
+            except ClientError as cexc:
+                logging.warning(
+                    "Could not extend the visibility timeout of the message. %s",
+                    str(cexc),
+                )
+
+    async def _process_message(self, message: dict):
+        """Runs the job of a single message and deletes the message afterwards"""
+        receipt_handle = message["ReceiptHandle"]
+        attributes = {
+            key: value["StringValue"]
+            for key, value in message.get("MessageAttributes", {}).items()
+        }
+        heartbeat = asyncio.create_task(self._extend_visibility(receipt_handle))
+        try:
+            await self.handler(
+                attributes["client_id"],
+                attributes["url"],
+                attributes["textextraction_id"],
+                attributes.get("callback_url"),
+            )
+        except Exception as exc:
+            logging.error(
+                "Error occurred while processing the queued request. %s",
+                str(exc),
+                exc_info=True,
+            )
+        finally:
+            heartbeat.cancel()
+
+        try:
+            await asyncio.to_thread(
+                self.sqs_client.delete_message,
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt_handle,
+            )
+        except ClientError as cexc:
+            logging.error("Could not delete the message from the queue. %s", str(cexc))
+
+    async def run(self):
+        """Polls the queue forever keeping at most `concurrency` jobs running"""
+        logging.info(
+            "Starting the SQS consumer pool with concurrency %s", self.concurrency
+        )
+        while True:
+            if len(self._inflight) >= self.concurrency:
+                await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            max_messages = min(
+                SQS_MAX_BATCH_SIZE, self.concurrency - len(self._inflight)
+            )
+            try:
+                messages = await self._receive_messages(max_messages)
+            except Exception as exc:
+                logging.error("Error while receiving the messages. %s", str(exc))
+                await asyncio.sleep(self.wait_time_secs or 1)
+                continue
+
+            if not messages:
+                if not self.wait_time_secs:
+                    await asyncio.sleep(1)
+                continue
+            logging.info("Received %s request message(s) from the queue", len(messages))
+            for message in messages:
+                task = asyncio.create_task(self._process_message(message))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
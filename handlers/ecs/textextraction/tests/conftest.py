@@ -0,0 +1,59 @@
+import gzip
+
+import pytest
+from botocore.exceptions import ClientError
+
+
+class FakeS3Body:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class FakeS3Client:
+    """In memory s3 client, only the calls used by the text extraction"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def _object(self, bucket, key, operation):
+        if (bucket, key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation)
+        return self.objects[(bucket, key)]
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, ContentEncoding=None):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = {"Body": Body, "ContentEncoding": ContentEncoding}
+
+    def put_gzip_object(self, bucket, key, body: bytes):
+        self.objects[(bucket, key)] = {"Body": gzip.compress(body), "ContentEncoding": "gzip"}
+
+    def get_object(self, Bucket, Key):
+        stored = self._object(Bucket, Key, "GetObject")
+        response = {"Body": FakeS3Body(stored["Body"])}
+        if stored["ContentEncoding"]:
+            response["ContentEncoding"] = stored["ContentEncoding"]
+        return response
+
+    def head_object(self, Bucket, Key):
+        self._object(Bucket, Key, "HeadObject")
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[(Bucket, Key)] = dict(
+            self._object(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        )
+
+    def generate_presigned_url(self, *args, Params=None, **kwargs):
+        params = Params or kwargs.get("Params")
+        return f"https://{params['Bucket']}.s3.amazonaws.com/{params['Key']}?X-Amz-Signature=test"
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+from batches import Batch, BatchRegistry, BatchStatus
+
+
+class FakeConnection:
+    def __init__(self, fail_commit=False, fail_rollback=False):
+        self.fail_commit = fail_commit
+        self.fail_rollback = fail_rollback
+        self.executed = []
+        self.committed = []
+        self.closed = False
+
+    def commit(self):
+        if self.fail_commit:
+            raise RuntimeError("connection lost")
+        self.committed.extend(self.executed)
+        self.executed = []
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise RuntimeError("connection lost")
+        self.executed = []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    def execute(self, sql_statement):
+        self.db_conn.executed.append(sql_statement)
+
+
+class FakeDatabase:
+    """Opens the given connections in order"""
+
+    def __init__(self, *db_conns):
+        self.db_conns = list(db_conns)
+        self.opened = []
+
+    def connect(self):
+        db_conn = self.db_conns.pop(0)
+        self.opened.append(db_conn)
+        return db_conn, FakeCursor(db_conn)
+
+
+def batch_items(*textextraction_ids):
+    return [
+        SimpleNamespace(textextraction_id=textextraction_id, url=f"https://example.com/{textextraction_id}.pdf")
+        for textextraction_id in textextraction_ids
+    ]
+
+
+def test_status_rows_are_written_in_bulk():
+    db_conn = FakeConnection()
+    database = FakeDatabase(db_conn)
+    batch = Batch("client", batch_items("a", "b", "c"), db_connect=database.connect, flush_size=2)
+
+    async def flush_when_due():
+        waiter = asyncio.create_task(batch.wait_flush(timeout=60))
+        await asyncio.sleep(0)
+        batch.add_statement("update a")
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        batch.add_statement("update b")
+        await asyncio.wait_for(waiter, timeout=1)
+        await asyncio.to_thread(batch.flush)
+
+    asyncio.run(flush_when_due())
+    assert db_conn.committed == ["update a", "update b"]
+
+    batch.add_statement("update c")
+    batch.close()
+
+    assert db_conn.committed == ["update a", "update b", "update c"]
+    assert db_conn.closed
+    assert len(database.opened) == 1
+    assert batch.progress()["finished"]
+
+
+def test_rows_of_a_failed_write_are_written_by_the_next_flush():
+    broken_conn, db_conn = FakeConnection(fail_commit=True, fail_rollback=True), FakeConnection()
+    database = FakeDatabase(broken_conn, db_conn)
+    batch = Batch("client", batch_items("a", "b"), db_connect=database.connect)
+
+    batch.add_statement("update a")
+    batch.flush()
+    batch.add_statement("update b")
+    # Within the backoff the rows stay buffered
+    batch.flush()
+    assert len(database.opened) == 1
+
+    batch.flush(force=True)
+
+    assert broken_conn.closed
+    assert db_conn.committed == ["update a", "update b"]
+
+
+def test_rows_are_dropped_after_max_retries():
+    database = FakeDatabase(*[FakeConnection(fail_commit=True) for _ in range(3)])
+    written = []
+    batch = Batch("client", batch_items("a"), db_connect=database.connect, max_retries=2)
+
+    batch.add_statement("update a", on_written=lambda: written.append("a"))
+    for _ in range(3):
+        batch.flush(force=True)
+
+    assert len(database.opened) == 3
+    assert batch._statements == []
+    # The callback is still sent
+    assert written == ["a"]
+
+
+def test_callbacks_are_sent_after_the_rows_are_written():
+    db_conn = FakeConnection()
+    batch = Batch("client", batch_items("a", "b"), db_connect=FakeDatabase(db_conn).connect)
+    sent = []
+
+    batch.add_statement("update a", on_written=lambda: sent.append(list(db_conn.committed)))
+    batch.add_statement("update b")
+    assert sent == []
+
+    batch.flush()
+
+    assert sent == [["update a", "update b"]]
+
+
+def test_connection_error_does_not_raise():
+    def connect():
+        raise RuntimeError("database unavailable")
+
+    batch = Batch("client", batch_items("a"), db_connect=connect)
+    batch.add_statement("update a")
+    batch.close()
+
+    assert batch.finished_at is not None
+
+
+def test_progress_counts():
+    batch = Batch("client", batch_items("a", "b", "c"))
+    batch.set_status("a", BatchStatus.RUNNING)
+    batch.set_status("b", "success")
+    batch.set_status("unknown", "success")
+
+    progress = batch.progress()
+
+    assert progress["total"] == 3
+    assert progress["counts"] == {BatchStatus.RUNNING: 1, "success": 1, BatchStatus.QUEUED: 1}
+    assert not progress["finished"]
+
+
+def test_finished_batches_expire(monkeypatch):
+    batch_registry = BatchRegistry(retention=60)
+    batch = Batch("client", batch_items("a"))
+    batch_registry._batches[batch.batch_id] = batch
+    batch.finished_at = 1000.0
+
+    monkeypatch.setattr("batches.time.time", lambda: 1030.0)
+    assert batch_registry.get(batch.batch_id) is batch
+    monkeypatch.setattr("batches.time.time", lambda: 1061.0)
+    assert batch_registry.get(batch.batch_id) is None
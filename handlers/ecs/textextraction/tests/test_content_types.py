@@ -0,0 +1,52 @@
+import pytest
+from content_types import OLE2_SIGNATURE, ZIP_SIGNATURE, ExtractContentType, UrlTypes, sniff_content_type
+
+
+@pytest.mark.parametrize(
+    "prefix, extension, url_type",
+    [
+        (b"%PDF-1.7\n%\xe2\xe3\xcf\xd3", None, UrlTypes.PDF),
+        (ZIP_SIGNATURE + b"..[Content_Types].xml..word/document.xml", None, UrlTypes.DOCX),
+        (ZIP_SIGNATURE + b"..[Content_Types].xml..xl/workbook.xml", None, UrlTypes.XLSX),
+        (ZIP_SIGNATURE + b"..[Content_Types].xml..ppt/presentation.xml", None, UrlTypes.PPTX),
+        (ZIP_SIGNATURE + b"..[Content_Types].xml..", "xlsx", UrlTypes.XLSX),
+        (OLE2_SIGNATURE + "WordDocument".encode("utf-16-le"), None, UrlTypes.MSWORD),
+        (OLE2_SIGNATURE + "Workbook".encode("utf-16-le"), None, UrlTypes.XLS),
+        (OLE2_SIGNATURE + "PowerPoint Document".encode("utf-16-le"), None, UrlTypes.PPT),
+        (OLE2_SIGNATURE + b"\x00" * 16, "doc", UrlTypes.MSWORD),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", None, UrlTypes.IMG),
+        (b"\xff\xd8\xff\xe0\x00\x10JFIF", None, UrlTypes.IMG),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", None, UrlTypes.IMG),
+        (b"\xef\xbb\xbf\n  <!DOCTYPE html><html>", None, UrlTypes.HTML),
+        (b"<HTML><HEAD><TITLE>", None, UrlTypes.HTML),
+    ],
+)
+def test_sniff_content_type(prefix, extension, url_type):
+    assert sniff_content_type(prefix, extension) == url_type
+
+
+@pytest.mark.parametrize(
+    "prefix, extension",
+    [
+        (b"", "pdf"),
+        (ZIP_SIGNATURE + b"plain zip archive", None),
+        (ZIP_SIGNATURE + b"..[Content_Types].xml..", "pdf"),
+        (OLE2_SIGNATURE + b"\x00" * 16, None),
+        (b"plain text, no markup", None),
+    ],
+)
+def test_sniff_content_type_unknown(prefix, extension):
+    assert sniff_content_type(prefix, extension) is None
+
+
+def test_sniffed_type_overrides_the_missing_header():
+    extract_content_type = ExtractContentType()
+    assert extract_content_type._resolve_content_type(
+        "https://example.com/download?id=1", "application/octet-stream", b"%PDF-1.4", None
+    ) == UrlTypes.PDF.value
+    assert extract_content_type._resolve_content_type(
+        "https://example.com/download?id=1", None, b"binary", "docx"
+    ) == UrlTypes.DOCX.value
+    assert extract_content_type._resolve_content_type(
+        "https://example.com/download?id=1", None, b"binary", None
+    ) is None
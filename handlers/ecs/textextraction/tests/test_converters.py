@@ -0,0 +1,116 @@
+import asyncio
+import os
+import stat
+import time
+
+import pytest
+from converters import LibreOfficeConverter
+from document import SpooledDocument
+
+# Stand-in of soffice: forks a child (as soffice does with soffice.bin), records its pid
+# and either hangs or writes the pdf to the output dir (the next to last argument)
+FAKE_SOFFICE = """#!/bin/sh
+sleep 30 &
+echo $! > "$FAKE_SOFFICE_CHILD_PID"
+if [ "$FAKE_SOFFICE_HANG" = "1" ]; then
+    wait
+fi
+kill $!
+for arg in "$@"; do outdir="$input"; input="$arg"; done
+printf '%%PDF-1.4 converted' > "$outdir/source.pdf"
+"""
+
+
+def process_alive(pid: int):
+    """The process exists and is not a zombie waiting to be reaped"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def wait_exit(pid: int, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while process_alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return not process_alive(pid)
+
+
+@pytest.fixture
+def soffice(tmp_path, monkeypatch):
+    soffice_path = tmp_path / "soffice"
+    soffice_path.write_text(FAKE_SOFFICE)
+    soffice_path.chmod(soffice_path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("FAKE_SOFFICE_CHILD_PID", str(tmp_path / "child.pid"))
+    return soffice_path
+
+
+def child_pid(soffice_path):
+    pid_file = soffice_path.parent / "child.pid"
+    return int(pid_file.read_text()) if pid_file.exists() else None
+
+
+def new_document():
+    document = SpooledDocument("https://example.com/report.docx")
+    document.write(b"docx contents")
+    document.flush()
+    return document
+
+
+def test_document_is_converted(soffice):
+    converter = LibreOfficeConverter(pool_size=1, timeout=5, soffice_path=str(soffice))
+    document = new_document()
+
+    async def main():
+        try:
+            return await converter.convert(document, "docx")
+        finally:
+            await converter.close()
+
+    converted_document = asyncio.run(main())
+
+    with converted_document.open() as f:
+        assert f.read() == b"%PDF-1.4 converted"
+    assert converter.stats()["failures"] == 0
+
+
+def test_process_group_is_killed_on_timeout(soffice, monkeypatch):
+    converter = LibreOfficeConverter(pool_size=1, timeout=5, soffice_path=str(soffice))
+    document = new_document()
+
+    async def main():
+        await converter.start()
+        monkeypatch.setenv("FAKE_SOFFICE_HANG", "1")
+        converter.timeout = 0.2
+        try:
+            return await converter.convert(document, "docx")
+        finally:
+            await converter.close()
+
+    assert asyncio.run(main()) is None
+    assert converter.stats()["failures"] == 1
+    assert wait_exit(child_pid(soffice))
+
+
+def test_process_group_is_killed_on_cancellation(soffice, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_SOFFICE_HANG", "1")
+    converter = LibreOfficeConverter(pool_size=1, timeout=30, soffice_path=str(soffice))
+    converter._work_dir = str(tmp_path)
+    converter._profiles = asyncio.Queue()
+    converter._profiles.put_nowait(str(tmp_path / "profile_0"))
+    document = new_document()
+
+    async def main():
+        conversion = asyncio.create_task(converter.convert(document, "docx"))
+        while child_pid(soffice) is None:
+            await asyncio.sleep(0.01)
+        conversion.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await conversion
+
+    asyncio.run(main())
+
+    assert wait_exit(child_pid(soffice))
+    assert converter._profiles.qsize() == 1
+    assert not os.path.exists(tmp_path / "profile_0")
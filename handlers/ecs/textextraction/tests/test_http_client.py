@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+import pytest
+from http_client import PooledHttpClient, percentile
+
+
+def new_client(handler, max_connections_per_host=2):
+    """Pooled client sending the requests to the async handler(request)"""
+    pooled_client = PooledHttpClient(max_connections_per_host=max_connections_per_host)
+    pooled_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pooled_client
+
+
+def test_requests_to_a_host_are_capped():
+    running, max_running = {}, {}
+
+    async def handler(request):
+        host = request.url.host
+        running[host] = running.get(host, 0) + 1
+        max_running[host] = max(max_running.get(host, 0), running[host])
+        await asyncio.sleep(0.01)
+        running[host] -= 1
+        return httpx.Response(200)
+
+    async def main():
+        pooled_client = new_client(handler)
+        await asyncio.gather(
+            *[pooled_client.request("GET", f"https://slow.example.com/{idx}") for idx in range(6)],
+            *[pooled_client.request("GET", f"https://other.example.com/{idx}") for idx in range(2)],
+        )
+        await pooled_client.aclose()
+
+    asyncio.run(main())
+
+    assert max_running == {"slow.example.com": 2, "other.example.com": 2}
+
+
+def test_host_slot_is_kept_while_requests_wait_for_it():
+    release = None
+
+    async def handler(request):
+        await release.wait()
+        return httpx.Response(200)
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        pooled_client = new_client(handler, max_connections_per_host=1)
+        requests = [
+            asyncio.create_task(pooled_client.request("GET", f"https://example.com/{idx}"))
+            for idx in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        slot = pooled_client._host_slots["example.com"]
+        users = slot.users
+        release.set()
+        await asyncio.gather(*requests)
+        await pooled_client.aclose()
+        return users, pooled_client._host_slots
+
+    users, host_slots = asyncio.run(main())
+
+    assert users == 3
+    assert host_slots == {}
+
+
+def test_host_slot_is_dropped_when_the_host_is_idle():
+    async def handler(request):
+        if request.url.path == "/error":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, content=b"contents")
+
+    async def main():
+        pooled_client = new_client(handler)
+        await pooled_client.head("https://a.example.com/file.pdf")
+        async with pooled_client.stream("GET", "https://b.example.com/file.pdf") as response:
+            contents = await response.aread()
+            busy_hosts = pooled_client.stats()["busy_hosts"]
+        with pytest.raises(httpx.ConnectError):
+            await pooled_client.request("GET", "https://c.example.com/error")
+        await pooled_client.aclose()
+        return contents, busy_hosts, pooled_client._host_slots
+
+    contents, busy_hosts, host_slots = asyncio.run(main())
+
+    assert contents == b"contents"
+    assert busy_hosts == 1
+    assert host_slots == {}
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4, 5], 50) == 3
+    assert percentile([3, 1, 2, 4, 5], 99) == 5
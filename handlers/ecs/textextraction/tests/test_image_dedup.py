@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+
+import pytest
+from image_dedup import DocumentImages, ImageIndex, hash_distance, perceptual_hash
+from PIL import Image, ImageDraw
+
+
+def save_image(path, size=(200, 100), shapes=((20, 20, 80, 80),), image_format="PNG"):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for shape in shapes:
+        draw.rectangle([int(value * size[0] / 200) for value in shape], fill="black")
+    image.save(path, image_format)
+    return str(path)
+
+
+@pytest.fixture
+def logo(tmp_path):
+    return save_image(tmp_path / "logo.png")
+
+
+def test_resized_copy_has_a_close_hash(logo, tmp_path):
+    copy = save_image(tmp_path / "copy.jpg", size=(400, 200), image_format="JPEG")
+    other = save_image(tmp_path / "other.png", shapes=((120, 10, 190, 90), (0, 0, 10, 100)))
+
+    assert hash_distance(perceptual_hash(logo), perceptual_hash(copy)) <= 4
+    assert hash_distance(perceptual_hash(logo), perceptual_hash(other)) > 4
+
+
+def test_hash_distance():
+    assert hash_distance(0b1011, 0b1011) == 0
+    assert hash_distance(0b1011, 0b0010) == 2
+
+
+def test_index_finds_near_images_of_the_scope():
+    image_index = ImageIndex(max_distance=2)
+    image_index.add("client", 0b1111, "images/logo.png")
+
+    assert image_index.find("client", 0b1111) == "images/logo.png"
+    assert image_index.find("client", 0b1100) == "images/logo.png"
+    assert image_index.find("client", 0b0000) is None
+    assert image_index.find("other client", 0b1111) is None
+    assert image_index.stats()["hits"] == 2
+
+
+def test_index_evicts_and_expires(monkeypatch):
+    image_index = ImageIndex(max_entries=2, max_distance=0, ttl=60)
+    image_index.add("client", 1, "images/1.png")
+    image_index.add("client", 2, "images/2.png")
+    image_index.add("client", 4, "images/4.png")
+
+    assert image_index.find("client", 1) is None
+    assert image_index.find("client", 2) == "images/2.png"
+
+    added_at = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: added_at + 61)
+    assert image_index.find("client", 4) is None
+    assert image_index.stats()["images"] == 0
+
+
+def test_copies_of_a_document_image_are_uploaded_once(logo, tmp_path):
+    copy = save_image(tmp_path / "copy.png", size=(100, 50))
+    other = save_image(tmp_path / "other.png", shapes=((120, 10, 190, 90), (0, 0, 10, 100)))
+    uploads = []
+
+    async def upload_image(image_path):
+        uploads.append(image_path)
+        await asyncio.sleep(0.01)
+        key = f"images/{os.path.basename(image_path)}"
+        return key, f"https://bucket/{key}"
+
+    async def presign_key(key):
+        return f"https://bucket/{key}?presigned"
+
+    image_index = ImageIndex()
+    document_images = DocumentImages(image_index, scope="client")
+
+    async def upload_images(images):
+        return await asyncio.gather(
+            *[document_images.upload(image, upload_image, presign_key) for image in images]
+        )
+
+    presigned_urls = asyncio.run(upload_images([logo, copy, other]))
+
+    assert len(uploads) == 2 and other in uploads
+    assert presigned_urls[0] == presigned_urls[1]
+    assert document_images.stats() == {"images": 3, "duplicates": 1, "reused": 0}
+
+    # The images of the next document of the client are presigned from the index
+    next_document_images = DocumentImages(image_index, scope="client")
+    presigned_url = asyncio.run(next_document_images.upload(copy, upload_image, presign_key))
+
+    assert presigned_url == f"{presigned_urls[1]}?presigned"
+    assert len(uploads) == 2
+
+
+def test_failed_upload_of_the_original_uploads_the_copy(logo, tmp_path):
+    copy = save_image(tmp_path / "copy.png", size=(100, 50))
+    uploads = []
+
+    async def upload_image(image_path):
+        # The upload of whichever copy is hashed first fails
+        uploads.append(image_path)
+        if len(uploads) == 1:
+            await asyncio.sleep(0.01)
+            return None, None
+        return "images/image.png", "https://bucket/images/image.png"
+
+    async def presign_key(key):
+        return f"https://bucket/{key}?presigned"
+
+    document_images = DocumentImages()
+
+    async def upload_images():
+        return await asyncio.gather(
+            document_images.upload(logo, upload_image, presign_key),
+            document_images.upload(copy, upload_image, presign_key),
+        )
+
+    presigned_urls = asyncio.run(upload_images())
+
+    assert sorted(presigned_urls, key=str) == [None, "https://bucket/images/image.png"]
+    assert sorted(uploads) == sorted([logo, copy])
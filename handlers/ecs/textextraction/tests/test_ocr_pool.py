@@ -0,0 +1,115 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ocr_pool
+import pytest
+from ocr_pool import OCRWorkerPool, engine_config
+
+
+class FakeEngine:
+    created = 0
+
+    def __init__(self, **config):
+        FakeEngine.created += 1
+        self.s3_bucket_key = config.get("s3_bucket_key")
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    monkeypatch.setattr(ocr_pool, "OCRProcessor", FakeEngine)
+    monkeypatch.setattr(ocr_pool, "_engines", {})
+    monkeypatch.setattr(ocr_pool, "_loop", None)
+    FakeEngine.created = 0
+    yield
+    if ocr_pool._loop:
+        ocr_pool._loop.close()
+
+
+def table_config(key):
+    return {**engine_config(ocr_pool.TABLE_EXTRACTION_TYPE, "bucket"), "s3_bucket_key": key}
+
+
+def test_engines_are_loaded_once_per_configuration(engines):
+    ocr_pool._init_worker([engine_config(ocr_pool.TABLE_EXTRACTION_TYPE, "bucket")])
+
+    first = ocr_pool._get_engine(table_config("doc-1/tables"))
+    second = ocr_pool._get_engine(table_config("doc-2/tables"))
+
+    assert first is second
+    assert second.s3_bucket_key == "doc-2/tables"
+    assert FakeEngine.created == 1
+
+    ocr_pool._get_engine(ocr_pool.PAGE_ENGINE_CONFIG)
+    ocr_pool._get_engine(ocr_pool.PAGE_ENGINE_CONFIG)
+    assert FakeEngine.created == 2
+
+
+def test_engine_without_the_job_attributes_is_not_reused(engines, monkeypatch):
+    class OpaqueEngine:
+        def __init__(self, **config):
+            FakeEngine.created += 1
+
+    monkeypatch.setattr(ocr_pool, "OCRProcessor", OpaqueEngine)
+    ocr_pool._get_engine(table_config("doc-1/tables"))
+    engine = ocr_pool._get_engine(table_config("doc-2/tables"))
+
+    assert FakeEngine.created == 2
+    assert engine is not ocr_pool._engines[ocr_pool._engine_key(table_config("doc-1/tables"))]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A pool of one worker thread, the OCR of a file sleeps the secs of its name"""
+
+    def run_ocr(config, file_path, is_image):
+        if file_path == "broken":
+            raise RuntimeError("OCR failed")
+        time.sleep(float(file_path))
+        return {"text": [{"content": file_path}], "table": []}, float(file_path)
+
+    monkeypatch.setattr(ocr_pool, "_run_ocr", run_ocr)
+    worker_pool = OCRWorkerPool(workers=1, page_timeout=1)
+    worker_pool._executor = ThreadPoolExecutor(max_workers=1)
+    yield worker_pool
+    worker_pool._executor.shutdown(wait=True)
+
+
+def test_timeout_starts_once_a_worker_picks_the_job(pool):
+    async def ocr():
+        return await asyncio.gather(
+            pool.ocr_document({}, "0.3", is_image=False, timeout=0.2),
+            pool.ocr_document({}, "0.1", is_image=False, timeout=0.2),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(ocr())
+
+    assert isinstance(first, asyncio.TimeoutError)
+    # The second job waited for the worker longer than its timeout
+    assert second["text"] == [{"content": "0.1"}]
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_queued_job_is_dropped_after_the_queue_timeout(pool):
+    async def ocr():
+        return await asyncio.gather(
+            pool.ocr_document({}, "0.2", is_image=False),
+            pool.ocr_document({}, "0.1", is_image=False, queue_timeout=0.05),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(ocr())
+
+    assert first["text"] == [{"content": "0.2"}]
+    assert isinstance(second, asyncio.TimeoutError)
+    assert pool.stats()["documents"] == 1
+    assert pool.stats()["busy"] == 0
+
+
+def test_failed_pages_are_missing(pool):
+    page_texts = asyncio.run(pool.ocr_pages({0: "0.01", 1: "broken", 2: "0.01"}))
+
+    assert page_texts == {0: ["0.01"], 2: ["0.01"]}
+    assert pool.stats()["failures"] == 1
+    assert pool.stats()["pages"] == 2
@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+from page_stream import (StructuredPageWriter, copy_page_stream,
+                         finish_page_stream)
+
+BUCKET = "test-bucket"
+
+
+def read_json(s3_client, key):
+    return json.loads(s3_client.objects[(BUCKET, key)]["Body"])
+
+
+def test_writer_manifest_and_status(s3_client):
+    async def write_pages():
+        page_writer = StructuredPageWriter(s3_client, BUCKET, "first")
+        await page_writer.start()
+        assert read_json(s3_client, "textextraction/structured/first/status.json") == {
+            "status": "in_progress"
+        }
+        page_writer.add_page(2, ["second"])
+        page_writer.add_page(1, ["first"])
+        await page_writer.finish(total_pages=2)
+
+    asyncio.run(write_pages())
+
+    assert read_json(s3_client, "textextraction/structured/first/manifest.json") == {
+        "total_pages": 2,
+        "pages": [
+            "textextraction/structured/first/pages/00001.jsonl",
+            "textextraction/structured/first/pages/00002.jsonl",
+        ],
+    }
+    assert read_json(s3_client, "textextraction/structured/first/pages/00002.jsonl") == {
+        "page_number": 2,
+        "blocks": ["second"],
+    }
+    assert read_json(s3_client, "textextraction/structured/first/status.json") == {
+        "status": "complete",
+        "total_pages": 2,
+    }
+
+
+def test_copy_of_the_page_stream(s3_client):
+    async def write_pages():
+        page_writer = StructuredPageWriter(s3_client, BUCKET, "first")
+        page_writer.add_page(1, ["first"])
+        await page_writer.finish(total_pages=1)
+
+    asyncio.run(write_pages())
+
+    copy_page_stream(
+        s3_client, BUCKET, "textextraction/structured/first/extracted_text.json", "second"
+    )
+
+    assert read_json(s3_client, "textextraction/structured/second/manifest.json") == {
+        "total_pages": 1,
+        "pages": ["textextraction/structured/second/pages/00001.jsonl"],
+    }
+    assert read_json(s3_client, "textextraction/structured/second/pages/00001.jsonl") == {
+        "page_number": 1,
+        "blocks": ["first"],
+    }
+    assert read_json(s3_client, "textextraction/structured/second/status.json")["status"] == "complete"
+
+
+def test_page_stream_from_the_structured_text(s3_client):
+    s3_client.put_gzip_object(
+        BUCKET,
+        "textextraction/structured/first/extracted_text.json",
+        json.dumps([["first"], ["second"]]).encode("utf-8"),
+    )
+
+    copy_page_stream(
+        s3_client, BUCKET, "textextraction/structured/first/extracted_text.json", "second"
+    )
+
+    assert read_json(s3_client, "textextraction/structured/second/manifest.json")["total_pages"] == 2
+    assert read_json(s3_client, "textextraction/structured/second/pages/00002.jsonl") == {
+        "page_number": 2,
+        "blocks": ["second"],
+    }
+    assert read_json(s3_client, "textextraction/structured/second/status.json") == {
+        "status": "complete",
+        "total_pages": 2,
+    }
+
+
+def test_missing_source_fails_the_page_stream(s3_client):
+    copy_page_stream(
+        s3_client, BUCKET, "textextraction/structured/first/extracted_text.json", "second"
+    )
+
+    assert read_json(s3_client, "textextraction/structured/second/status.json") == {
+        "status": "failed"
+    }
+
+
+def test_finished_page_stream_is_kept(s3_client):
+    async def write_pages():
+        page_writer = StructuredPageWriter(s3_client, BUCKET, "first")
+        page_writer.add_page(1, ["first"])
+        await page_writer.finish(total_pages=1)
+
+    asyncio.run(write_pages())
+    s3_client.put_object(
+        Bucket=BUCKET, Key="textextraction/structured/first/extracted_text.json", Body="[[]]"
+    )
+
+    finish_page_stream(s3_client, BUCKET, "first")
+
+    assert read_json(s3_client, "textextraction/structured/first/pages/00001.jsonl")["blocks"] == ["first"]
+
+
+def test_webpage_gets_a_single_page_stream(s3_client):
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="textextraction/structured/first/extracted_text.json",
+        Body=json.dumps(["title", "paragraph"]),
+    )
+
+    finish_page_stream(s3_client, BUCKET, "first")
+
+    assert read_json(s3_client, "textextraction/structured/first/pages/00001.jsonl") == {
+        "page_number": 1,
+        "blocks": ["title", "paragraph"],
+    }
+    assert read_json(s3_client, "textextraction/structured/first/status.json") == {
+        "status": "complete",
+        "total_pages": 1,
+    }
+
+
+def test_failed_job_gets_a_failed_status(s3_client):
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="textextraction/structured/first/status.json",
+        Body=json.dumps({"status": "in_progress"}),
+    )
+
+    finish_page_stream(s3_client, BUCKET, "first")
+
+    assert read_json(s3_client, "textextraction/structured/first/status.json") == {
+        "status": "failed"
+    }
@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import fitz
+import parallel_extraction
+import pytest
+from parallel_extraction import PageRangeExtraction, page_ranges, render_pages
+
+
+@pytest.mark.parametrize(
+    "total_pages, chunk_size, ranges",
+    [
+        (10, 4, [(0, 3), (4, 7), (8, 9)]),
+        (8, 4, [(0, 3), (4, 7)]),
+        (3, 10, [(0, 2)]),
+        (0, 4, []),
+    ],
+)
+def test_page_ranges(total_pages, chunk_size, ranges):
+    assert page_ranges(total_pages, chunk_size) == ranges
+
+
+def test_failed_page_ranges_are_skipped(monkeypatch):
+    async def run_page_range(executor, timeout, file_path, first_page, last_page, images_dir):
+        if first_page == 4:
+            raise asyncio.TimeoutError()
+        return [{"page": page} for page in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(parallel_extraction, "get_executor", lambda max_workers: None)
+    monkeypatch.setattr(parallel_extraction, "_run_page_range", run_page_range)
+    page_range_extraction = PageRangeExtraction(
+        "document.pdf", "/tmp", total_pages=10, chunk_size=4, chunk_timeout=1, max_workers=2
+    )
+
+    async def extract():
+        return [blocks async for blocks in page_range_extraction]
+
+    block_chunks = asyncio.run(extract())
+
+    assert [[block["page"] for block in blocks] for blocks in block_chunks] == [[0, 1, 2, 3], [8, 9]]
+    assert page_range_extraction.failed_pages == [4, 5, 6, 7]
+
+
+def test_pages_that_fail_to_render_are_missing(tmp_path):
+    file_path = str(tmp_path / "document.pdf")
+    with fitz.open() as pdf_document:
+        for _ in range(2):
+            pdf_document.new_page()
+        pdf_document.save(file_path)
+
+    page_images = render_pages(file_path, [0, 1, 5], str(tmp_path), dpi=20)
+
+    assert sorted(page_images) == [0, 1]
+    assert all(os.path.exists(image_path) for image_path in page_images.values())
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+
+import pytest
+from result_cache import ExtractionResultCache, s3_key_from_presigned_url
+
+BUCKET = "test-bucket"
+
+
+def presigned_url(key):
+    return f"https://{BUCKET}.s3.amazonaws.com/{key}?X-Amz-Signature=test"
+
+
+def extraction_results(textextraction_id):
+    text_key = f"textextraction/2024-06-01/{textextraction_id}/extracted_text.txt"
+    structured_text_key = f"textextraction/structured/{textextraction_id}/extracted_text.json"
+    return {
+        "text_presigned_url": presigned_url(text_key),
+        "structured_text_presigned_url": presigned_url(structured_text_key),
+        "total_pages": 2,
+        "total_words_count": 10,
+        "table_contents": [{"page": 1, "path": presigned_url("tables/table.csv")}],
+        "images_contents": [],
+    }
+
+
+@pytest.fixture
+def result_cache(s3_client):
+    for key in (
+        "textextraction/2024-06-01/first/extracted_text.txt",
+        "textextraction/structured/first/extracted_text.json",
+    ):
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"[]")
+    return ExtractionResultCache(BUCKET, s3_client)
+
+
+@pytest.mark.parametrize(
+    "url, key",
+    [
+        (f"https://{BUCKET}.s3.amazonaws.com/a/b.json?X-Amz-Signature=x", "a/b.json"),
+        (f"https://s3.us-east-1.amazonaws.com/{BUCKET}/a/b%20c.json?X-Amz-Signature=x", "a/b c.json"),
+        ("https://other-bucket.s3.amazonaws.com/a/b.json", None),
+        ("https://example.com/a/b.json", None),
+    ],
+)
+def test_s3_key_from_presigned_url(url, key):
+    assert s3_key_from_presigned_url(url, BUCKET) == key
+
+
+def test_hit_copies_the_structured_text(result_cache, s3_client):
+    asyncio.run(result_cache.put("doc-hash", extraction_results("first")))
+
+    results = asyncio.run(result_cache.get("doc-hash", "second"))
+
+    structured_text_key = "textextraction/structured/second/extracted_text.json"
+    assert s3_key_from_presigned_url(
+        results["structured_text_presigned_url"], BUCKET
+    ) == structured_text_key
+    assert (BUCKET, structured_text_key) in s3_client.objects
+    assert results["total_pages"] == 2
+    assert s3_key_from_presigned_url(results["table_contents"][0]["path"], BUCKET) == "tables/table.csv"
+
+
+def test_unknown_document_is_a_miss(result_cache):
+    assert asyncio.run(result_cache.get("other-hash", "second")) is None
+
+
+def test_results_without_structured_text_are_not_cached(result_cache):
+    results = {**extraction_results("first"), "structured_text_presigned_url": None}
+    asyncio.run(result_cache.put("doc-hash", results))
+
+    assert asyncio.run(result_cache.get("doc-hash", "second")) is None
+
+
+def test_deleted_text_is_a_miss(result_cache, s3_client):
+    asyncio.run(result_cache.put("doc-hash", extraction_results("first")))
+    del s3_client.objects[(BUCKET, "textextraction/2024-06-01/first/extracted_text.txt")]
+
+    assert asyncio.run(result_cache.get("doc-hash", "second")) is None
+
+
+def test_url_entry(result_cache):
+    validators = {"etag": '"abc"'}
+    asyncio.run(result_cache.put_url("https://example.com/a.pdf", validators, "doc-hash"))
+    asyncio.run(result_cache.put_url("https://example.com/b.pdf", {}, "doc-hash"))
+
+    url_entry = asyncio.run(result_cache.get_url_entry("https://example.com/a.pdf"))
+    assert url_entry["validators"] == validators
+    assert url_entry["content_hash"] == "doc-hash"
+    assert asyncio.run(result_cache.get_url_entry("https://example.com/b.pdf")) is None
+
+
+def test_expired_entries_are_misses(result_cache, monkeypatch):
+    asyncio.run(result_cache.put("doc-hash", extraction_results("first")))
+    asyncio.run(result_cache.put_url("https://example.com/a.pdf", {"etag": '"abc"'}, "doc-hash"))
+    stored_at = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: stored_at + result_cache.ttl + 1)
+
+    assert asyncio.run(result_cache.get("doc-hash", "second")) is None
+    assert asyncio.run(result_cache.get_url_entry("https://example.com/a.pdf")) is None
+
+
+def test_entries_without_write_time_are_expired(result_cache, s3_client):
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key=result_cache._url_key("https://example.com/a.pdf"),
+        Body=json.dumps({"validators": {"etag": '"abc"'}, "content_hash": "doc-hash"}),
+    )
+
+    assert asyncio.run(result_cache.get_url_entry("https://example.com/a.pdf")) is None
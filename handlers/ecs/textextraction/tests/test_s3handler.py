@@ -0,0 +1,20 @@
+import json
+
+from s3handler import put_gzip_object, read_object
+
+BUCKET = "test-bucket"
+
+
+def test_gzip_object_round_trip(s3_client):
+    contents = json.dumps([["first page"], ["second page"]])
+
+    put_gzip_object(s3_client, BUCKET, "extracted_text.json", contents, "application/json")
+
+    assert s3_client.objects[(BUCKET, "extracted_text.json")]["ContentEncoding"] == "gzip"
+    assert read_object(s3_client, BUCKET, "extracted_text.json").decode("utf-8") == contents
+
+
+def test_read_plain_object(s3_client):
+    s3_client.put_object(Bucket=BUCKET, Key="extracted_text.txt", Body="plain text")
+
+    assert read_object(s3_client, BUCKET, "extracted_text.txt") == b"plain text"
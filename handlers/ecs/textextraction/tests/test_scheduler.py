@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+import scheduler
+from scheduler import FairShareScheduler, SchedulerSaturated
+
+USER, SYSTEM = 1, 2
+
+
+@pytest.fixture(autouse=True)
+def no_memory_pressure(monkeypatch):
+    monkeypatch.setattr(scheduler, "memory_usage", lambda: (0, 1))
+
+
+def new_scheduler(max_concurrency=1, max_queued=100, max_queued_per_client=100, weights=None):
+    return FairShareScheduler(
+        max_concurrency=max_concurrency,
+        max_queued=max_queued,
+        max_queued_per_client=max_queued_per_client,
+        weights=weights or {USER: 1, SYSTEM: 1},
+    )
+
+
+def run_jobs(fair_scheduler, jobs):
+    """Submits the (client_id, request_type, name) jobs, returns the names in the order they ran"""
+    started = []
+
+    async def job(name):
+        started.append(name)
+        await asyncio.sleep(0)
+
+    async def main():
+        futures = [
+            fair_scheduler.submit(client_id, request_type, job, name)
+            for client_id, request_type, name in jobs
+        ]
+        dispatcher = asyncio.create_task(fair_scheduler.dispatch())
+        await asyncio.sleep(0)
+        fair_scheduler._notify()
+        await asyncio.gather(*futures)
+        dispatcher.cancel()
+
+    asyncio.run(main())
+    return started
+
+
+def test_burst_of_a_client_is_interleaved():
+    started = run_jobs(
+        new_scheduler(),
+        [
+            ("a", USER, "a1"),
+            ("a", USER, "a2"),
+            ("a", USER, "a3"),
+            ("b", USER, "b1"),
+            ("b", USER, "b2"),
+        ],
+    )
+
+    assert started == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_flows_share_by_weight():
+    started = run_jobs(
+        new_scheduler(weights={USER: 2, SYSTEM: 1}),
+        [("a", SYSTEM, f"system{idx}") for idx in range(3)] +
+        [("a", USER, f"user{idx}") for idx in range(4)],
+    )
+
+    assert started == ["system0", "user0", "user1", "system1", "user2", "user3", "system2"]
+
+
+def test_max_concurrency():
+    fair_scheduler = new_scheduler(max_concurrency=2)
+    running = []
+    max_running = []
+
+    async def job():
+        running.append(1)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def main():
+        futures = [fair_scheduler.submit(f"client{idx}", USER, job) for idx in range(6)]
+        dispatcher = asyncio.create_task(fair_scheduler.dispatch())
+        await asyncio.sleep(0)
+        fair_scheduler._notify()
+        await asyncio.gather(*futures)
+        dispatcher.cancel()
+
+    asyncio.run(main())
+
+    assert max(max_running) == 2
+    assert fair_scheduler.completed_count == 6
+
+
+def test_admission_limits():
+    fair_scheduler = new_scheduler(max_queued=3, max_queued_per_client=2)
+
+    async def job():
+        pass
+
+    async def main():
+        fair_scheduler.submit("a", USER, job)
+        fair_scheduler.submit("a", USER, job)
+        with pytest.raises(SchedulerSaturated) as client_error:
+            fair_scheduler.submit("a", USER, job)
+        fair_scheduler.submit("b", USER, job)
+        with pytest.raises(SchedulerSaturated) as queue_error:
+            fair_scheduler.submit("c", USER, job)
+        # The system jobs of a batch are not limited
+        fair_scheduler.submit("c", SYSTEM, job, enforce_limits=False)
+        return client_error.value, queue_error.value
+
+    client_error, queue_error = asyncio.run(main())
+
+    assert "client a" in str(client_error)
+    assert "queue is full" in str(queue_error)
+    assert queue_error.retry_after >= 1
+    assert fair_scheduler.rejected_count == 2
+    assert fair_scheduler.queue_depth == 4
+
+
+def test_failed_job_completes_its_future():
+    fair_scheduler = new_scheduler()
+
+    async def job():
+        raise RuntimeError("extraction failed")
+
+    async def main():
+        future = fair_scheduler.submit("a", USER, job)
+        dispatcher = asyncio.create_task(fair_scheduler.dispatch())
+        await asyncio.sleep(0)
+        fair_scheduler._notify()
+        result = await future
+        dispatcher.cancel()
+        return result
+
+    assert asyncio.run(main()) is None
+    assert fair_scheduler.running == 0
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from sqs_consumer import SQSConsumerPool
+
+REAL_SLEEP = asyncio.sleep
+
+
+class FakeSQSClient:
+    """Records the calls of the consumer pool"""
+
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.calls = []
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        messages = self.messages[:MaxNumberOfMessages]
+        del self.messages[:MaxNumberOfMessages]
+        return {"Messages": messages}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.calls.append(("change_message_visibility", ReceiptHandle))
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.calls.append(("delete_message", ReceiptHandle))
+
+
+@pytest.fixture(autouse=True)
+def fast_sleep(monkeypatch):
+    """The consumer waits (visibility interval, empty polls) 100 times faster"""
+    monkeypatch.setattr(asyncio, "sleep", lambda secs: REAL_SLEEP(secs / 100))
+
+
+def queue_message(receipt_handle):
+    attributes = {
+        "client_id": "client",
+        "url": f"https://example.com/{receipt_handle}.pdf",
+        "textextraction_id": receipt_handle,
+    }
+    return {
+        "ReceiptHandle": receipt_handle,
+        "MessageAttributes": {
+            key: {"StringValue": value, "DataType": "String"} for key, value in attributes.items()
+        },
+    }
+
+
+def new_pool(sqs_client, handler, concurrency=4, visibility_timeout=2):
+    return SQSConsumerPool(
+        sqs_client,
+        "https://sqs/queue",
+        handler,
+        message_attribute_names=["All"],
+        concurrency=concurrency,
+        visibility_timeout=visibility_timeout,
+        wait_time_secs=0,
+    )
+
+
+def test_visibility_is_extended_while_the_job_runs():
+    sqs_client = FakeSQSClient()
+
+    async def handler(client_id, url, textextraction_id, callback_url):
+        # 3.5 visibility intervals (1 sec each, a hundredth with the fast sleep)
+        await REAL_SLEEP(0.035)
+
+    asyncio.run(new_pool(sqs_client, handler)._process_message(queue_message("m1")))
+
+    *extensions, deletion = sqs_client.calls
+    assert len(extensions) >= 2
+    assert set(extensions) == {("change_message_visibility", "m1")}
+    assert deletion == ("delete_message", "m1")
+
+
+def test_visibility_is_not_extended_after_the_job():
+    sqs_client = FakeSQSClient()
+
+    async def handler(client_id, url, textextraction_id, callback_url):
+        pass
+
+    async def main():
+        await new_pool(sqs_client, handler)._process_message(queue_message("m1"))
+        await REAL_SLEEP(0.03)
+
+    asyncio.run(main())
+
+    assert sqs_client.calls == [("delete_message", "m1")]
+
+
+def test_every_message_is_deleted_once_its_own_job_is_done():
+    sqs_client = FakeSQSClient([queue_message("slow"), queue_message("failing"), queue_message("fast")])
+    slow_job_release = None
+    deleted_before_release = []
+
+    async def handler(client_id, url, textextraction_id, callback_url):
+        if textextraction_id == "slow":
+            await slow_job_release.wait()
+        elif textextraction_id == "failing":
+            raise RuntimeError("extraction failed")
+
+    async def main():
+        nonlocal slow_job_release
+        slow_job_release = asyncio.Event()
+        consumer = asyncio.create_task(new_pool(sqs_client, handler, visibility_timeout=120).run())
+        while len(sqs_client.calls) < 2:
+            await REAL_SLEEP(0.001)
+        deleted_before_release.extend(sqs_client.calls)
+        slow_job_release.set()
+        while len(sqs_client.calls) < 3:
+            await REAL_SLEEP(0.001)
+        consumer.cancel()
+
+    asyncio.run(main())
+
+    assert sorted(deleted_before_release) == [("delete_message", "failing"), ("delete_message", "fast")]
+    assert sqs_client.calls[-1] == ("delete_message", "slow")
+
+
+def test_at_most_concurrency_jobs_run():
+    sqs_client = FakeSQSClient([queue_message(f"m{idx}") for idx in range(5)])
+    running, max_running, done = 0, 0, []
+
+    async def handler(client_id, url, textextraction_id, callback_url):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await REAL_SLEEP(0.01)
+        running -= 1
+        done.append(textextraction_id)
+
+    async def main():
+        consumer = asyncio.create_task(new_pool(sqs_client, handler, concurrency=2).run())
+        while len(done) < 5:
+            await REAL_SLEEP(0.001)
+        consumer.cancel()
+
+    asyncio.run(main())
+
+    assert max_running == 2
+    assert sorted(done) == [f"m{idx}" for idx in range(5)]
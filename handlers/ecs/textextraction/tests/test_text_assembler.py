@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import pytest
+from text_assembler import StructuredTextAssembler, TextAssembler
+
+BUCKET = "test-bucket"
+
+
+class FakeUploadClient:
+    """Keeps the uploaded file objects and their extra args"""
+
+    def __init__(self):
+        self.uploads = {}
+
+    def upload_fileobj(self, fileobj, bucket_name, key, ExtraArgs=None, Config=None):
+        self.uploads[key] = (fileobj.read(), ExtraArgs)
+
+    def generate_presigned_url(self, client_method, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}"
+
+
+def test_pages_markers_and_words_count():
+    text_contents = TextAssembler(compress=False)
+    text_contents.add_page(1, ["Hello, world!\x00 ", "foo_bar"])
+    text_contents.add_page(2, [])
+
+    assert text_contents.getvalue() == (
+        "********* [PAGE 1 START] *********\n"
+        "Hello, world! foo_bar"
+        "\n********* [PAGE 1 END] *********\n"
+        "********* [PAGE 2 START] *********\n"
+        "\n********* [PAGE 2 END] *********\n"
+    )
+    assert text_contents.pages_count == 2
+    # The page markers are counted as words, like get_words_count of the whole text
+    assert text_contents.words_count == 3 + 4 * 3
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_structured_text_is_the_json_of_the_pages(compress):
+    pages = [["first", "page"], [], ["é, \"quoted\""]]
+    structured_text = StructuredTextAssembler(compress=compress)
+    for page_texts in pages:
+        structured_text.add_page(page_texts)
+
+    assert structured_text.getvalue() == json.dumps(pages)
+    assert StructuredTextAssembler.from_pages(pages).pages_count == 3
+
+
+def test_gzip_upload_round_trip():
+    s3_client = FakeUploadClient()
+    pages = [["first page"], ["second page"]]
+    structured_text = StructuredTextAssembler.from_pages(pages)
+
+    presigned_url = structured_text.upload(
+        s3_client=s3_client,
+        bucket_name=BUCKET,
+        key="textextraction/structured/id/extracted_text.json",
+        signed_url_expiry_secs=3600,
+    )
+
+    body, extra_args = s3_client.uploads["textextraction/structured/id/extracted_text.json"]
+    assert extra_args == {"ContentType": "application/json", "ContentEncoding": "gzip"}
+    assert json.loads(gzip.decompress(body)) == pages
+    assert presigned_url.endswith("textextraction/structured/id/extracted_text.json")
+
+
+def test_upload_without_compression():
+    s3_client = FakeUploadClient()
+    text_contents = TextAssembler(compress=False)
+    text_contents.add_page(1, ["text"])
+
+    text_contents.upload(
+        s3_client=s3_client, bucket_name=BUCKET, key="extracted_text.txt", signed_url_expiry_secs=60
+    )
+
+    body, extra_args = s3_client.uploads["extracted_text.txt"]
+    assert "ContentEncoding" not in extra_args
+    assert body.decode("utf-8") == text_contents.getvalue()
@@ -0,0 +1,60 @@
+import asyncio
+
+import metrics
+import pytest
+from timings import StageMetrics, job_timings, span
+
+
+class FakeCloudWatchClient:
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.calls.append((Namespace, MetricData))
+
+
+def test_metric_data_of_the_stages():
+    stage_metrics = StageMetrics()
+    for duration_secs in (1.0, 2.0, 6.0):
+        stage_metrics.record("download", duration_secs)
+
+    metric_data = {metric["MetricName"]: metric["Value"] for metric in stage_metrics.metric_data("dev")}
+
+    assert metric_data == {"download_count": 3, "download_avg_secs": 3.0, "download_max_secs": 6.0}
+    assert stage_metrics.metric_data("dev") == []
+
+
+def test_metrics_are_published_in_chunks(monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_METRIC_DATA", 4)
+    stage_metrics = StageMetrics()
+    for stage in ("download", "parse", "upload"):
+        stage_metrics.record(stage, 1.0)
+    cw_client = FakeCloudWatchClient()
+
+    async def publish_once():
+        task = asyncio.create_task(
+            stage_metrics.publish(cw_client, "TextExtraction", "dev", interval=0.01)
+        )
+        while len(cw_client.calls) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(publish_once())
+
+    assert [len(metric_data) for _, metric_data in cw_client.calls] == [4, 4, 1]
+    assert {namespace for namespace, _ in cw_client.calls} == {"TextExtraction"}
+
+
+def test_spans_of_the_job():
+    with job_timings("textextraction-id", "https://example.com/a.pdf") as job:
+        with span("download"):
+            pass
+        with pytest.raises(ValueError):
+            with span("parse", pages=2):
+                raise ValueError("invalid pdf")
+
+    assert [(record["stage"], record["outcome"]) for record in job.spans] == [
+        ("download", "ok"),
+        ("parse", "error"),
+    ]
+    assert job.spans[1]["pages"] == 2
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+from web_sessions import WebSessionPool
+
+
+class FakeWebExtractor:
+    """Records the pages extracted by every session"""
+
+    instances = []
+
+    def __init__(self, url, delay=0.0, slow_urls=None, failing_urls=()):
+        self.delay = delay
+        self.slow_urls = slow_urls
+        self.failing_urls = failing_urls
+        self.pages = []
+        self.closed = False
+        FakeWebExtractor.instances.append(self)
+
+    def extract_text(self, output_format="list", url=None):
+        if self.delay and (self.slow_urls is None or url in self.slow_urls):
+            threading.Event().wait(self.delay)
+        if url in self.failing_urls:
+            raise RuntimeError("page crashed")
+        self.pages.append(url)
+        return [f"text of {url}"]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def reset_instances():
+    FakeWebExtractor.instances = []
+
+
+def new_pool(size=1, timeout=5, max_uses=20, **extractor_kwargs):
+    return WebSessionPool(
+        factory=lambda url: FakeWebExtractor(url, **extractor_kwargs),
+        size=size,
+        timeout=timeout,
+        max_uses=max_uses,
+    )
+
+
+def extract_pages(pool, urls):
+    async def main():
+        results = []
+        for url in urls:
+            try:
+                results.append(await pool.extract(url))
+            except Exception as exc:
+                results.append(type(exc).__name__)
+        return results
+
+    try:
+        return asyncio.run(main())
+    finally:
+        pool.close()
+
+
+def test_session_is_reused_until_max_uses():
+    pool = new_pool(max_uses=2)
+
+    results = extract_pages(pool, ["https://a", "https://b", "https://c"])
+
+    assert results == [["text of https://a"], ["text of https://b"], ["text of https://c"]]
+    first_session, second_session = FakeWebExtractor.instances
+    assert first_session.pages == ["https://a", "https://b"]
+    assert first_session.closed
+    assert second_session.pages == ["https://c"]
+    assert pool.stats()["sessions_created"] == 2
+
+
+def test_session_is_recycled_after_a_failure():
+    pool = new_pool(failing_urls=("https://crash",))
+
+    results = extract_pages(pool, ["https://crash", "https://a"])
+
+    assert results == ["RuntimeError", ["text of https://a"]]
+    first_session, second_session = FakeWebExtractor.instances
+    assert first_session.closed
+    assert second_session.pages == ["https://a"]
+    assert pool.stats()["failures"] == 1
+
+
+def test_session_is_recycled_after_a_timeout():
+    pool = new_pool(timeout=0.05, delay=0.1, slow_urls=("https://slow",))
+
+    results = extract_pages(pool, ["https://slow", "https://a"])
+
+    assert results == ["TimeoutError", ["text of https://a"]]
+    first_session, second_session = FakeWebExtractor.instances
+    # The timed out page still completes, then its session is closed
+    assert first_session.pages == ["https://slow"]
+    assert first_session.closed
+    assert second_session.pages == ["https://a"]
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_pages_wait_for_a_free_session():
+    pool = new_pool(size=2, delay=0.02)
+
+    async def main():
+        extractions = [pool.extract(f"https://{idx}") for idx in range(5)]
+        return await asyncio.gather(*extractions)
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        pool.close()
+
+    assert results == [[f"text of https://{idx}"] for idx in range(5)]
+    assert len(FakeWebExtractor.instances) == 2
+    assert pool.stats()["busy"] == 0
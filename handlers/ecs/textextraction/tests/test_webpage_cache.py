@@ -0,0 +1,73 @@
+import time
+
+from webpage_cache import WebpageCache
+
+VALIDATORS = {"etag": '"abc"', "last_modified": "Wed, 01 May 2024 10:00:00 GMT"}
+
+
+def test_hit_after_revalidation():
+    webpage_cache = WebpageCache()
+    webpage_cache.put("https://example.com/page", VALIDATORS, ["first entry"])
+
+    page = webpage_cache.get("https://example.com/page")
+
+    assert WebpageCache.conditional_headers(page) == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Wed, 01 May 2024 10:00:00 GMT",
+    }
+    assert webpage_cache.hit(page) == ["first entry"]
+    assert webpage_cache.stats()["hit_rate"] == 0.5
+
+
+def test_pages_without_validators_are_not_cached():
+    webpage_cache = WebpageCache()
+    webpage_cache.put("https://example.com/page", {}, ["first entry"])
+
+    assert webpage_cache.get("https://example.com/page") is None
+    assert WebpageCache.conditional_headers(None) == {}
+
+
+def test_changed_page_replaces_the_entry():
+    webpage_cache = WebpageCache()
+    webpage_cache.put("https://example.com/page", VALIDATORS, ["first entry"])
+    webpage_cache.put("https://example.com/page", {"etag": '"def"'}, ["second entry"])
+
+    assert webpage_cache.get("https://example.com/page")["entries"] == ["second entry"]
+    assert webpage_cache.changed_count == 1
+    assert webpage_cache.stats()["pages"] == 1
+
+
+def test_least_recently_used_pages_are_evicted():
+    webpage_cache = WebpageCache(max_entries=2)
+    webpage_cache.put("https://example.com/a", VALIDATORS, ["a"])
+    webpage_cache.put("https://example.com/b", VALIDATORS, ["b"])
+    webpage_cache.get("https://example.com/a")
+    webpage_cache.put("https://example.com/c", VALIDATORS, ["c"])
+
+    assert webpage_cache.get("https://example.com/b") is None
+    assert webpage_cache.get("https://example.com/a") is not None
+    assert webpage_cache.evictions_count == 1
+
+
+def test_size_limit():
+    webpage_cache = WebpageCache(max_bytes=30)
+    webpage_cache.put("https://example.com/big", VALIDATORS, ["x" * 100])
+    webpage_cache.put("https://example.com/a", VALIDATORS, ["a" * 15])
+    webpage_cache.put("https://example.com/b", VALIDATORS, ["b" * 15])
+
+    assert webpage_cache.get("https://example.com/big") is None
+    assert webpage_cache.get("https://example.com/a") is None
+    assert webpage_cache.get("https://example.com/b") is not None
+    assert webpage_cache.total_bytes <= 30
+
+
+def test_expired_pages(monkeypatch):
+    webpage_cache = WebpageCache(ttl=60)
+    webpage_cache.put("https://example.com/page", VALIDATORS, ["first entry"])
+    stored_at = time.monotonic()
+
+    monkeypatch.setattr(time, "monotonic", lambda: stored_at + 61)
+
+    assert webpage_cache.get("https://example.com/page") is None
+    assert webpage_cache.expirations_count == 1
+    assert webpage_cache.total_bytes == 0
@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import zlib
+from gzip import GzipFile
+from tempfile import SpooledTemporaryFile
+
+from boto3.s3.transfer import TransferConfig
+
+# Same as get_words_count: punctuation and underscores are dropped before splitting
+NON_WORD_CHARS_REGEX = re.compile(r"[^\w\s]|_")
+
+MB = 1024 * 1024
+
+# The extracted text and structured json artifacts are stored gzip encoded
+ARTIFACTS_COMPRESSION_ENABLED = (
+    os.environ.get("ARTIFACTS_COMPRESSION_ENABLED", "true").lower() == "true"
+)
+
+
+class SpooledArtifact:
+    """
+    Artifact written in a single pass to a spooled file (kept in memory up to
+    max_memory_size) which is then streamed to s3 with a multipart upload.
+    With compress, the contents are gzip compressed as they are written and
+    stored with the gzip Content-Encoding.
+    """
+
+    content_type = "application/octet-stream"
+
+    def __init__(self, max_memory_size: int = 8 * MB, compress: bool = ARTIFACTS_COMPRESSION_ENABLED):
+        self._buffer = SpooledTemporaryFile(max_size=max_memory_size, mode="w+b")
+        self.compress = compress
+        self._writer = (
+            GzipFile(mode="wb", fileobj=self._buffer, mtime=0.0, compresslevel=6)
+            if compress
+            else self._buffer
+        )
+
+    def getvalue(self):
+        """Whole contents (only meant for small documents)"""
+        self._writer.flush()
+        self._buffer.seek(0)
+        contents = self._buffer.read()
+        self._buffer.seek(0, 2)
+        if self.compress:
+            # The gzip trailer is only written on upload
+            contents = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(contents)
+        return contents.decode("utf-8")
+
+    def _finish(self):
+        """Completes the contents before the upload"""
+
+    def upload(
+        self,
+        s3_client,
+        bucket_name: str,
+        key: str,
+        signed_url_expiry_secs: int,
+        content_type: str = None,
+        part_size: int = 8 * MB,
+    ):
+        """Streams the contents to s3 (multipart for big documents), returns its presigned url"""
+        self._finish()
+        extra_args = {"ContentType": content_type or self.content_type}
+        if self.compress:
+            self._writer.close()  # writes the gzip trailer, the buffer stays open
+            extra_args["ContentEncoding"] = "gzip"
+        self._buffer.seek(0)
+        s3_client.upload_fileobj(
+            self._buffer,
+            bucket_name,
+            key,
+            ExtraArgs=extra_args,
+            Config=TransferConfig(
+                multipart_threshold=part_size, multipart_chunksize=part_size
+            ),
+        )
+        return s3_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": key},
+            ExpiresIn=int(signed_url_expiry_secs),
+        )
+
+    def close(self):
+        self._writer.close()
+        self._buffer.close()
+
+
+class TextAssembler(SpooledArtifact):
+    """
+    Assembles the extracted text page by page in a single pass.
+    The page markers are added, NUL characters and invalid utf-8 code points
+    are removed and the words are counted while the text is written.
+    """
+
+    content_type = "text/plain; charset=utf-8"
+
+    def __init__(self, max_memory_size: int = 8 * MB, compress: bool = ARTIFACTS_COMPRESSION_ENABLED):
+        super().__init__(max_memory_size=max_memory_size, compress=compress)
+        self.words_count = 0
+        self.pages_count = 0
+
+    def write(self, text: str):
+        """Writes the sanitised text"""
+        if not text:
+            return
+        self._writer.write(text.replace("\x00", "").encode("utf-8", "ignore"))
+        self.words_count += len(NON_WORD_CHARS_REGEX.sub("", text).split())
+
+    def add_page(self, page_number: int, page_texts):
+        """Writes the texts of the page between its start and end markers"""
+        self.write(f"********* [PAGE {page_number} START] *********\n")
+        for text in page_texts:
+            self.write(text)
+        self.write(f"\n********* [PAGE {page_number} END] *********\n")
+        self.pages_count += 1
+
+
+class StructuredTextAssembler(SpooledArtifact):
+    """
+    Assembles the structured text (json list of the texts of every page) page by
+    page, so that the finished pages don't stay in memory. The output is the same
+    as json.dumps of the whole list.
+    """
+
+    content_type = "application/json"
+
+    def __init__(self, max_memory_size: int = 8 * MB, compress: bool = ARTIFACTS_COMPRESSION_ENABLED):
+        super().__init__(max_memory_size=max_memory_size, compress=compress)
+        self.pages_count = 0
+        self._writer.write(b"[")
+
+    @classmethod
+    def from_pages(cls, pages: list):
+        structured_text = cls()
+        for page_texts in pages:
+            structured_text.add_page(page_texts)
+        return structured_text
+
+    def add_page(self, page_texts: list):
+        if self.pages_count:
+            self._writer.write(b", ")
+        self._writer.write(json.dumps(page_texts).encode("utf-8"))
+        self.pages_count += 1
+
+    def _finish(self):
+        self._writer.write(b"]")
+
+    def getvalue(self):
+        return super().getvalue() + "]"
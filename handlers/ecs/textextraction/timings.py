@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import psutil
+from metrics import metric_datum, module_dimensions, put_metric_data
+
+logging.getLogger().setLevel(logging.INFO)
+
+# The job of the running task, copied into its sub tasks and threads
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobTimings:
+    """Stage spans of an extraction job, tagged with the document properties"""
+
+    def __init__(self, textextraction_id: str, url: str):
+        self.textextraction_id = textextraction_id
+        self.url = url
+        self.tags = {}
+        self.spans = []
+        self.start_time = time.perf_counter()
+        self.total_secs = None
+        self.start_rss = None
+        self.peak_rss = None
+
+    def tag(self, **tags):
+        self.tags.update({name: value for name, value in tags.items() if value is not None})
+
+    def to_dict(self):
+        return {
+            "textextraction_id": self.textextraction_id,
+            "url": self.url,
+            "total_secs": self.total_secs,
+            "start_rss_mb": _mb(self.start_rss),
+            "peak_rss_mb": _mb(self.peak_rss),
+            **self.tags,
+            "stages": self.spans,
+        }
+
+
+def _mb(size_bytes):
+    return round(size_bytes / 1024 / 1024, 1) if size_bytes is not None else None
+
+
+def task_rss():
+    """Resident memory of the task, i.e. the process and its workers (page ranges)"""
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+class RSSMonitor:
+    """
+    Samples the resident memory while jobs are running and keeps the peak of
+    every job. The jobs share the task, so the peak of a job is the peak of the
+    task during the job (the concurrent jobs included).
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                jobs = list(self._jobs)
+            if not jobs:
+                continue
+            try:
+                rss = task_rss()
+            except psutil.Error:
+                continue
+            for job in jobs:
+                job.peak_rss = max(job.peak_rss or 0, rss)
+
+    def add(self, job: JobTimings):
+        job.start_rss = job.peak_rss = task_rss()
+        with self._lock:
+            self._jobs.add(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+                self._thread.start()
+
+    def remove(self, job: JobTimings):
+        with self._lock:
+            self._jobs.discard(job)
+        job.peak_rss = max(job.peak_rss or 0, task_rss())
+
+
+class StageMetrics:
+    """
+    Durations of the stages, aggregated between two publications so that
+    CloudWatch gets a few data points per stage and interval, not per job.
+    """
+
+    def __init__(self):
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, duration_secs: float):
+        with self._lock:
+            self._durations[stage].append(duration_secs)
+
+    def drain(self):
+        with self._lock:
+            durations, self._durations = self._durations, defaultdict(list)
+        return durations
+
+    def metric_data(self, environment: str):
+        """Count, average and max duration of every stage since the last call"""
+        dimensions = module_dimensions(environment)
+        return [
+            metric_datum(metric_name, metric_value, dimensions)
+            for stage, durations in self.drain().items()
+            for metric_name, metric_value in (
+                (f"{stage}_count", len(durations)),
+                (f"{stage}_avg_secs", round(sum(durations) / len(durations), 3)),
+                (f"{stage}_max_secs", round(max(durations), 3)),
+            )
+        ]
+
+    async def publish(self, cw_client, namespace: str, environment: str, interval: int = 60):
+        """Publishes the stage metrics in a single call per interval, runs forever"""
+        while True:
+            await asyncio.sleep(interval)
+            await put_metric_data(cw_client, namespace, self.metric_data(environment))
+
+
+stage_metrics = StageMetrics()
+rss_monitor = RSSMonitor()
+
+
+def tag_job(**tags):
+    """Tags the running job (content type, page count, size ...)"""
+    job = _current_job.get()
+    if job:
+        job.tag(**tags)
+
+
+@contextmanager
+def span(stage: str, **tags):
+    """Times the stage, logged as a structured record and added to the job and stage metrics"""
+    start_time = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration_secs = round(time.perf_counter() - start_time, 3)
+        stage_metrics.record(stage, duration_secs)
+        record = {"stage": stage, "duration_secs": duration_secs, "outcome": outcome, **tags}
+        job = _current_job.get()
+        if job:
+            job.spans.append(record)
+            record = {"textextraction_id": job.textextraction_id, **job.tags, **record}
+        logging.info("stage_timing %s", json.dumps(record, default=str))
+
+
+@contextmanager
+def job_timings(textextraction_id: str, url: str):
+    """Collects the spans of the stages run inside the block for the job"""
+    job = JobTimings(textextraction_id, url)
+    token = _current_job.set(job)
+    rss_monitor.add(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+        rss_monitor.remove(job)
+        job.total_secs = round(time.perf_counter() - job.start_time, 3)
+        stage_metrics.record("total", job.total_secs)
+        logging.info("job_timing %s", json.dumps(job.to_dict(), default=str))
@@ -1,45 +1,98 @@
 import asyncio
+import functools
 import json
 import logging
 import re
-import tempfile
 from datetime import date
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import aiofiles
-import httpx
-import numpy as np
 from botocore.exceptions import (ClientError, ConnectTimeoutError,
                                  ReadTimeoutError)
+from content_types import SNIFF_SIZE
+from document import SpooledDocument
+from http_client import http_client
 from nlp_modules_utils import generate_presigned_url
 from ocr_extractor import OCRProcessor
 from PIL import Image
+from text_assembler import TextAssembler
 
 logging.getLogger().setLevel(logging.INFO)
 
 
-def create_tempfile(response):
-    """
-    Creates a temporary file
-    """
-    tempf = tempfile.NamedTemporaryFile(mode="w+b")
-    for chunk in response.iter_content(chunk_size=128):
-        tempf.write(chunk)
-    tempf.seek(0)
-    return tempf
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
 
-async def create_async_tempfile(url: str, headers: dict, timeout: int = 30):
-    """Creates a async tempfile"""
-    client = httpx.AsyncClient()
-    tempf = tempfile.NamedTemporaryFile(mode="w+b")
-    async with client.stream(
-        "GET", url=url, headers=headers, timeout=timeout
+def normalize_url(url: str):
+    """
+    Normalised url to recognise the requests of the same document: lower case
+    scheme and host, no default port, no fragment and sorted query parameters.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+async def download_document(
+    url: str,
+    headers: dict,
+    timeout: int = 60,
+    resolve_content_type=None,
+    skip_body_types=(),
+):
+    """
+    Downloads the document once into a local spooled copy.
+    The download stops after the sniffed prefix if the type resolved by
+    resolve_content_type(document), from the headers and the first bytes, is one
+    of skip_body_types (e.g. webpages which are rendered by the web extractor).
+    A conditional request (cached webpage) answered with 304 returns a document
+    without body flagged as not_modified.
+    """
+    async with http_client.stream(
+        "GET", url=url, headers=headers, timeout=timeout, follow_redirects=True
     ) as response:
-        async for chunk in response.aiter_bytes():
-            tempf.write(chunk)
-        tempf.seek(0)
-    await client.aclose()
-    return tempf
+        if response.status_code == 304:
+            document = SpooledDocument(url, response.headers)
+            document.not_modified = True
+            return document
+        response.raise_for_status()
+        document = SpooledDocument(url, response.headers)
+        try:
+            resolved = resolve_content_type is None or not skip_body_types
+            async for chunk in response.aiter_bytes():
+                document.write(chunk)
+                if not resolved and len(document.prefix) >= SNIFF_SIZE:
+                    resolved = True
+                    if resolve_content_type(document) in skip_body_types:
+                        break
+        except Exception:
+            document.close()
+            raise
+    document.flush()
+    return document
+
+
+def download_s3_document(s3_client, bucket_name: str, key: str):
+    """Downloads the s3 object into a local spooled copy"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    document = SpooledDocument(key, {"Content-Type": response.get("ContentType")})
+    try:
+        for chunk in response["Body"].iter_chunks(chunk_size=1024 * 1024):
+            document.write(chunk)
+    except Exception:
+        document.close()
+        raise
+    document.flush()
+    return document
 
 
 def get_words_count(text):
@@ -62,28 +115,18 @@ def preprocess_extracted_texts(text):
     return extracted_text
 
 
-def download_file(s3_client, filename_s3, bucketname, filename_local):
-    """
-    Downloads the file
-    """
-    try:
-        s3_client.download_file(bucketname, filename_s3, filename_local)
-        logging.info("The file is downloaded in the lambda /tmp directory.")
-    except ClientError as cexc:
-        logging.error("Client error occurred. %s", str(cexc))
-        return False
-    return True
-
-
 async def invoke_conversion_lambda(
     lambda_client,
     docs_conversion_bucket_name,
     docs_convert_lambda_fn_name,
     tmp_filename,
     ext_type,
+    executor=None,
 ):
     """
     Invoke lambda function to convert documents(docx, pptx, xlsx) to pdf
+    The invocation waits for the conversion in the executor threads
+    (the default one if None) so the event loop is not blocked meanwhile.
     """
     logging.info("File conversion request initiated.")
     payload = json.dumps(
@@ -95,11 +138,14 @@ async def invoke_conversion_lambda(
         }
     )
     try:
-        docs_conversion_lambda_response = await asyncio.to_thread(
-            lambda_client.invoke,
-            FunctionName=docs_convert_lambda_fn_name,
-            InvocationType="RequestResponse",
-            Payload=payload,
+        docs_conversion_lambda_response = await asyncio.get_running_loop().run_in_executor(
+            executor,
+            functools.partial(
+                lambda_client.invoke,
+                FunctionName=docs_convert_lambda_fn_name,
+                InvocationType="RequestResponse",
+                Payload=payload,
+            ),
         )
     except ClientError as cexc:
         logging.error("Client error occurred during lambda invocation. %s", str(cexc))
@@ -113,113 +159,143 @@ async def invoke_conversion_lambda(
     return docs_conversion_lambda_response_json
 
 
-def append_text(f):
-    def inner(main_txt, pgnum):
-        start_text = f"********* [PAGE {pgnum} START] *********"
-        end_text = f"********* [PAGE {pgnum} END] *********"
-        final_data = start_text + "\n" + main_txt + "\n" + end_text + "\n"
-        return f(final_data, pgnum)
-
-    return inner
-
-
-def append_ocr_text(f):
-    def inner(main_txt):
-        start_text = "-" * 100
-        end_text = "-" * 100
-        final_data = start_text + "\n" + main_txt + "\n" + end_text + "\n"
-        return f(final_data)
-
-    return inner
-
-
-@append_text
-def beautify_extracted_text(text, pgnum):
-    return text
-
-
-@append_ocr_text
-def beautify_ocr_text(text):
-    return text
+def ocr_page_texts(texts: list):
+    """Surrounds the ocr texts of a page with separator lines"""
+    return ["-" * 100 + "\n", *texts, "\n" + "-" * 100 + "\n"]
 
 
 def filter_file_by_size(file_path: str, filesize: int = 100_000):
-    """Filters images/files based on the file size"""
-    img = np.array(Image.open(file_path))
-    if img.size >= filesize:
+    """
+    Filters images/files based on the file size.
+    Only the image header is read to get its dimensions and bands.
+    """
+    with Image.open(file_path) as img:
+        width, height = img.size
+        img_size = width * height * len(img.getbands())
+    if img_size >= filesize:
         return True
     return False
 
 
 async def handle_scanned_doc_or_image(
-    url: str,
+    file_path: str,
     is_image: bool,
     s3_bucket_name: str,
     textextraction_id: str,
-    headers: dict,
-    req_timeout: int = 30,
+    ocr_pool=None,
+    timeout: int = None,
 ):
-    """Handles complete scanned document or image"""
+    """
+    Handles complete scanned document or image (in the OCR worker pool, if given)
+    within timeout secs.
+    Returns the texts, the structured text, the tables, the images and whether the OCR succeeded.
+    """
     date_today = date.today().isoformat()
-    tempf = await create_async_tempfile(url=url, headers=headers, timeout=req_timeout)
+    ocr_config = {
+        "extraction_type": 4,
+        "show_log": False,
+        "use_s3": True,
+        "s3_bucket_name": s3_bucket_name,
+        "s3_bucket_key": f"textextraction/{date_today}/{textextraction_id}",
+    }
     try:
-        ocr_engine = OCRProcessor(
-            extraction_type=4,
-            show_log=False,
-            use_s3=True,
-            s3_bucket_name=s3_bucket_name,
-            s3_bucket_key=f"textextraction/{date_today}/{textextraction_id}",
-        )
-        ocr_engine.load_file(file_path=tempf.name, is_image=is_image)
-        results = await ocr_engine.handler()
+        if ocr_pool:
+            # The timeout starts once a worker picks it up
+            results = await ocr_pool.ocr_document(ocr_config, file_path, is_image, timeout=timeout)
+        else:
+            ocr_engine = OCRProcessor(**ocr_config)
+            ocr_engine.load_file(file_path=file_path, is_image=is_image)
+            results = await asyncio.wait_for(ocr_engine.handler(), timeout=timeout)
+    except asyncio.exceptions.TimeoutError:
+        logging.warning("Timeout occurred while extracting the contents with OCR.")
+        return TextAssembler(), [[]], [], [], False
     except Exception as exc:
         logging.warning("Exception occurred while extracting contents %s", str(exc))
-        return "", [[]], []
+        return TextAssembler(), [[]], [], [], False
 
     tables = results["table"]
-    texts = ""
-    temp_texts = ""
+    texts = TextAssembler()
+    temp_texts = []
     structured_text = []
     structured_text_temp = []
     page_num = 0
     for text_block in results["text"]:
         if text_block["page_number"] == page_num:
-            temp_texts += text_block["content"] + "\n\n\n"
+            temp_texts.append(text_block["content"] + "\n\n\n")
             structured_text_temp.append(text_block["content"])
         else:
-            temp_texts = beautify_ocr_text(temp_texts)
-            texts += beautify_extracted_text(temp_texts, page_num + 1)
-            temp_texts = ""
-            temp_texts += text_block["content"] + "\n\n\n"
+            texts.add_page(page_num + 1, ocr_page_texts(temp_texts))
+            temp_texts = [text_block["content"] + "\n\n\n"]
             structured_text.append(structured_text_temp)
             structured_text_temp = []
             structured_text_temp.append(text_block["content"])
             page_num += 1
-    if texts or temp_texts:
-        temp_texts = beautify_ocr_text(temp_texts)
-        texts += beautify_extracted_text(temp_texts, page_num + 1)
+    if texts.pages_count or temp_texts:
+        texts.add_page(page_num + 1, ocr_page_texts(temp_texts))
         structured_text.append(structured_text_temp)
 
-    return texts, structured_text, tables, results["image"]
+    return texts, structured_text, tables, results["image"], True
+
+
+async def ocr_page_image(image_path: str, semaphore):
+    """Texts of the page image"""
+    async with semaphore:
+        ocr_engine = OCRProcessor(extraction_type=1, show_log=False, use_s3=False)
+        await asyncio.to_thread(ocr_engine.load_file, file_path=image_path, is_image=True)
+        results = await ocr_engine.handler()
+    return [text_block["content"] for text_block in results["text"]]
+
+
+async def ocr_pages(page_images: dict, concurrency: int):
+    """
+    OCR of the page images in parallel. Returns the texts of every page,
+    the pages that failed are missing.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    page_numbers = list(page_images)
+    results = await asyncio.gather(
+        *[ocr_page_image(page_images[page_number], semaphore) for page_number in page_numbers],
+        return_exceptions=True,
+    )
+    page_texts = {}
+    for page_number, result in zip(page_numbers, results):
+        if isinstance(result, Exception):
+            logging.warning("OCR of the page %s failed. %s", page_number + 1, str(result))
+        else:
+            page_texts[page_number] = result
+    return page_texts
 
 
 async def uploadfile_s3(
     filepath: str, bucket_name: str, textextraction_id: str, s3_client
 ):
-    """Upload file in s3"""
+    """Upload file in s3 (off the event loop), returns its key and presigned url"""
     date_today = date.today().isoformat()
     filename = filepath.split("/")[-1]
-    async with aiofiles.open(filepath, "rb") as f:
-        contents = await f.read()
+    key = f"textextraction/{date_today}/{textextraction_id}/images/{filename}"
+    presigned_url = await asyncio.to_thread(_upload_image_s3, filepath, bucket_name, key, s3_client)
+    return key, presigned_url
+
+
+async def presign_s3_key(bucket_name: str, key: str, s3_client):
+    """Presigned url of an uploaded file"""
+    return await asyncio.to_thread(
+        generate_presigned_url, bucket_name=bucket_name, key=key, s3_client=s3_client
+    )
+
+
+def _upload_image_s3(filepath: str, bucket_name: str, key: str, s3_client):
+    """Uploads the image and returns its presigned url"""
+    with open(filepath, "rb") as f:
         s3_client.put_object(
             Bucket=bucket_name,
-            Key=f"textextraction/{date_today}/{textextraction_id}/images/{filename}",
-            Body=contents,
+            Key=key,
+            Body=f,
             ContentType="image/png",
         )
     image_presigned_url = generate_presigned_url(
         bucket_name=bucket_name,
-        key=f"textextraction/{date_today}/{textextraction_id}/images/{filename}",
+        key=key,
         s3_client=s3_client,
     )
     return image_presigned_url
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+class WebSession:
+    """A web extractor (browser session behind the proxy) reused across the pages"""
+
+    def __init__(self):
+        self.extractor = None
+        self.uses = 0
+        self.expired = False
+
+    def close(self):
+        close = getattr(self.extractor, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as exc:
+                logging.warning("Could not close the web session. %s", str(exc))
+        self.extractor = None
+        self.uses = 0
+        self.expired = False
+
+
+class WebSessionPool:
+    """
+    Runs the webpage extractions off the event loop, at most `size` at a time,
+    each one on a session of the pool. The sessions are created by `factory(url)`
+    on first use (or at startup with a warm-up url) and recycled after `max_uses`
+    pages or a failure. A page taking more than `timeout` secs fails its request;
+    its session is only given back, and recycled, once the extraction returns.
+    """
+
+    def __init__(self, factory, size: int = 2, timeout: int = 120, max_uses: int = 20):
+        self.factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_uses = max(1, max_uses)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.size, thread_name_prefix="html-extraction"
+        )
+        self._sessions = asyncio.Queue()
+        for _ in range(self.size):
+            self._sessions.put_nowait(WebSession())
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._waiting = 0
+        self.sessions_created = 0
+        self.extractions_count = 0
+        self.failures_count = 0
+        self.timeouts_count = 0
+        self.total_secs = 0.0
+
+    def _extract(self, session: WebSession, url: str):
+        if session.expired or session.uses >= self.max_uses:
+            session.close()
+        if session.extractor is None:
+            session.extractor = self.factory(url)
+            with self._lock:
+                self.sessions_created += 1
+        session.uses += 1
+        try:
+            return session.extractor.extract_text(output_format="list", url=url)
+        except Exception:
+            session.close()
+            raise
+
+    def _release(self, session: WebSession, future):
+        if not future.cancelled() and future.exception():
+            with self._lock:
+                self.failures_count += 1
+        self._busy -= 1
+        self._sessions.put_nowait(session)
+
+    async def extract(self, url: str):
+        """Entries of the webpage"""
+        self._waiting += 1
+        try:
+            session = await self._sessions.get()
+        finally:
+            self._waiting -= 1
+        self._busy += 1
+        start_time = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, self._extract, session, url
+        )
+        future.add_done_callback(lambda f: self._release(session, f))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts_count += 1
+            session.expired = True
+            raise
+        finally:
+            self.extractions_count += 1
+            self.total_secs += time.perf_counter() - start_time
+
+    async def _warm_up(self, session: WebSession, url: str):
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._extract, session, url
+            )
+        except Exception as exc:
+            logging.warning("Could not warm up the web session. %s", str(exc))
+
+    async def start(self, warm_up_url: str = None):
+        """Opens the sessions of the pool with the warm-up page, if given"""
+        if not warm_up_url:
+            return
+        start_time = time.perf_counter()
+        sessions = [self._sessions.get_nowait() for _ in range(self._sessions.qsize())]
+        try:
+            await asyncio.gather(*[self._warm_up(session, warm_up_url) for session in sessions])
+        finally:
+            for session in sessions:
+                self._sessions.put_nowait(session)
+        logging.info(
+            "Started %s web sessions in %.2f secs", len(sessions), time.perf_counter() - start_time
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        while not self._sessions.empty():
+            self._sessions.get_nowait().close()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "busy": self._busy,
+            "waiting": self._waiting,
+            "utilisation": round(self._busy / self.size, 2),
+            "sessions_created": self.sessions_created,
+            "extractions": self.extractions_count,
+            "failures": self.failures_count,
+            "timeouts": self.timeouts_count,
+            "avg_extraction_secs": (
+                round(self.total_secs / self.extractions_count, 3)
+                if self.extractions_count
+                else None
+            ),
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import metric_datum, module_dimensions, put_metric_data
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+class WebpageCache:
+    """
+    In memory LRU cache of the webpage extractions by url, kept with the ETag and
+    Last-Modified validators of the page. A repeated url is fetched with a
+    conditional GET and its cached entries are reused on a 304, so the page is
+    not rendered again. Pages without validators are not cached, entries older
+    than ttl secs are dropped, and the least recently used entries are evicted
+    above max_entries or max_bytes (size of the entries as json).
+    """
+
+    def __init__(self, max_entries: int = 500, max_bytes: int = 64 * 1024 * 1024, ttl: int = 86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._pages = OrderedDict()
+        self.total_bytes = 0
+        self.hits_count = 0
+        self.misses_count = 0
+        self.changed_count = 0
+        self.evictions_count = 0
+        self.expirations_count = 0
+
+    def _remove(self, url: str):
+        page = self._pages.pop(url)
+        self.total_bytes -= page["size"]
+
+    def get(self, url: str):
+        """Cached page of the url, None if it is missing or expired"""
+        page = self._pages.get(url)
+        if page is None:
+            return None
+        if time.monotonic() - page["stored_at"] > self.ttl:
+            self._remove(url)
+            self.expirations_count += 1
+            return None
+        self._pages.move_to_end(url)
+        return page
+
+    @staticmethod
+    def conditional_headers(page):
+        """If-None-Match / If-Modified-Since headers to revalidate the cached page"""
+        if not page:
+            return {}
+        headers = {}
+        if page["validators"].get("etag"):
+            headers["If-None-Match"] = page["validators"]["etag"]
+        if page["validators"].get("last_modified"):
+            headers["If-Modified-Since"] = page["validators"]["last_modified"]
+        return headers
+
+    def hit(self, page):
+        """The page was not modified, returns its cached entries"""
+        self.hits_count += 1
+        return page["entries"]
+
+    def put(self, url: str, validators: dict, entries: list):
+        """Caches the entries of a rendered page (a miss)"""
+        self.misses_count += 1
+        if url in self._pages:
+            self._remove(url)
+            self.changed_count += 1
+        if not validators:
+            return
+        size = len(json.dumps(entries))
+        if size > self.max_bytes:
+            return
+        self._pages[url] = {
+            "validators": validators,
+            "entries": entries,
+            "size": size,
+            "stored_at": time.monotonic(),
+        }
+        self.total_bytes += size
+        while len(self._pages) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self._pages)))
+            self.evictions_count += 1
+
+    def hit_rate(self):
+        lookups = self.hits_count + self.misses_count
+        return round(self.hits_count / lookups, 3) if lookups else None
+
+    def stats(self):
+        return {
+            "pages": len(self._pages),
+            "size_bytes": self.total_bytes,
+            "hits": self.hits_count,
+            "misses": self.misses_count,
+            "hit_rate": self.hit_rate(),
+            "changed": self.changed_count,
+            "evictions": self.evictions_count,
+            "expirations": self.expirations_count,
+        }
+
+    async def publish_metrics(self, cw_client, namespace: str, environment: str, interval: int = 60):
+        """Publishes the hits and misses of every interval, runs forever"""
+        hits_count, misses_count = self.hits_count, self.misses_count
+        while True:
+            await asyncio.sleep(interval)
+            hits = self.hits_count - hits_count
+            misses = self.misses_count - misses_count
+            hits_count, misses_count = self.hits_count, self.misses_count
+            if not hits + misses:
+                continue
+            dimensions = module_dimensions(environment)
+            await put_metric_data(
+                cw_client,
+                namespace,
+                [
+                    metric_datum(metric_name, metric_value, dimensions)
+                    for metric_name, metric_value in (
+                        ("webpage_cache_hits", hits),
+                        ("webpage_cache_misses", misses),
+                        ("webpage_cache_hit_rate", round(hits / (hits + misses), 3)),
+                    )
+                ],
+            )
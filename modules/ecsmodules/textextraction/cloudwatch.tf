@@ -74,4 +74,20 @@ resource "aws_cloudwatch_metric_alarm" "memory_low" {
     ServiceName = aws_ecs_service.service.name
   }
   alarm_actions = [aws_appautoscaling_policy.scale_down_policy.arn]
-}
\ No newline at end of file
+}
+# Backlog of the in-process scheduler (published by the tasks every minute)
+resource "aws_cloudwatch_metric_alarm" "queue_depth_high" {
+  alarm_name          = "te-queue-depth-high-${var.environment}"
+  comparison_operator = "GreaterThanOrEqualToThreshold"
+  evaluation_periods  = var.evaluation_period_max
+  metric_name         = "QueuedJobs"
+  namespace           = "TextExtraction"
+  period              = 60
+  statistic           = "Average"
+  threshold           = var.textextraction_max_queued_jobs_target_value
+  treat_missing_data  = "notBreaching"
+  dimensions = {
+    Environment = var.environment
+  }
+  alarm_actions = [aws_appautoscaling_policy.scale_up_policy.arn]
+}
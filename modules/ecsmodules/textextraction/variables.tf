@@ -90,6 +90,10 @@ variable "textextraction_min_mem_target_value" {
   default = 40
 }
 
+variable "textextraction_max_queued_jobs_target_value" {
+  default = 5
+}
+
 variable "monitoring_period" {
   default = 30
 }